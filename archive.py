@@ -0,0 +1,458 @@
+import argparse
+import csv
+import datetime
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+import log_config
+from match_table import normalize_name
+from util import Match, Player
+
+FILENAME = os.path.basename(__file__)
+
+run_timestamp = datetime.datetime.now()
+
+DEFAULT_DB = "archive.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+  id INTEGER PRIMARY KEY,
+  platform TEXT NOT NULL,
+  tid TEXT NOT NULL,
+  name TEXT,
+  date TEXT,
+  ingested_at TEXT NOT NULL,
+  UNIQUE (platform, tid)
+);
+
+CREATE TABLE IF NOT EXISTS players (
+  id INTEGER PRIMARY KEY,
+  platform TEXT NOT NULL,
+  pid TEXT,
+  discord TEXT,
+  name TEXT,
+  name_key TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS matches (
+  id INTEGER PRIMARY KEY,
+  event_id INTEGER NOT NULL REFERENCES events (id) ON DELETE CASCADE,
+  round INTEGER NOT NULL,
+  table_number TEXT,
+  winner_id INTEGER NOT NULL REFERENCES players (id),
+  loser_id INTEGER NOT NULL REFERENCES players (id),
+  winner_wins INTEGER NOT NULL,
+  loser_wins INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS games (
+  id INTEGER PRIMARY KEY,
+  match_id INTEGER NOT NULL REFERENCES matches (id) ON DELETE CASCADE,
+  game_number INTEGER NOT NULL,
+  winner_id INTEGER NOT NULL REFERENCES players (id),
+  loser_id INTEGER NOT NULL REFERENCES players (id)
+);
+
+CREATE TABLE IF NOT EXISTS rankings (
+  event_id INTEGER NOT NULL REFERENCES events (id) ON DELETE CASCADE,
+  player_id INTEGER NOT NULL REFERENCES players (id),
+  ranking INTEGER,
+  PRIMARY KEY (event_id, player_id)
+);
+
+CREATE INDEX IF NOT EXISTS players_pid ON players (platform, pid);
+CREATE INDEX IF NOT EXISTS players_discord ON players (discord);
+CREATE INDEX IF NOT EXISTS players_name ON players (platform, name_key);
+CREATE INDEX IF NOT EXISTS matches_event_round ON matches (event_id, round);
+CREATE INDEX IF NOT EXISTS matches_winner ON matches (winner_id);
+CREATE INDEX IF NOT EXISTS matches_loser ON matches (loser_id);
+CREATE INDEX IF NOT EXISTS games_match ON games (match_id);
+CREATE INDEX IF NOT EXISTS rankings_player ON rankings (player_id);
+"""
+
+MATCH_QUERY = """
+SELECT e.platform, e.tid, e.date, m.round, m.table_number,
+       w.name, l.name, w.pid, l.pid, m.winner_wins, m.loser_wins
+FROM matches m
+JOIN events e ON e.id = m.event_id
+JOIN players w ON w.id = m.winner_id
+JOIN players l ON l.id = m.loser_id
+"""
+
+MATCH_COLUMNS = [
+    "platform", "tid", "date", "round", "table", "winner", "loser",
+    "winner_pid", "loser_pid", "winner_wins", "loser_wins"
+]
+
+parser = argparse.ArgumentParser(
+    description="an sqlite archive of scraped events")
+parser.add_argument('--db', type=str, default=DEFAULT_DB)
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+ingest_parser = subparsers.add_parser(
+    'ingest', help="load an event's csv output into the archive")
+ingest_parser.add_argument('--input', type=str, default=".")
+ingest_parser.add_argument('--platform',
+                           choices=["rk9", "bcp", "battlefy"],
+                           required=True)
+ingest_parser.add_argument('--tid', type=str, required=True)
+ingest_parser.add_argument('--name', type=str)
+ingest_parser.add_argument('--date', type=str, help="YYYY-MM-DD")
+
+subparsers.add_parser('events', help="list archived events")
+
+player_parser = subparsers.add_parser('player', help="a player's matches")
+player_group = player_parser.add_mutually_exclusive_group(required=True)
+player_group.add_argument('--pid', type=str)
+player_group.add_argument('--discord', type=str)
+player_group.add_argument('--name', type=str)
+player_parser.add_argument('--platform', type=str)
+player_parser.add_argument('--since', type=str, help="YYYY-MM-DD")
+
+h2h_parser = subparsers.add_parser('h2h', help="matches between two players")
+h2h_parser.add_argument('--pid', type=str, nargs=2, required=True)
+h2h_parser.add_argument('--platform', type=str)
+
+rankings_parser = subparsers.add_parser('rankings',
+                                        help="an event's final standings")
+rankings_parser.add_argument('--platform', type=str, required=True)
+rankings_parser.add_argument('--tid', type=str, required=True)
+log_config.add_arguments(parser)
+
+logger = logging.getLogger(__name__)
+
+
+def log(msg, print_dest="stderr"):
+  logger.info(msg)
+
+  if print_dest == "stderr":
+    print(msg, file=sys.stderr)
+
+  if print_dest == "stdout":
+    print(msg)
+
+
+class Archive:
+  """
+  Events, players, matches, games and rankings from many scrapes in one
+  sqlite database. Players are shared across a platform's events, found by
+  pid, then discord, then normalized name, the same way
+  match_table.PlayerRegistry does it.
+  """
+
+  def __init__(self, path=DEFAULT_DB):
+    self.path = path
+    self.conn = sqlite3.connect(path)
+    self.conn.execute("PRAGMA foreign_keys = ON")
+    self.conn.execute("PRAGMA journal_mode = WAL")
+    self.conn.execute("PRAGMA synchronous = NORMAL")
+    self.conn.executescript(SCHEMA)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def close(self):
+    self.conn.close()
+
+  def find_player(self, platform, name=None, pid=None, discord=None):
+    if pid:
+      sql = "SELECT id FROM players WHERE platform = ? AND pid = ?"
+      row = self.conn.execute(sql, (platform, pid)).fetchone()
+      if row:
+        return row[0]
+
+    # a discord or name match only counts if it isn't someone with another
+    # pid, so a player first seen without a pid keeps their row once one
+    # turns up, but two players sharing a name never merge
+    compatible = "(? IS NULL OR pid IS NULL OR pid = ?)"
+    pid = pid or None
+    if discord:
+      sql = ("SELECT id FROM players WHERE platform = ? AND discord = ? "
+             f"AND {compatible} ORDER BY id LIMIT 1")
+      row = self.conn.execute(sql, (platform, discord, pid, pid)).fetchone()
+      if row:
+        return row[0]
+
+    sql = ("SELECT id FROM players WHERE platform = ? AND name_key = ? "
+           f"AND {compatible} ORDER BY id LIMIT 1")
+    row = self.conn.execute(
+        sql, (platform, normalize_name(name), pid, pid)).fetchone()
+    return row[0] if row else None
+
+  def intern_player(self, platform, name, pid=None, discord=None):
+    player_id = self.find_player(platform, name, pid=pid, discord=discord)
+
+    if player_id is None:
+      cursor = self.conn.execute(
+          "INSERT INTO players (platform, pid, discord, name, name_key) "
+          "VALUES (?, ?, ?, ?, ?)",
+          (platform, pid, discord, name, normalize_name(name)))
+      return cursor.lastrowid
+
+    # fill in whatever this sighting knows that earlier ones didn't
+    self.conn.execute(
+        "UPDATE players SET pid = coalesce(pid, ?), "
+        "discord = coalesce(discord, ?) WHERE id = ?",
+        (pid or None, discord or None, player_id))
+    return player_id
+
+  def ingest_event(self,
+                   platform,
+                   tid,
+                   matches,
+                   players=None,
+                   name=None,
+                   date=None):
+    """
+    Replaces the archived copy of an event with `matches` (util.Match) and,
+    if given, `players` (util.Player rankings), in a single transaction.
+    Returns the number of matches stored.
+    """
+
+    with self.conn:
+      self.conn.execute("DELETE FROM events WHERE platform = ? AND tid = ?",
+                        (platform, tid))
+      cursor = self.conn.execute(
+          "INSERT INTO events (platform, tid, name, date, ingested_at) "
+          "VALUES (?, ?, ?, ?, ?)",
+          (platform, tid, name, date,
+           datetime.datetime.now().isoformat(timespec="seconds")))
+      event_id = cursor.lastrowid
+
+      # interning hits the database, so only do it once per player sighting
+      interned = {}
+
+      def intern(name, pid, discord):
+        key = (name, pid, discord)
+        if key not in interned:
+          interned[key] = self.intern_player(platform, name, pid, discord)
+        return interned[key]
+
+      match_rows = []
+      for match in matches:
+        winner_id = intern(match.winner, match.winner_pid, match.winner_discord)
+        loser_id = intern(match.loser, match.loser_pid, match.loser_discord)
+        match_rows.append((event_id, int(match.round), match.table, winner_id,
+                           loser_id, match.winner_wins, match.loser_wins))
+
+      # match ids are assigned in insertion order, so the games can be laid
+      # out against them without reading each id back
+      first_id = self.conn.execute(
+          "SELECT coalesce(max(id), 0) + 1 FROM matches").fetchone()[0]
+      self.conn.executemany(
+          "INSERT INTO matches (id, event_id, round, table_number, "
+          "winner_id, loser_id, winner_wins, loser_wins) "
+          "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+          ((first_id + i,) + row for i, row in enumerate(match_rows)))
+      self.conn.executemany(
+          "INSERT INTO games (match_id, game_number, winner_id, loser_id) "
+          "VALUES (?, ?, ?, ?)", iter_game_rows(first_id, match_rows))
+
+      if players:
+        ranking_rows = {}
+        for player in players:
+          player_id = intern(player.name, player.player_id, player.discord)
+          ranking_rows[player_id] = (event_id, player_id,
+                                     to_ranking(player.ranking))
+        self.conn.executemany(
+            "INSERT INTO rankings (event_id, player_id, ranking) "
+            "VALUES (?, ?, ?)", ranking_rows.values())
+
+    return len(match_rows)
+
+  def events(self):
+    return self.conn.execute(
+        "SELECT e.platform, e.tid, e.name, e.date, count(m.id) "
+        "FROM events e LEFT JOIN matches m ON m.event_id = e.id "
+        "GROUP BY e.id ORDER BY e.date, e.platform, e.tid").fetchall()
+
+  def player_ids(self, pid=None, discord=None, name=None, platform=None):
+    if pid:
+      where, value = "pid = ?", pid
+    elif discord:
+      where, value = "discord = ?", discord
+    else:
+      where, value = "name_key = ?", normalize_name(name)
+
+    sql = f"SELECT id FROM players WHERE {where}"
+    params = [value]
+    if platform:
+      sql += " AND platform = ?"
+      params.append(platform)
+    return [row[0] for row in self.conn.execute(sql, params)]
+
+  def player_matches(self,
+                     pid=None,
+                     discord=None,
+                     name=None,
+                     platform=None,
+                     since=None):
+    ids = self.player_ids(pid, discord, name, platform)
+    if not ids:
+      return []
+
+    marks = ", ".join("?" * len(ids))
+    # two indexed lookups beat one OR across winner_id and loser_id
+    sql = (f"{MATCH_QUERY} WHERE m.winner_id IN ({marks}) {{since}} UNION ALL "
+           f"{MATCH_QUERY} WHERE m.loser_id IN ({marks}) {{since}} "
+           f"ORDER BY 3, 1, 2, 4")
+    params = list(ids)
+    if since:
+      sql = sql.format(since="AND e.date >= ?")
+      params.append(since)
+    else:
+      sql = sql.format(since="")
+    return self.conn.execute(sql, params * 2).fetchall()
+
+  def head_to_head(self, pid_a, pid_b, platform=None):
+    ids_a = self.player_ids(pid=pid_a, platform=platform)
+    ids_b = self.player_ids(pid=pid_b, platform=platform)
+    if not ids_a or not ids_b:
+      return []
+
+    marks_a = ", ".join("?" * len(ids_a))
+    marks_b = ", ".join("?" * len(ids_b))
+    sql = (f"{MATCH_QUERY} "
+           f"WHERE (m.winner_id IN ({marks_a}) AND m.loser_id IN ({marks_b})) "
+           f"OR (m.winner_id IN ({marks_b}) AND m.loser_id IN ({marks_a})) "
+           f"ORDER BY 3, 1, 2, 4")
+    return self.conn.execute(sql, ids_a + ids_b + ids_b + ids_a).fetchall()
+
+  def event_rankings(self, platform, tid):
+    return self.conn.execute(
+        "SELECT r.ranking, p.name, p.pid, p.discord FROM rankings r "
+        "JOIN events e ON e.id = r.event_id "
+        "JOIN players p ON p.id = r.player_id "
+        "WHERE e.platform = ? AND e.tid = ? ORDER BY r.ranking",
+        (platform, tid)).fetchall()
+
+
+def iter_game_rows(first_match_id, match_rows):
+  for i, (_, _, _, winner_id, loser_id, winner_wins,
+          loser_wins) in enumerate(match_rows):
+    match_id = first_match_id + i
+    game_number = 0
+    for _ in range(winner_wins):
+      game_number += 1
+      yield match_id, game_number, winner_id, loser_id
+    for _ in range(loser_wins):
+      game_number += 1
+      yield match_id, game_number, loser_id, winner_id
+
+
+def to_ranking(value):
+  try:
+    return int(value)
+  except (TypeError, ValueError):
+    return None
+
+
+def empty_to_none(value):
+  return value if value != '' else None
+
+
+def read_csv_event(input_dir, platform, tid):
+  """
+  Rebuilds (matches, players) from the csvs scrape_matches and
+  scrape_rankings wrote for an event. Win counts come from the games csv if
+  there is one; players is None without a rankings csv.
+  """
+
+  base_path = os.path.join(input_dir, f"{platform}_{tid}")
+
+  wins = {}
+  try:
+    with open(f"{base_path}_games.csv", newline='') as f:
+      for row in csv.DictReader(f):
+        key = (row["round"], row["table"], row["winner"], row["loser"])
+        wins[key] = wins.get(key, 0) + 1
+  except FileNotFoundError:
+    pass
+
+  matches = []
+  with open(f"{base_path}_matches.csv", newline='') as f:
+    for row in csv.DictReader(f):
+      key = (row["round"], row["table"], row["winner"], row["loser"])
+      reverse = (row["round"], row["table"], row["loser"], row["winner"])
+      matches.append(
+          Match(row["winner"],
+                row["loser"],
+                row["table"],
+                row["round"],
+                winner_wins=wins.get(key, 0),
+                loser_wins=wins.get(reverse, 0),
+                winner_pid=empty_to_none(row["winner_pid"]),
+                loser_pid=empty_to_none(row["loser_pid"]),
+                winner_discord=empty_to_none(row["winner_discord"]),
+                loser_discord=empty_to_none(row["loser_discord"])))
+
+  players = None
+  try:
+    with open(f"{base_path}_rankings.csv", newline='') as f:
+      players = [
+          Player(row["name"],
+                 row["ranking"],
+                 player_id=empty_to_none(row["player_id"]),
+                 discord=empty_to_none(row["discord"]))
+          for row in csv.DictReader(f)
+      ]
+  except FileNotFoundError:
+    pass
+
+  return matches, players
+
+
+def write_rows(columns, rows):
+  writer = csv.writer(sys.stdout)
+  writer.writerow(columns)
+  writer.writerows(rows)
+
+
+def main():
+  args = parser.parse_args()
+
+  log_dir = os.path.dirname(os.path.abspath(args.db))
+  log_config.configure(log_config.log_path(log_dir, FILENAME),
+                       level=args.log_level)
+
+  with Archive(args.db) as archive:
+    start = time.perf_counter()
+
+    if args.command == "ingest":
+      matches, players = read_csv_event(args.input, args.platform, args.tid)
+      count = archive.ingest_event(args.platform,
+                                   args.tid,
+                                   matches,
+                                   players=players,
+                                   name=args.name,
+                                   date=args.date)
+      log(f"archived {count} matches for {args.platform} {args.tid}")
+    elif args.command == "events":
+      write_rows(["platform", "tid", "name", "date", "matches"],
+                 archive.events())
+    elif args.command == "player":
+      write_rows(
+          MATCH_COLUMNS,
+          archive.player_matches(pid=args.pid,
+                                 discord=args.discord,
+                                 name=args.name,
+                                 platform=args.platform,
+                                 since=args.since))
+    elif args.command == "h2h":
+      write_rows(MATCH_COLUMNS,
+                 archive.head_to_head(*args.pid, platform=args.platform))
+    elif args.command == "rankings":
+      write_rows(["ranking", "name", "player_id", "discord"],
+                 archive.event_rankings(args.platform, args.tid))
+
+    log(f"{args.command} took {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,28 +1,23 @@
-import datetime
+import concurrent.futures
 import logging
-import os
 import sys
+import urllib.parse
 
-import requests
-
+import http_cache
+import log_config
+import metrics
+import throttle
 from util import Match, Player
 
-run_timestamp = datetime.datetime.now()
-
-FILENAME = os.path.basename(__file__)
-FILEDIR = os.path.dirname(__file__)
-
-BATTLEFY_RANKINGS_URL = "https://dtmwra1jsgyb0.cloudfront.net/stages/{event_id}/latest-round-standings"
-BATTLEFY_PAIRINGS_URL = "https://dtmwra1jsgyb0.cloudfront.net/stages/{event_id}/matches"
+BATTLEFY_BASE_URL = "https://dtmwra1jsgyb0.cloudfront.net"
+BATTLEFY_RANKINGS_URL = (f"{BATTLEFY_BASE_URL}/stages/{{event_id}}"
+                         f"/latest-round-standings")
+BATTLEFY_PAIRINGS_URL = f"{BATTLEFY_BASE_URL}/stages/{{event_id}}/matches"
 
-log_dir = os.path.join(FILEDIR, "logs")
-log_name = f"{FILENAME}-{run_timestamp:%Y%m%d}.log"
-log_path = os.path.join(log_dir, log_name)
+MAX_ROUNDS = 19
 
-logging.basicConfig(format='[%(asctime)s] %(message)s',
-                    filename=log_path,
-                    level=logging.DEBUG)
-logger = logging.getLogger()
+logger = logging.getLogger(__name__)
+parse_failures = log_config.RateLimited(logger)
 
 
 def log(msg, print_dest="stderr"):
@@ -35,9 +30,26 @@ def log(msg, print_dest="stderr"):
     print(msg)
 
 
+def configure(base_url=BATTLEFY_BASE_URL):
+  """
+  Sends api requests to base_url instead of battlefy's, e.g. to
+  benchmarks/mock_server.py.
+  """
+
+  global BATTLEFY_RANKINGS_URL, BATTLEFY_PAIRINGS_URL
+  base_url = base_url.rstrip("/")
+  BATTLEFY_RANKINGS_URL = (f"{base_url}/stages/{{event_id}}"
+                           f"/latest-round-standings")
+  BATTLEFY_PAIRINGS_URL = f"{base_url}/stages/{{event_id}}/matches"
+  # --hedge follows the api wherever it's served from
+  throttle.HEDGE_HOSTS = {urllib.parse.urlparse(BATTLEFY_PAIRINGS_URL).netloc}
+
+
 def get_all_rankings_data(event_id):
-  response = requests.get(BATTLEFY_RANKINGS_URL.format(event_id=event_id))
-  data = response.json()
+  with metrics.phase("battlefy.fetch"):
+    response = http_cache.get(BATTLEFY_RANKINGS_URL.format(event_id=event_id))
+  with metrics.phase("battlefy.decode"):
+    data = response.json()
 
   return data
 
@@ -45,9 +57,11 @@ def get_all_rankings_data(event_id):
 def get_all_match_data(event_id, round):
   params = {"roundNumber": round}
 
-  response = requests.get(BATTLEFY_PAIRINGS_URL.format(event_id=event_id),
-                          params=params)
-  data = response.json()
+  with metrics.phase("battlefy.fetch"):
+    response = http_cache.get(BATTLEFY_PAIRINGS_URL.format(event_id=event_id),
+                              params=params)
+  with metrics.phase("battlefy.decode"):
+    data = response.json()
   return data
 
 
@@ -61,6 +75,13 @@ def player_for_player_data(player_data, ranking):
 def get_rankings(eventID):
   players_data = get_all_rankings_data(eventID)
 
+  with metrics.phase("battlefy.rankings") as phase:
+    players = get_players_for_data(players_data)
+    phase.rows = len(players)
+  return players
+
+
+def get_players_for_data(players_data):
   dnf_player_data = []
   ranked_player_data = []
 
@@ -94,7 +115,7 @@ def match_for_match_data(match_data, prior_rounds_match_count):
   if isBye:
     return None
   elif not p1Name or not p2Name:
-    log(f"missing player name: {match_data}", print_dest=None)
+    parse_failures.warning("missing player name: %s", match_data)
     return None
 
   p1Win = match_data["top"].get("winner", False)
@@ -127,21 +148,77 @@ def match_for_match_data(match_data, prior_rounds_match_count):
                loser_pid=loser_pid)
 
 
-def get_all_matches(event_id):
-  matches = []
-  prior_rounds_match_count = 0
-
-  for round in range(1, 20):
+def iter_round_match_data(event_id):
+  for round in range(1, MAX_ROUNDS + 1):
     new_match_data = get_all_match_data(event_id, round)
     if new_match_data:
-      matches.extend([
-          match_for_match_data(match, prior_rounds_match_count)
-          for match in new_match_data
-      ])
-      prior_rounds_match_count += len(new_match_data)
+      yield new_match_data
     else:
       break
 
+
+def iter_round_match_data_concurrent(event_id, concurrency):
+  """
+  Fetches every round up to MAX_ROUNDS at once, at most `concurrency` in
+  flight, and yields them in order. Rounds past the end of the event are
+  probed speculatively, and whatever hasn't started by the time the first
+  empty round comes back is cancelled. Results are taken in round order, so
+  an error is only raised for a round the sequential scrape would have
+  fetched; errors from rounds past the end of the event are logged.
+  """
+
+  with concurrent.futures.ThreadPoolExecutor(
+      max_workers=concurrency) as executor:
+    futures = [
+        executor.submit(get_all_match_data, event_id, round)
+        for round in range(1, MAX_ROUNDS + 1)
+    ]
+
+    try:
+      for round, future in enumerate(futures, 1):
+        with metrics.phase("battlefy.wait"):
+          new_match_data = future.result()
+        if new_match_data:
+          yield new_match_data
+        else:
+          break
+    finally:
+      for future in futures:
+        future.cancel()
+
+  for later_round, future in enumerate(futures[round:], round + 1):
+    if not future.cancelled() and future.exception() is not None:
+      log(f"ignoring error for round {later_round}, past the end of the "
+          f"event: {future.exception()!r}")
+
+
+def iter_matches(event_id, concurrency=1):
+  """
+  Yields matches round by round.
+  """
+
+  if concurrency > 1:
+    rounds_data = iter_round_match_data_concurrent(event_id, concurrency)
+  else:
+    rounds_data = iter_round_match_data(event_id)
+
+  # table numbers are offsets into the event-wide match numbering, so they
+  # depend on the size of every earlier round
+  prior_rounds_match_count = 0
+
+  for new_match_data in rounds_data:
+    with metrics.phase("battlefy.convert") as phase:
+      matches = [
+          match_for_match_data(match, prior_rounds_match_count)
+          for match in new_match_data
+      ]
+      matches = [m for m in matches if m and m.is_valid_match()]
+      phase.rows = len(matches)
+    yield from matches
+    prior_rounds_match_count += len(new_match_data)
+
   log(f"done scraping")
 
-  return [m for m in matches if m and m.is_valid_match()]
+
+def get_all_matches(event_id, concurrency=1):
+  return list(iter_matches(event_id, concurrency=concurrency))
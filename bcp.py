@@ -1,28 +1,23 @@
-import datetime
+from collections import defaultdict
+import concurrent.futures
 import logging
-import os
+import queue
 import sys
 
-import requests
-
+import http_cache
+import log_config
+import metrics
 from util import Match, Player
 
-run_timestamp = datetime.datetime.now()
-
-FILENAME = os.path.basename(__file__)
-FILEDIR = os.path.dirname(__file__)
-
-BCP_RANKINGS_URL = "https://prod-api.bestcoastpairings.com/players"
-BCP_PAIRINGS_URL = "https://prod-api.bestcoastpairings.com/pairings"
+BCP_BASE_URL = "https://prod-api.bestcoastpairings.com"
+BCP_RANKINGS_URL = f"{BCP_BASE_URL}/players"
+BCP_PAIRINGS_URL = f"{BCP_BASE_URL}/pairings"
 
-log_dir = os.path.join(FILEDIR, "logs")
-log_name = f"{FILENAME}-{run_timestamp:%Y%m%d}.log"
-log_path = os.path.join(log_dir, log_name)
+MAX_ROUNDS = 19
+PAGE_LIMIT = 100
 
-logging.basicConfig(format='[%(asctime)s] %(message)s',
-                    filename=log_path,
-                    level=logging.DEBUG)
-logger = logging.getLogger()
+logger = logging.getLogger(__name__)
+parse_failures = log_config.RateLimited(logger)
 
 
 def log(msg, print_dest="stderr"):
@@ -35,6 +30,18 @@ def log(msg, print_dest="stderr"):
     print(msg)
 
 
+def configure(base_url=BCP_BASE_URL):
+  """
+  Sends api requests to base_url instead of bcp's, e.g. to
+  benchmarks/mock_server.py.
+  """
+
+  global BCP_RANKINGS_URL, BCP_PAIRINGS_URL
+  base_url = base_url.rstrip("/")
+  BCP_RANKINGS_URL = f"{base_url}/players"
+  BCP_PAIRINGS_URL = f"{base_url}/pairings"
+
+
 def get_rankings_data(client_id, event_id, limit, next_key):
   params = {
       "eventId": event_id,
@@ -48,8 +55,10 @@ def get_rankings_data(client_id, event_id, limit, next_key):
   if next_key:
     params["nextKey"] = next_key
 
-  response = requests.get(BCP_RANKINGS_URL, params=params, headers=headers)
-  data = response.json()
+  with metrics.phase("bcp.fetch"):
+    response = http_cache.get(BCP_RANKINGS_URL, params=params, headers=headers)
+  with metrics.phase("bcp.decode"):
+    data = response.json()
 
   return data
 
@@ -68,8 +77,10 @@ def get_match_data(client_id, event_id, round, limit, next_key):
   if next_key:
     params["nextKey"] = next_key
 
-  response = requests.get(BCP_PAIRINGS_URL, params=params, headers=headers)
-  data = response.json()
+  with metrics.phase("bcp.fetch"):
+    response = http_cache.get(BCP_PAIRINGS_URL, params=params, headers=headers)
+  with metrics.phase("bcp.decode"):
+    data = response.json()
 
   return data
 
@@ -90,8 +101,11 @@ def get_data(type, client_id, event_id, limit, round=None, next_key=None):
     raise Exception(f"unknown type: {type}")
 
 
-def get_paginated_data(type, client_id, event_id, round=None):
+def iter_paginated_data(type, client_id, event_id, round=None):
   """
+  Yields each page of items as it arrives, following nextKey until a short
+  or empty page.
+
   Valid types: 
     - "rankings"
     - "matches"
@@ -103,7 +117,7 @@ def get_paginated_data(type, client_id, event_id, round=None):
     log(f"=== scraping {type}")
 
   part = 1
-  limit = 100
+  limit = PAGE_LIMIT
   next_key = None
   last_items = []
 
@@ -114,7 +128,9 @@ def get_paginated_data(type, client_id, event_id, round=None):
   log(f"  > found {len(items)} {type}")
 
   if not items:
-    return []
+    return
+
+  yield items
 
   if len(items) >= limit:
     next_key = data.get("nextKey")
@@ -139,7 +155,7 @@ def get_paginated_data(type, client_id, event_id, round=None):
     if len(new_items) == len(last_items) and new_items == last_items:
       raise Exception("infinite loop detected")
 
-    items.extend(new_items)
+    yield new_items
 
     if len(new_items) >= limit:
       new_next_key = data.get("nextKey")
@@ -152,6 +168,21 @@ def get_paginated_data(type, client_id, event_id, round=None):
 
     last_items = new_items
 
+
+def get_paginated_data(type, client_id, event_id, round=None):
+  """
+  Valid types: 
+    - "rankings"
+    - "matches"
+  """
+
+  items = []
+  for page in iter_paginated_data(type, client_id, event_id, round=round):
+    items.extend(page)
+
+  if not items:
+    return []
+
   if round:
     log(f"--- found {len(items)} {type} for round {round}")
   else:
@@ -190,8 +221,11 @@ def player_for_player_data(player_data):
 
 def get_rankings(client_id, eventID):
   players_data = get_all_rankings_data(client_id, eventID)
-  players = [player_for_player_data(p_data) for p_data in players_data]
-  return [p for p in players if p]
+  with metrics.phase("bcp.rankings") as phase:
+    players = [player_for_player_data(p_data) for p_data in players_data]
+    players = [p for p in players if p]
+    phase.rows = len(players)
+  return players
 
 
 def match_for_match_data(match_data):
@@ -199,7 +233,7 @@ def match_for_match_data(match_data):
   round = match_data["round"]
   metadata = match_data.get("metaData")
   if not metadata:
-    log(f"no metadata for match: {match_data}")
+    parse_failures.warning("no metadata for match: %s", match_data)
     return None
   p1Name = "{} {}".format(metadata["p1-firstName"], metadata["p1-lastName"])
   p2Name = "{} {}".format(metadata["p2-firstName"], metadata["p2-lastName"])
@@ -228,17 +262,163 @@ def match_for_match_data(match_data):
                loser_pid=loser_pid)
 
 
-def get_all_matches(client_id, event_id):
-  match_data = []
+def iter_matches(client_id, event_id, concurrency=1):
+  """
+  Yields matches round by round, each round sorted by table.
+  """
+
+  if concurrency > 1:
+    for type, items in iter_event_concurrent(client_id, event_id, concurrency):
+      yield from items
+    log(f"done scraping")
+    return
 
-  for round in range(1, 20):
+  for round in range(1, MAX_ROUNDS + 1):
     new_matches = get_all_match_data(client_id, event_id, round)
-    if new_matches:
-      match_data.extend(new_matches)
-    else:
+    if not new_matches:
       break
 
+    with metrics.phase("bcp.convert") as phase:
+      matches = [match_for_match_data(match) for match in new_matches]
+      matches = [m for m in matches if m and m.is_valid_match()]
+      phase.rows = len(matches)
+    yield from matches
+
+  log(f"done scraping")
+
+
+def get_all_matches(client_id, event_id, concurrency=1):
+  return list(iter_matches(client_id, event_id, concurrency=concurrency))
+
+
+def get_matches_and_rankings(client_id, event_id, concurrency=1):
+  if concurrency > 1:
+    return get_event_concurrent(client_id, event_id, concurrency, rankings=True)
+
+  return (get_all_matches(client_id,
+                          event_id), get_rankings(client_id, event_id))
+
+
+def iter_event_concurrent(client_id, event_id, concurrency, rankings=False):
+  """
+  Paginates every round (and optionally the rankings) in parallel, with at
+  most `concurrency` requests in flight. Worker threads put pages on a queue
+  and this thread converts them to matches as they arrive.
+
+  Yields ("matches", matches) for each round in order, as soon as it and all
+  earlier rounds are complete, and ("rankings", players) once the rankings
+  are.
+
+  Rounds are probed speculatively up to MAX_ROUNDS; once a round comes back
+  empty, later rounds that haven't started are cancelled and any that did
+  return data are dropped, same as the sequential scrape. An error fetching
+  a round is raised when the rounds before it are complete, as it would be
+  sequentially; errors from rounds past the end of the event are only
+  logged.
+  """
+
+  pages = queue.Queue()
+
+  def produce(type, round=None):
+    try:
+      for page in iter_paginated_data(type, client_id, event_id, round=round):
+        pages.put((type, round, page))
+    finally:
+      pages.put((type, round, None))
+
+  matches_by_round = defaultdict(list)
+  players_data = []
+  empty_rounds = set(range(1, MAX_ROUNDS + 1))
+  done_rounds = set()
+  errors = {}
+  next_round = 1
+
+  with concurrent.futures.ThreadPoolExecutor(
+      max_workers=concurrency) as executor:
+    futures = {}
+    if rankings:
+      futures[None] = executor.submit(produce, "rankings")
+    for round in range(1, MAX_ROUNDS + 1):
+      futures[round] = executor.submit(produce, "matches", round)
+
+    pending = len(futures)
+    while pending:
+      with metrics.phase("bcp.wait"):
+        type, round, page = pages.get()
+
+      if page is not None:
+        if type == "rankings":
+          players_data.extend(page)
+          continue
+
+        empty_rounds.discard(round)
+        with metrics.phase("bcp.convert") as phase:
+          round_matches = matches_by_round[round]
+          before = len(round_matches)
+          for match_data in page:
+            match = match_for_match_data(match_data)
+            if match and match.is_valid_match():
+              round_matches.append(match)
+          phase.rows = len(round_matches) - before
+        continue
+
+      pending -= 1
+
+      if type == "rankings":
+        # surfaces any error from the worker (e.g. infinite loop detection)
+        futures[None].result()
+        with metrics.phase("bcp.rankings") as phase:
+          players_data.sort(key=lambda p: p["placing"])
+          players = [player_for_player_data(p_data) for p_data in players_data]
+          players = [p for p in players if p]
+          phase.rows = len(players)
+        yield "rankings", players
+        continue
+
+      done_rounds.add(round)
+      error = futures[round].exception()
+      if error is not None:
+        errors[round] = error
+      elif round in empty_rounds:
+        for later_round in range(round + 1, MAX_ROUNDS + 1):
+          future = futures[later_round]
+          if not future.cancelled() and future.cancel():
+            pending -= 1
+
+      while next_round in done_rounds:
+        if next_round in errors:
+          raise errors[next_round]
+        if next_round in empty_rounds:
+          break
+        round_matches = matches_by_round.pop(next_round)
+        round_matches.sort(key=lambda m: m.table)
+        log(f"--- found {len(round_matches)} matches for round {next_round}")
+        yield "matches", round_matches
+        next_round += 1
+
+  # only rounds past the first empty one are left; the event had ended
+  for round, error in sorted(errors.items()):
+    log(f"ignoring error for round {round}, past the end of the event: "
+        f"{error!r}")
+
+
+def get_event_concurrent(client_id, event_id, concurrency, rankings=False):
+  """
+  Returns (matches, players) from iter_event_concurrent; players is None
+  unless rankings=True.
+  """
+
+  matches = []
+  players = None
+  for type, items in iter_event_concurrent(client_id,
+                                           event_id,
+                                           concurrency,
+                                           rankings=rankings):
+    if type == "rankings":
+      players = items
+    else:
+      matches.extend(items)
+
   log(f"done scraping")
 
-  matches = [match_for_match_data(match) for match in match_data]
-  return [m for m in matches if m and m.is_valid_match()]
+  return matches, players
@@ -0,0 +1,481 @@
+"""
+Parse throughput and peak memory of each platform's parser, parse_bcp_txt
+and fill_deck_records over synthetic fixtures (see fixtures.py), with no
+network. Results are compared against benchmarks/baselines.json; --check
+exits non-zero when a benchmark is slower or bigger than its baseline by
+more than the tolerance, and --record replaces the baselines.
+
+Peak memory is tracemalloc's peak, except for the lxml benchmarks: lxml
+allocates its trees in C, where tracemalloc can't see them, so those report
+how far the process's RSS grew instead (sampled from /proc, so Linux only;
+null elsewhere).
+
+Baselines are only comparable on the machine (and at the scale) they were
+recorded on, so record new ones before relying on --check elsewhere. The
+machine is saved with them; the checked-in baselines come from a single-CPU
+machine.
+
+  python benchmarks/bench_parsers.py [--players 2000] [--rounds 9]
+      [--repeat 3] [--only rk9] [--check | --record]
+"""
+
+import argparse
+import contextlib
+import ctypes
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import battlefy
+import bcp
+import fill_deck_records
+import fixtures
+import http_cache
+import parse_bcp_txt
+import rk9
+
+BASELINES_PATH = os.path.join(BENCH_DIR, "baselines.json")
+
+DEFAULT_PLAYERS = 2000
+DEFAULT_ROUNDS = 9
+DEFAULT_REPEAT = 3
+# how much slower (throughput) or bigger (peak memory) than the baseline a
+# benchmark can get before --check fails
+DEFAULT_TOLERANCE = 0.25
+# seconds between RSS samples while an RSS benchmark runs
+RSS_INTERVAL = 0.002
+
+
+class Fixtures:
+  """
+  Every input the benchmarks read, generated once per run.
+  """
+
+  def __init__(self, num_players, num_rounds, seed=0):
+    self.divisions = fixtures.make_divisions(num_players, num_rounds, seed=seed)
+    masters = self.divisions["P2"]
+    self.num_rounds = num_rounds
+
+    self.rk9_html = fixtures.rk9_html(self.divisions)
+    self.rk9_lxml = rk9.parse_lxml(self.rk9_html)
+    self.rk9_bs4 = rk9.parse_bs4(self.rk9_html)
+
+    self.bcp_pairings = [
+        item for round in range(1, num_rounds + 1)
+        for page in fixtures.bcp_pairing_pages(masters, round)
+        for item in json.loads(json.dumps(page))["data"]
+    ]
+    self.battlefy_rounds = [
+        json.loads(json.dumps(fixtures.battlefy_round(masters, round)))
+        for round in range(1, num_rounds + 1)
+    ]
+    self.round_txts = [
+        fixtures.round_txt(masters, round)
+        for round in range(1, num_rounds + 1)
+    ]
+
+    self.tmp_dir = tempfile.mkdtemp(prefix="bench_parsers-")
+    self.event_dir = os.path.join(self.tmp_dir, "event")
+    fixtures.write_event_dir(masters, self.event_dir, seed=seed)
+
+  def close(self):
+    shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def rk9_snapshot(fx, parser):
+  url = rk9.RK9_PAIRINGS_URL.format("bench")
+  snapshot = rk9.EventSnapshot("bench", parser=parser)
+  snapshot.response = http_cache.Response(url,
+                                          fx.rk9_html.encode(),
+                                          encoding="utf-8")
+  return snapshot
+
+
+# each benchmark takes the fixtures and returns (setup, run): setup() is
+# untimed and its result is passed to run(), which returns the rows produced
+# (for the parse benchmarks, the one page)
+
+
+def bench_rk9_parse_lxml(fx):
+  return lambda: None, lambda _: int(rk9.parse_lxml(fx.rk9_html) is not None)
+
+
+def bench_rk9_parse_bs4(fx):
+  return lambda: None, lambda _: int(rk9.parse_bs4(fx.rk9_html) is not None)
+
+
+def bench_rk9_round_matches_lxml(fx):
+
+  def run(_):
+    rounds = rk9.get_all_round_matches_lxml(fx.rk9_lxml)
+    return sum(len(matches) for matches in rounds.values())
+
+  return lambda: None, run
+
+
+def bench_rk9_round_matches_bs4(fx):
+
+  def run(_):
+    return sum(
+        len(rk9.get_round_matches(fx.rk9_bs4, round) or ())
+        for round in range(1, fx.num_rounds + 1))
+
+  return lambda: None, run
+
+
+def bench_rk9_rankings_lxml(fx):
+  # decode, parse and standings, as EventSnapshot.get_rankings does them
+  return lambda: rk9_snapshot(fx, "lxml"), lambda s: len(s.get_rankings())
+
+
+def bench_rk9_rankings_bs4(fx):
+  return lambda: rk9_snapshot(fx, "bs4"), lambda s: len(s.get_rankings())
+
+
+def bench_rk9_divisions_lxml(fx):
+  # one parse, then every division's matches and standings, as
+  # scrape_matches --divisions does
+
+  def run(snapshot):
+    divisions = snapshot.get_divisions(rk9.DIVISIONS, rankings=True)
+    return sum(len(matches) for matches, _ in divisions.values())
+
+  return lambda: rk9_snapshot(fx, "lxml"), run
+
+
+def bench_bcp_match_for_match_data(fx):
+
+  def run(_):
+    matches = [bcp.match_for_match_data(m) for m in fx.bcp_pairings]
+    return len([m for m in matches if m and m.is_valid_match()])
+
+  return lambda: None, run
+
+
+def bench_battlefy_match_for_match_data(fx):
+
+  def run(_):
+    matches = []
+    prior = 0
+    for round_data in fx.battlefy_rounds:
+      for match_data in round_data:
+        match = battlefy.match_for_match_data(match_data, prior)
+        if match and match.is_valid_match():
+          matches.append(match)
+      prior += len(round_data)
+    return len(matches)
+
+  return lambda: None, run
+
+
+def bench_parse_bcp_txt(fx):
+
+  def run(_):
+    matches = []
+    for round, txt in enumerate(fx.round_txts, 1):
+      matches.extend(parse_bcp_txt.get_round_matches(io.StringIO(txt), round))
+    return len(matches)
+
+  return lambda: None, run
+
+
+def bench_fill_deck_records(fx):
+  # a run writes overrides the next run would read, so each gets a fresh copy
+  copies = []
+
+  def setup():
+    path = os.path.join(fx.tmp_dir, f"event-{len(copies)}")
+    shutil.copytree(fx.event_dir, path)
+    copies.append(path)
+    return path
+
+  def run(path):
+    stats = fill_deck_records.process_event(path,
+                                            interactive=False,
+                                            print_dest=None)
+    return stats["core_matches"] + stats["extra_matches"]
+
+  return setup, run
+
+
+BENCHMARKS = {
+    "rk9.parse_lxml": bench_rk9_parse_lxml,
+    "rk9.parse_bs4": bench_rk9_parse_bs4,
+    "rk9.get_round_matches_lxml": bench_rk9_round_matches_lxml,
+    "rk9.get_round_matches": bench_rk9_round_matches_bs4,
+    "rk9.get_rankings[lxml]": bench_rk9_rankings_lxml,
+    "rk9.get_rankings[bs4]": bench_rk9_rankings_bs4,
+    "rk9.get_divisions[lxml]": bench_rk9_divisions_lxml,
+    "bcp.match_for_match_data": bench_bcp_match_for_match_data,
+    "battlefy.match_for_match_data": bench_battlefy_match_for_match_data,
+    "parse_bcp_txt.get_round_matches": bench_parse_bcp_txt,
+    "fill_deck_records": bench_fill_deck_records,
+}
+
+# benchmarks whose memory is mostly lxml's, measured as RSS growth
+RSS_BENCHMARKS = {
+    "rk9.parse_lxml",
+    "rk9.get_round_matches_lxml",
+    "rk9.get_rankings[lxml]",
+    "rk9.get_divisions[lxml]",
+}
+
+
+def rss_bytes():
+  try:
+    with open("/proc/self/statm") as f:
+      return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+  except (OSError, ValueError):
+    return None
+
+
+def release_memory():
+  # hand memory freed by earlier runs back to the os, so it isn't reused
+  # without showing up as growth
+  gc.collect()
+  try:
+    ctypes.CDLL("libc.so.6").malloc_trim(0)
+  except (OSError, AttributeError):
+    pass
+
+
+def peak_rss_growth(run, arg):
+  """
+  Runs run(arg), returning the most the process's RSS grew meanwhile, or
+  None where RSS can't be read.
+  """
+
+  release_memory()
+  before = rss_bytes()
+  if before is None:
+    run(arg)
+    return None
+
+  peak = [before]
+  done = threading.Event()
+
+  def sample():
+    while not done.wait(RSS_INTERVAL):
+      peak[0] = max(peak[0], rss_bytes())
+
+  sampler = threading.Thread(target=sample, daemon=True)
+  sampler.start()
+  try:
+    run(arg)
+  finally:
+    done.set()
+    sampler.join()
+  return max(peak[0], rss_bytes()) - before
+
+
+def peak_traced(run, arg):
+  tracemalloc.start()
+  try:
+    run(arg)
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return peak
+
+
+def measure(name, bench, fx, repeat):
+  setup, run = bench(fx)
+
+  times = []
+  rows = None
+  for _ in range(repeat):
+    arg = setup()
+    start = time.perf_counter()
+    rows = run(arg)
+    times.append(time.perf_counter() - start)
+
+  # a separate run for memory, since tracing slows everything down
+  arg = setup()
+  if name in RSS_BENCHMARKS:
+    memory = "rss"
+    peak = peak_rss_growth(run, arg)
+  else:
+    memory = "tracemalloc"
+    peak = peak_traced(run, arg)
+
+  best = min(times)
+  return {
+      "rows": rows,
+      "best_seconds": round(best, 6),
+      "median_seconds": round(statistics.median(times), 6),
+      "rows_per_second": round(rows / best, 1) if best else None,
+      "peak_mb": None if peak is None else round(peak / 1024 / 1024, 2),
+      "memory": memory,
+  }
+
+
+def cpu_model():
+  try:
+    with open("/proc/cpuinfo") as f:
+      for line in f:
+        if line.startswith("model name"):
+          return line.split(":", 1)[1].strip()
+  except OSError:
+    pass
+  return platform.processor() or platform.machine()
+
+
+def memory_gb():
+  try:
+    total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+  except (ValueError, OSError, AttributeError):
+    return None
+  return round(total / 1024**3, 1)
+
+
+def machine():
+  import bs4
+  import lxml.etree
+
+  return {
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "processor": cpu_model(),
+      "cpus": os.cpu_count(),
+      "memory_gb": memory_gb(),
+      "lxml": ".".join(str(v) for v in lxml.etree.LXML_VERSION),
+      "bs4": bs4.__version__,
+  }
+
+
+def compare(name, result, baseline, tolerance):
+  """
+  Returns (note, failed) for result against its baseline entry.
+  """
+
+  if not baseline:
+    return "no baseline", False
+
+  notes = []
+  failed = False
+
+  rate, base_rate = result["rows_per_second"], baseline["rows_per_second"]
+  if rate and base_rate:
+    ratio = rate / base_rate
+    notes.append(f"{ratio:.2f}x speed")
+    if ratio < 1 - tolerance:
+      failed = True
+
+  peak, base_peak = result["peak_mb"], baseline["peak_mb"]
+  # an rss baseline says nothing about a tracemalloc peak, or vice versa
+  same_measure = result["memory"] == baseline.get("memory", "tracemalloc")
+  if peak is not None and base_peak and same_measure:
+    ratio = peak / base_peak
+    notes.append(f"{ratio:.2f}x memory")
+    if ratio > 1 + tolerance:
+      failed = True
+
+  if result["rows"] != baseline["rows"]:
+    notes.append(f"rows {baseline['rows']} -> {result['rows']}")
+    failed = True
+
+  return ", ".join(notes), failed
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--players', type=int, default=DEFAULT_PLAYERS)
+  parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+  parser.add_argument('--only',
+                      type=str,
+                      help="only run benchmarks whose name contains this")
+  parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+  parser.add_argument('--baselines', type=str, default=BASELINES_PATH)
+  mode = parser.add_mutually_exclusive_group()
+  mode.add_argument('--check',
+                    action='store_true',
+                    help="exit 1 if anything regressed past --tolerance")
+  mode.add_argument('--record',
+                    action='store_true',
+                    help="save these results as the new baselines")
+  args = parser.parse_args()
+
+  # parse failures (ties and byes) are expected; keep them off stderr
+  logging.getLogger().addHandler(logging.NullHandler())
+
+  scale = {"players": args.players, "rounds": args.rounds, "seed": args.seed}
+
+  try:
+    with open(args.baselines) as f:
+      baselines = json.load(f)
+  except FileNotFoundError:
+    baselines = {}
+
+  if baselines and baselines.get("scale") != scale:
+    print(f"baselines were recorded at {baselines.get('scale')}; "
+          f"not comparing")
+    baselines = {}
+
+  start = time.perf_counter()
+  with contextlib.redirect_stderr(io.StringIO()):
+    fx = Fixtures(args.players, args.rounds, seed=args.seed)
+  print(f"{args.players} players, {args.rounds} rounds "
+        f"({len(fx.rk9_html) / 1024 / 1024:.1f} MB of rk9 html), "
+        f"fixtures in {time.perf_counter() - start:.1f}s")
+
+  results = {}
+  failures = []
+  print(f"{'':34} {'rows':>7} {'best s':>8} {'rows/s':>11} {'peak MB':>8}")
+  try:
+    for name, bench in BENCHMARKS.items():
+      if args.only and args.only not in name:
+        continue
+
+      # the modules log their progress to stderr
+      with contextlib.redirect_stderr(io.StringIO()):
+        result = measure(name, bench, fx, args.repeat)
+      results[name] = result
+
+      note, failed = compare(name, result,
+                             baselines.get("results", {}).get(name),
+                             args.tolerance)
+      if failed:
+        failures.append(name)
+      rate = result["rows_per_second"] or 0
+      print(f"{name:34} {result['rows']:7} {result['best_seconds']:8.3f} "
+            f"{rate:11,.0f} {result['peak_mb'] or 0:8.1f}  "
+            f"{'REGRESSED ' if failed else ''}{note}")
+  finally:
+    fx.close()
+
+  if args.record:
+    recorded = {
+        "scale": scale,
+        "machine": machine(),
+        "recorded_at": time.strftime("%Y-%m-%d"),
+        "results": dict(baselines.get("results", {}), **results),
+    }
+    with open(args.baselines, "w") as f:
+      json.dump(recorded, f, indent=2)
+      f.write("\n")
+    print(f"baselines written to {args.baselines}")
+
+  if failures:
+    print(f"regressed: {', '.join(failures)}")
+    if args.check:
+      sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,157 @@
+"""
+Memory and throughput of util.Match/Game on a synthetic event, compared with
+the previous eager, unslotted records.
+
+  python benchmarks/bench_records.py [--players 3000] [--rounds 18]
+"""
+
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util import Match, MATCH_FIELDS
+
+
+class LegacyGame:
+
+  def __init__(self,
+               winner,
+               loser,
+               table,
+               round,
+               winner_pid=None,
+               loser_pid=None,
+               winner_discord=None,
+               loser_discord=None):
+    self.winner = winner
+    self.loser = loser
+    self.table = table
+    self.round = round
+    self.winner_pid = winner_pid
+    self.loser_pid = loser_pid
+    self.winner_discord = winner_discord
+    self.loser_discord = loser_discord
+
+
+class LegacyMatch:
+  """util.Match before games became lazy: every game is built up front."""
+
+  def __init__(self,
+               winner,
+               loser,
+               table,
+               round,
+               winner_wins=0,
+               loser_wins=0,
+               winner_pid=None,
+               loser_pid=None,
+               winner_discord=None,
+               loser_discord=None):
+    self.winner = winner
+    self.loser = loser
+    self.table = table
+    self.round = round
+    self.winner_pid = winner_pid
+    self.loser_pid = loser_pid
+    self.winner_discord = winner_discord
+    self.loser_discord = loser_discord
+    self.games = []
+    for i in range(int(winner_wins)):
+      self.games.append(
+          LegacyGame(winner, loser, table, round, winner_pid, loser_pid))
+    for i in range(int(loser_wins)):
+      self.games.append(
+          LegacyGame(loser, winner, table, round, loser_pid, winner_pid))
+
+  def iter_games(self):
+    return iter(self.games)
+
+
+def make_rows(num_players, num_rounds, seed=0):
+  rng = random.Random(seed)
+  players = [(f"First{i} Last{i}", f"pid-{i:06d}") for i in range(num_players)]
+  rows = []
+  for round in range(1, num_rounds + 1):
+    rng.shuffle(players)
+    for table in range(num_players // 2):
+      (w_name, w_pid), (l_name, l_pid) = players[2 * table:2 * table + 2]
+      loser_wins = rng.choice((0, 1))
+      rows.append(
+          (w_name, l_name, str(table + 1), round, 2, loser_wins, w_pid, l_pid))
+  return rows
+
+
+def build(match_type, rows):
+  return [
+      match_type(w, l, t, r, ww, lw, winner_pid=wp, loser_pid=lp)
+      for (w, l, t, r, ww, lw, wp, lp) in rows
+  ]
+
+
+def write_games(matches):
+  f = io.StringIO()
+  writer = csv.writer(f)
+  count = 0
+  for match in matches:
+    for game in match.iter_games():
+      writer.writerow([getattr(game, field) for field in MATCH_FIELDS])
+      count += 1
+  return count
+
+
+def measure(match_type, rows):
+  tracemalloc.start()
+  start = time.perf_counter()
+  matches = build(match_type, rows)
+  build_seconds = time.perf_counter() - start
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  start = time.perf_counter()
+  games = write_games(matches)
+  write_seconds = time.perf_counter() - start
+
+  return {
+      "peak_mb": peak / 1024 / 1024,
+      "build_per_sec": len(rows) / build_seconds,
+      "games_per_sec": games / write_seconds,
+      "games": games,
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--players', type=int, default=3000)
+  parser.add_argument('--rounds', type=int, default=18)
+  args = parser.parse_args()
+
+  rows = make_rows(args.players, args.rounds)
+  print(f"{args.players} players, {args.rounds} rounds: "
+        f"{len(rows)} matches")
+
+  results = {
+      "legacy": measure(LegacyMatch, rows),
+      "util.Match": measure(Match, rows),
+  }
+
+  print(f"{'':12} {'peak MB':>10} {'matches/s':>12} {'game rows/s':>12}")
+  for name, r in results.items():
+    print(f"{name:12} {r['peak_mb']:10.1f} {r['build_per_sec']:12,.0f} "
+          f"{r['games_per_sec']:12,.0f}")
+
+  legacy, current = results["legacy"], results["util.Match"]
+  assert legacy["games"] == current["games"]
+  print(f"memory: {legacy['peak_mb'] / current['peak_mb']:.1f}x smaller, "
+        f"build: {current['build_per_sec'] / legacy['build_per_sec']:.1f}x "
+        f"faster")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,570 @@
+"""
+Synthetic tournaments in every format the scrapers read: RK9 pairings html,
+BCP's paginated pairings/players json, Battlefy's per-round matches and
+standings json, the round_N.txt files parse_bcp_txt reads, and an event
+directory for fill_deck_records. Everything is derived from a seed, so the
+same arguments always produce the same bytes.
+
+  python benchmarks/fixtures.py --out /tmp/fixtures [--players 2000]
+      [--rounds 9] [--seed 0]
+"""
+
+import argparse
+import csv
+import html
+import json
+import os
+import random
+
+FIRST_NAMES = [
+    "Aaron", "Abigail", "Alejandro", "Alex", "Amelia", "Andrea", "Ben", "Bruno",
+    "Camila", "Carlos", "Charlotte", "Chris", "Daniel", "Diego", "Elena",
+    "Emma", "Ethan", "Felipe", "Gabriel", "Grace", "Hannah", "Hugo", "Isaac",
+    "Isabella", "Jack", "James", "Javier", "Jonathan", "José", "Julia", "Kai",
+    "Katherine", "Kenji", "Liam", "Lucas", "Lucía", "Mateo", "Matthew", "Mia",
+    "Michael", "Nathan", "Noah", "Olivia", "Pablo", "Rafael", "Robert", "Ryan",
+    "Samuel", "Sarah", "Sofia", "Stephanie", "Thomas", "Tomás", "Victoria",
+    "William", "Yuki", "Zoë", "Anne-Marie", "Jean-Luc", "Mary Kate"
+]
+
+LAST_NAMES = [
+    "Anderson", "Bailey", "Brown", "Campbell", "Chen", "Clark", "Cohen",
+    "Davis", "de la Cruz", "Dubois", "Evans", "Fernández", "García", "Gonzalez",
+    "Hall", "Harris", "Hernández", "Hughes", "Ito", "Jackson", "Johnson", "Kim",
+    "Kowalski", "Lee", "Lewis", "López", "Martin", "Martínez", "Müller",
+    "Nguyen", "O'Brien", "Okafor", "Patel", "Pérez", "Ramírez", "Rossi",
+    "Sánchez", "Schmidt", "Silva", "Smith", "Suzuki", "Tanaka", "Taylor",
+    "Thompson", "Torres", "Van der Berg", "Walker", "White", "Williams",
+    "Wilson", "Wright", "Young", "Zhang", "Álvarez", "Nakamura", "Rivera",
+    "Moreau", "Novak", "Costa", "Ivanova"
+]
+
+DECK_TYPES = [
+    "Charizard ex", "Gardevoir ex", "Lugia VSTAR", "Miraidon ex",
+    "Lost Zone Box", "Chien-Pao ex", "Giratina VSTAR", "Roaring Moon ex",
+    "Iron Hands ex", "Snorlax Stall", "Arceus VSTAR", "Mew VMAX",
+    "Palkia VSTAR", "Ancient Box", "Future Box", "Dragapult ex",
+    "Regidrago VSTAR", "Raging Bolt ex", "Lost Box Kyogre", "Other"
+]
+
+# rk9 splits an event into juniors, seniors and masters
+DIVISIONS = ("P0", "P1", "P2")
+
+BCP_PAGE_LIMIT = 100
+
+
+class Player:
+
+  def __init__(self, index, first, last, pid, discord=None):
+    self.index = index
+    self.first = first
+    self.last = last
+    self.pid = pid
+    self.discord = discord
+    self.points = 0
+    self.record = [0, 0, 0]
+    self.dropped = False
+
+  @property
+  def name(self):
+    return f"{self.first} {self.last}"
+
+  def score(self, result):
+    # result is 0 for a win, 1 for a loss, 2 for a tie
+    self.record[result] += 1
+    self.points += (3, 0, 1)[result]
+
+
+class Pairing:
+  """
+  One table of a round. winner is 0 (p1), 1 (p2) or None for a tie; p2 is
+  None for a bye. games are (p1 wins, p2 wins). An unreported pairing is
+  one whose result isn't posted yet, as in a round still being played.
+  """
+
+  def __init__(self, table, p1, p2, winner, games, reported=True):
+    self.table = table
+    self.p1 = p1
+    self.p2 = p2
+    self.winner = winner
+    self.games = games
+    self.reported = reported
+
+  def unreported(self):
+    return Pairing(self.table,
+                   self.p1,
+                   self.p2,
+                   self.winner,
+                   self.games,
+                   reported=False)
+
+
+class Tournament:
+  """
+  A swiss event: players are paired within (roughly) their score group
+  each round, a few percent of matches tie and a few players drop.
+  """
+
+  def __init__(self,
+               num_players,
+               num_rounds,
+               seed=0,
+               pid_prefix="",
+               discord_rate=0.1,
+               tie_rate=0.02,
+               drop_rate=0.01):
+    self.rng = random.Random(seed)
+    self.players = make_players(self.rng, num_players, pid_prefix, discord_rate)
+    self.rounds = []
+    for round in range(1, num_rounds + 1):
+      self.rounds.append(self.pair_round(round, tie_rate))
+      for player in self.players:
+        if not player.dropped and self.rng.random() < drop_rate:
+          player.dropped = True
+
+  def pair_round(self, round, tie_rate):
+    rng = self.rng
+    active = [p for p in self.players if not p.dropped]
+    active.sort(key=lambda p: (-p.points, rng.random()))
+
+    pairings = []
+    for i in range(0, len(active) - 1, 2):
+      p1, p2 = active[i], active[i + 1]
+      if rng.random() < tie_rate:
+        winner, games = None, (1, 1)
+        p1.score(2)
+        p2.score(2)
+      else:
+        winner = rng.randrange(2)
+        games = rng.choice(((2, 0), (2, 1)))
+        if winner:
+          games = games[::-1]
+        (p1, p2)[winner].score(0)
+        (p2, p1)[winner].score(1)
+      pairings.append(Pairing(len(pairings) + 1, p1, p2, winner, games))
+
+    if len(active) % 2:
+      bye = active[-1]
+      bye.score(0)
+      pairings.append(Pairing(len(pairings) + 1, bye, None, 0, (2, 0)))
+
+    return pairings
+
+  def standings(self):
+    return sorted(self.players,
+                  key=lambda p: (p.dropped, -p.points, p.last, p.first))
+
+
+def make_players(rng, num_players, pid_prefix="", discord_rate=0.1):
+  names = [(f, l) for f in FIRST_NAMES for l in LAST_NAMES]
+  rng.shuffle(names)
+
+  players = []
+  for i in range(num_players):
+    first, last = names[i % len(names)]
+    if i >= len(names):
+      last = f"{last} {i // len(names) + 1}"
+    discord = None
+    if rng.random() < discord_rate:
+      discord = f"{first.lower().replace(' ', '')}{rng.randrange(10000):04d}"
+    players.append(
+        Player(i, first, last, f"{pid_prefix}{100000 + i}", discord=discord))
+  return players
+
+
+# rk9 ---------------------------------------------------------------------
+
+
+def _rk9_name(player):
+  name = html.escape(player.name)
+  if player.discord:
+    name = f'"{html.escape(player.discord)}" {name}'
+  return name
+
+
+def _rk9_player(player, position, result):
+  wins, losses, ties = player.record
+  return (f'<div class="col-5 player {position} {result}">'
+          f'<span class="name">{_rk9_name(player)}</span> '
+          f'<span class="record">{wins}-{losses}-{ties} ({player.points})'
+          f'</span></div>')
+
+
+def rk9_match(pairing):
+  if pairing.p2 is None:
+    return (f'<div class="row row-cols-3 match no-gutter complete">'
+            f'{_rk9_player(pairing.p1, "player1", "winner")}'
+            f'<div class="col-2 text-center"><span class="tablenumber">'
+            f'{pairing.table}</span></div>'
+            f'<div class="col-5 player player2"><span class="name">BYE'
+            f'</span></div></div>')
+
+  if not pairing.reported:
+    # still being played: no result classes on either player
+    return (f'<div class="row row-cols-3 match no-gutter">'
+            f'{_rk9_player(pairing.p1, "player1", "")}'
+            f'<div class="col-2 text-center"><span class="tablenumber">'
+            f'{pairing.table}</span></div>'
+            f'{_rk9_player(pairing.p2, "player2", "")}</div>')
+
+  if pairing.winner is None:
+    results = ("tie", "tie")
+  elif pairing.winner == 0:
+    results = ("winner", "loser")
+  else:
+    results = ("loser", "winner")
+
+  return (f'<div class="row row-cols-3 match no-gutter complete">'
+          f'{_rk9_player(pairing.p1, "player1", results[0])}'
+          f'<div class="col-2 text-center"><span class="tablenumber">'
+          f'{pairing.table}</span></div>'
+          f'{_rk9_player(pairing.p2, "player2", results[1])}</div>')
+
+
+def rk9_division(division, tournament):
+  parts = [f'<div class="tab-pane" id="{division}">', '<ul class="nav">']
+  for round in range(1, len(tournament.rounds) + 1):
+    parts.append(f'<li><a href="#{division}R{round}">Round {round}</a></li>')
+  parts.append('</ul><div class="tab-content">')
+
+  for round, pairings in enumerate(tournament.rounds, 1):
+    parts.append(f'<div class="tab-pane" id="{division}R{round}">')
+    parts.extend(rk9_match(p) for p in pairings)
+    parts.append('</div>')
+
+  parts.append(f'<div class="tab-pane" id="{division}-standings">')
+  for rank, player in enumerate(tournament.standings(), 1):
+    parts.append(f'{rank}. {_rk9_name(player)}<br>')
+  parts.append('</div></div></div>')
+
+  return "\n".join(parts)
+
+
+def rk9_html(tournaments):
+  """
+  A pairings page with a tab per division, tournaments being a dict of
+  division ("P0", "P1", "P2") -> Tournament.
+  """
+
+  head = ('<!DOCTYPE html><html><head><meta charset="utf-8">'
+          '<title>Pairings</title>'
+          '<script>window.dataLayer = window.dataLayer || [];</script>'
+          '</head><body><nav class="navbar">RK9 Labs</nav>'
+          '<div class="container"><div class="tab-content">')
+  body = "\n".join(rk9_division(d, t) for d, t in tournaments.items())
+  return f"{head}\n{body}\n</div></div></body></html>\n"
+
+
+# bcp ---------------------------------------------------------------------
+
+
+def bcp_pairing(pairing, round):
+  p1, p2 = pairing.p1, pairing.p2
+  p1_wins, p2_wins = pairing.games
+  margin = {None: 0, 0: 1, 1: -1}[pairing.winner]
+  item = {
+      "id": f"pairing-{round}-{pairing.table}",
+      "table": pairing.table,
+      "round": round,
+      "pairingType": "Pairing",
+      "player1Id": p1.pid,
+      "player2Id": p2.pid,
+  }
+  if not pairing.reported:
+    # the result metadata only appears once the table reports
+    return item
+
+  item["metaData"] = {
+      "p1-firstName": p1.first,
+      "p1-lastName": p1.last,
+      "p2-firstName": p2.first,
+      "p2-lastName": p2.last,
+      "p1-marginOfVictory": margin,
+      "p2-marginOfVictory": -margin,
+      "p1-gamePoints": p1_wins,
+      "p2-gamePoints": p2_wins,
+  }
+  return item
+
+
+def bcp_page(items, start, limit=BCP_PAGE_LIMIT):
+  """
+  The page of items starting at start, the way the api returns it: with a
+  nextKey whenever the page is full.
+  """
+
+  page = {"data": items[start:start + limit]}
+  if len(page["data"]) >= limit:
+    page["nextKey"] = f"key-{start + limit}"
+  return page
+
+
+def bcp_pages(items, limit=BCP_PAGE_LIMIT):
+  pages = [
+      bcp_page(items, start, limit) for start in range(0, len(items), limit)
+  ]
+  return pages or [{"data": []}]
+
+
+def bcp_pairings(tournament, round):
+  return [
+      bcp_pairing(p, round)
+      for p in tournament.rounds[round - 1]
+      if p.p2 is not None
+  ]
+
+
+def bcp_pairing_pages(tournament, round, limit=BCP_PAGE_LIMIT):
+  return bcp_pages(bcp_pairings(tournament, round), limit)
+
+
+def bcp_players(tournament):
+  return [{
+      "id": p.pid,
+      "firstName": p.first,
+      "lastName": p.last,
+      "placing": rank,
+  } for rank, p in enumerate(tournament.standings(), 1)]
+
+
+def bcp_player_pages(tournament, limit=BCP_PAGE_LIMIT):
+  return bcp_pages(bcp_players(tournament), limit)
+
+
+# battlefy ----------------------------------------------------------------
+
+
+def _battlefy_side(player, won, score):
+  if player is None:
+    return {}
+  return {
+      "teamID": player.pid,
+      "team": {
+          "name": player.name
+      },
+      "winner": won,
+      "score": score,
+  }
+
+
+def battlefy_round(tournament, round):
+  # match numbers run on from the previous rounds'
+  first_number = sum(len(r) for r in tournament.rounds[:round - 1]) + 1
+
+  matches = []
+  for i, pairing in enumerate(tournament.rounds[round - 1]):
+    p1_wins, p2_wins = pairing.games
+    winner = pairing.winner
+    if not pairing.reported:
+      p1_wins, p2_wins, winner = 0, 0, None
+    matches.append({
+        "_id": f"match-{round}-{pairing.table}",
+        "matchNumber": first_number + i,
+        "roundNumber": round,
+        "isBye": pairing.p2 is None,
+        "top": _battlefy_side(pairing.p1, winner == 0, p1_wins),
+        "bottom": _battlefy_side(pairing.p2, winner == 1, p2_wins),
+    })
+  return matches
+
+
+def battlefy_standings(tournament):
+  return [{
+      "_id": f"standing-{p.pid}",
+      "team": {
+          "name": p.name
+      },
+      "disqualified": p.dropped and p.points == 0,
+  } for p in tournament.standings()]
+
+
+# bcp txt -----------------------------------------------------------------
+
+
+def round_txt(tournament, round):
+  """
+  A round copied out of the BCP app, as parse_bcp_txt reads it.
+  """
+
+  lines = []
+  for pairing in tournament.rounds[round - 1]:
+    if pairing.p2 is None or pairing.winner is None or not pairing.reported:
+      continue
+    winner = (pairing.p1, pairing.p2)[pairing.winner]
+    loser = (pairing.p2, pairing.p1)[pairing.winner]
+    lines.extend([
+        "TABLE",
+        str(pairing.table), winner.name, "Win: 1", loser.name, "Loss: 0", ""
+    ])
+  return "\n".join(lines) + "\n"
+
+
+# fill_deck_records -------------------------------------------------------
+
+
+def misspell(rng, name):
+  kind = rng.randrange(4)
+  if kind == 0:
+    return name.lower()
+  if kind == 1:
+    return name.upper()
+  if kind == 2 and len(name) > 4:
+    i = rng.randrange(1, len(name) - 1)
+    return name[:i] + name[i + 1:]
+  return f"  {name} "
+
+
+def write_event_dir(tournament,
+                    out_dir,
+                    seed=0,
+                    misspell_rate=0.1,
+                    missing_rate=0.05):
+  """
+  Writes matches.csv, games.csv, rankings.csv and submitted_decks.csv as
+  scrape_matches/scrape_rankings and the deck form export would. Some form
+  names are misspelled and some players never submitted a deck.
+  """
+
+  rng = random.Random(seed)
+  os.makedirs(out_dir, exist_ok=True)
+  fields = [
+      "round", "table", "winner", "loser", "winner_pid", "loser_pid",
+      "winner_discord", "loser_discord"
+  ]
+
+  with open(os.path.join(out_dir, "matches.csv"), "w", newline='') as mf, \
+      open(os.path.join(out_dir, "games.csv"), "w", newline='') as gf:
+    matches = csv.writer(mf)
+    games = csv.writer(gf)
+    matches.writerow(fields)
+    games.writerow(fields)
+
+    for round, pairings in enumerate(tournament.rounds, 1):
+      for pairing in pairings:
+        if pairing.winner is None:
+          continue
+        winner = (pairing.p1, pairing.p2)[pairing.winner]
+        loser = (pairing.p2, pairing.p1)[pairing.winner]
+        if loser is None:
+          matches.writerow([
+              round, pairing.table, winner.name, "", winner.pid, "",
+              winner.discord or "", ""
+          ])
+          continue
+
+        row = [
+            round, pairing.table, winner.name, loser.name, winner.pid,
+            loser.pid, winner.discord or "", loser.discord or ""
+        ]
+        matches.writerow(row)
+        winner_wins = max(pairing.games)
+        loser_wins = min(pairing.games)
+        games.writerows([row] * winner_wins)
+        games.writerows([[
+            round, pairing.table, loser.name, winner.name, loser.pid,
+            winner.pid, loser.discord or "", winner.discord or ""
+        ]] * loser_wins)
+
+  with open(os.path.join(out_dir, "rankings.csv"), "w", newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(["ranking", "name", "player_id", "discord"])
+    for rank, player in enumerate(tournament.standings(), 1):
+      writer.writerow([rank, player.name, player.pid, player.discord or ""])
+
+  with open(os.path.join(out_dir, "submitted_decks.csv"), "w", newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(
+        ["player_name", "deck_type_1", "deck_type_2", "tag_count_1"])
+    submitted = set()
+    for player in tournament.players:
+      if rng.random() < missing_rate:
+        continue
+      name = player.name
+      if rng.random() < misspell_rate:
+        name = misspell(rng, name)
+      # the form rejects a second submission under the same name
+      if name.strip().lower() in submitted:
+        continue
+      submitted.add(name.strip().lower())
+      deck_types = rng.sample(DECK_TYPES, 2)
+      writer.writerow([name, deck_types[0], deck_types[1], ""])
+
+
+# -------------------------------------------------------------------------
+
+
+def make_divisions(num_players, num_rounds, seed=0):
+  """
+  Masters at the requested size, with seniors and juniors fields the usual
+  fractions of it, as a dict of division -> Tournament.
+  """
+
+  return {
+      "P0":
+          Tournament(max(2, num_players // 10),
+                     max(1, num_rounds - 2),
+                     seed=seed + 2,
+                     pid_prefix="J"),
+      "P1":
+          Tournament(max(2, num_players // 6),
+                     max(1, num_rounds - 1),
+                     seed=seed + 1,
+                     pid_prefix="S"),
+      "P2":
+          Tournament(num_players, num_rounds, seed=seed, pid_prefix="M"),
+  }
+
+
+def _write_json(path, data):
+  with open(path, "w") as f:
+    json.dump(data, f)
+
+
+def write_fixtures(out_dir, num_players, num_rounds, seed=0):
+  divisions = make_divisions(num_players, num_rounds, seed=seed)
+  masters = divisions["P2"]
+
+  os.makedirs(out_dir, exist_ok=True)
+  with open(os.path.join(out_dir, "rk9_pairings.html"), "w") as f:
+    f.write(rk9_html(divisions))
+
+  bcp_dir = os.path.join(out_dir, "bcp")
+  os.makedirs(bcp_dir, exist_ok=True)
+  for round in range(1, num_rounds + 1):
+    for i, page in enumerate(bcp_pairing_pages(masters, round), 1):
+      _write_json(os.path.join(bcp_dir, f"pairings_r{round}_p{i}.json"), page)
+  for i, page in enumerate(bcp_player_pages(masters), 1):
+    _write_json(os.path.join(bcp_dir, f"players_p{i}.json"), page)
+
+  battlefy_dir = os.path.join(out_dir, "battlefy")
+  os.makedirs(battlefy_dir, exist_ok=True)
+  for round in range(1, num_rounds + 1):
+    _write_json(os.path.join(battlefy_dir, f"matches_r{round}.json"),
+                battlefy_round(masters, round))
+  _write_json(os.path.join(battlefy_dir, "standings.json"),
+              battlefy_standings(masters))
+
+  txt_dir = os.path.join(out_dir, "txt")
+  os.makedirs(txt_dir, exist_ok=True)
+  for round in range(1, num_rounds + 1):
+    with open(os.path.join(txt_dir, f"round_{round}.txt"), "w") as f:
+      f.write(round_txt(masters, round))
+
+  write_event_dir(masters, os.path.join(out_dir, "event"), seed=seed)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description="write synthetic rk9/bcp/battlefy/txt fixtures")
+  parser.add_argument('--out', type=str, required=True)
+  parser.add_argument('--players', type=int, default=2000)
+  parser.add_argument('--rounds', type=int, default=9)
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+
+  write_fixtures(args.out, args.players, args.rounds, seed=args.seed)
+  print(f"fixtures written to {args.out}")
+
+
+if __name__ == "__main__":
+  main()
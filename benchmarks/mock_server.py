@@ -0,0 +1,560 @@
+"""
+A local stand-in for rk9, bcp and battlefy serving fixtures.py events, so
+the scrapers can be load tested end to end against a target whose latency,
+failures and live rounds are under our control:
+
+  python benchmarks/mock_server.py [--port 8000] [--players 2000]
+      [--latency 0.05] [--error-rate 0.01] [--throttle-rate 0.01]
+      [--round-interval 60 --rounds-complete 3]
+  python scrape_matches.py --rk9 --tid EV1 --base-url http://127.0.0.1:8000
+
+Every platform is served from the same root, on the paths the scrapers ask
+for once pointed at it with --base-url:
+
+  /pairings/{tid}                          rk9 pairings page (all divisions)
+  /pairings?eventId=&round=&nextKey=       bcp pairings, paginated
+  /players?eventId=&nextKey=               bcp players, paginated
+  /stages/{tid}/matches?roundNumber=       battlefy matches for a round
+  /stages/{tid}/latest-round-standings     battlefy standings
+  /_stats                                  requests served, by route/status
+
+Any tid works, and each gets its own event seeded from --seed and the tid.
+With --round-interval an event starts with --rounds-complete rounds
+reported, then pairs the next round and posts its results a few tables at a
+time over each interval, so --watch has a live round to poll.
+"""
+
+import argparse
+import collections
+import functools
+import gzip
+import hashlib
+import http.server
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import fixtures
+
+DEFAULT_PORT = 8000
+DEFAULT_PLAYERS = 2000
+DEFAULT_ROUNDS = 9
+# a live round's results are posted in this many batches
+REPORT_STEPS = 20
+ERROR_STATUSES = (500, 502, 503)
+
+# bcp and battlefy events are a single division
+MAIN_DIVISION = "P2"
+
+
+def log(msg, print_dest="stderr"):
+  if print_dest == "stderr":
+    print(msg, file=sys.stderr)
+
+  if print_dest == "stdout":
+    print(msg)
+
+
+class MockEvent:
+  """
+  One event's tournaments and how far into them it is. Rounds past
+  rounds_complete are revealed one every round_interval seconds, the
+  current round's tables reporting in a fixed random order.
+  """
+
+  def __init__(self,
+               tid,
+               num_players,
+               num_rounds,
+               seed=0,
+               rounds_complete=None,
+               round_interval=None):
+    seed = seed + zlib.crc32(tid.encode())
+    self.tid = tid
+    self.divisions = fixtures.make_divisions(num_players, num_rounds, seed=seed)
+    self.round_interval = round_interval
+    self.rounds_complete = (num_rounds if rounds_complete is None else min(
+        rounds_complete, num_rounds))
+    self.started = time.monotonic()
+
+    rng = random.Random(seed)
+    self.report_order = {}
+    for division, tournament in self.divisions.items():
+      orders = []
+      for pairings in tournament.rounds:
+        tables = [p.table for p in pairings if p.p2 is not None]
+        rng.shuffle(tables)
+        orders.append(tables)
+      self.report_order[division] = orders
+
+  def state(self):
+    """
+    (rounds fully reported, reporting steps into the next round). Responses
+    only change when this does.
+    """
+
+    if not self.round_interval:
+      return self.rounds_complete, 0
+
+    elapsed = time.monotonic() - self.started
+    progress = self.rounds_complete + elapsed / self.round_interval
+    complete = int(progress)
+    step = int((progress - complete) * REPORT_STEPS)
+    return complete, step
+
+  def view(self, division, state):
+    """
+    The division's tournament as it stands at state, with the rounds not
+    yet started cut off and the current round's unreported tables marked.
+    """
+
+    tournament = self.divisions[division]
+    complete, step = state
+    rounds = tournament.rounds[:complete]
+
+    if complete < len(tournament.rounds):
+      order = self.report_order[division][complete]
+      reported = set(order[:len(order) * step // REPORT_STEPS])
+      rounds.append([
+          p if p.p2 is None or p.table in reported else p.unreported()
+          for p in tournament.rounds[complete]
+      ])
+
+    return TournamentView(tournament, rounds)
+
+
+class TournamentView:
+
+  def __init__(self, tournament, rounds):
+    self.tournament = tournament
+    self.rounds = rounds
+
+  def standings(self):
+    return self.tournament.standings()
+
+
+class RequestBucket:
+  """
+  A token bucket that refuses instead of waiting, like a server's rate
+  limit.
+  """
+
+  def __init__(self, rate, burst):
+    self.rate = rate
+    self.burst = burst
+    self.tokens = burst
+    self.updated = time.monotonic()
+    self.lock = threading.Lock()
+
+  def try_acquire(self):
+    """
+    Returns 0 if a request may go ahead, otherwise the seconds until one
+    can.
+    """
+
+    with self.lock:
+      now = time.monotonic()
+      self.tokens = min(self.burst,
+                        self.tokens + (now - self.updated) * self.rate)
+      self.updated = now
+
+      if self.tokens >= 1:
+        self.tokens -= 1
+        return 0
+
+      return (1 - self.tokens) / self.rate
+
+
+class Body:
+  """
+  A rendered response, with its etag and a gzipped copy made on first use.
+  """
+
+  def __init__(self, content, content_type):
+    self.content = content
+    self.content_type = content_type
+    self.etag = f'"{hashlib.sha1(content).hexdigest()[:16]}"'
+    self._gzipped = None
+
+  @property
+  def gzipped(self):
+    if self._gzipped is None:
+      self._gzipped = gzip.compress(self.content, compresslevel=6)
+    return self._gzipped
+
+
+def json_body(data):
+  return Body(json.dumps(data).encode(), "application/json")
+
+
+class MockServer(http.server.ThreadingHTTPServer):
+  daemon_threads = True
+
+  def __init__(self,
+               address,
+               num_players=DEFAULT_PLAYERS,
+               num_rounds=DEFAULT_ROUNDS,
+               seed=0,
+               rounds_complete=None,
+               round_interval=None,
+               latency=0.0,
+               jitter=0.0,
+               error_rate=0.0,
+               throttle_rate=0.0,
+               reset_rate=0.0,
+               retry_after=1.0,
+               max_rps=None,
+               verbose=False):
+    super().__init__(address, MockHandler)
+    self.num_players = num_players
+    self.num_rounds = num_rounds
+    self.seed = seed
+    self.rounds_complete = rounds_complete
+    self.round_interval = round_interval
+    self.latency = latency
+    self.jitter = jitter
+    self.error_rate = error_rate
+    self.throttle_rate = throttle_rate
+    self.reset_rate = reset_rate
+    self.retry_after = retry_after
+    self.bucket = (RequestBucket(max_rps, max(1, int(max_rps)))
+                   if max_rps else None)
+    self.verbose = verbose
+
+    self.rng = random.Random(seed)
+    self.rng_lock = threading.Lock()
+    self.events = {}
+    self.events_lock = threading.Lock()
+    self.stats = collections.Counter()
+    self.bytes_sent = 0
+    self.stats_lock = threading.Lock()
+
+    # renders are cached per event state, so only a live round's progress
+    # costs a re-render
+    self.render = functools.lru_cache(maxsize=256)(self._render)
+
+  @property
+  def url(self):
+    host, port = self.server_address[:2]
+    return f"http://{host}:{port}"
+
+  def random(self):
+    with self.rng_lock:
+      return self.rng.random()
+
+  def event(self, tid):
+    with self.events_lock:
+      if tid not in self.events:
+        self.events[tid] = MockEvent(tid,
+                                     self.num_players,
+                                     self.num_rounds,
+                                     seed=self.seed,
+                                     rounds_complete=self.rounds_complete,
+                                     round_interval=self.round_interval)
+      return self.events[tid]
+
+  def count(self, route, status, sent=0):
+    with self.stats_lock:
+      self.stats[f"{route} {status}"] += 1
+      self.bytes_sent += sent
+
+  def stats_summary(self):
+    with self.stats_lock:
+      return {
+          "requests": sum(self.stats.values()),
+          "bytes_sent": self.bytes_sent,
+          "by_route": dict(sorted(self.stats.items())),
+      }
+
+  def _render(self, route, tid, state, round=None, offset=0, limit=None):
+    event = self.event(tid)
+
+    if route == "rk9.pairings":
+      views = {d: event.view(d, state) for d in event.divisions}
+      return Body(fixtures.rk9_html(views).encode(), "text/html; charset=utf-8")
+
+    view = event.view(MAIN_DIVISION, state)
+
+    if route == "bcp.players":
+      return json_body(
+          fixtures.bcp_page(fixtures.bcp_players(view), offset, limit))
+
+    if route == "bcp.pairings":
+      items = []
+      if 1 <= round <= len(view.rounds):
+        items = fixtures.bcp_pairings(view, round)
+      return json_body(fixtures.bcp_page(items, offset, limit))
+
+    if route == "battlefy.matches":
+      if 1 <= round <= len(view.rounds):
+        return json_body(fixtures.battlefy_round(view, round))
+      return json_body([])
+
+    if route == "battlefy.standings":
+      return json_body(fixtures.battlefy_standings(view))
+
+    raise ValueError(f"unknown route: {route}")
+
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+  # keep-alive, as the real hosts do
+  protocol_version = "HTTP/1.1"
+
+  def log_message(self, format, *args):
+    if self.server.verbose:
+      super().log_message(format, *args)
+
+  def do_GET(self):
+    url = urllib.parse.urlsplit(self.path)
+    params = urllib.parse.parse_qs(url.query)
+    parts = [p for p in url.path.split("/") if p]
+
+    if parts == ["_stats"]:
+      self.send_body("_stats", 200, json_body(self.server.stats_summary()))
+      return
+
+    route, kwargs = self.route(parts, params)
+    if route is None:
+      self.send_error_status("unknown", 404)
+      return
+
+    if self.inject_faults(route):
+      return
+
+    if route.startswith("bcp.") and not self.headers.get("client-id"):
+      self.send_error_status(route, 401)
+      return
+
+    tid = kwargs.pop("tid")
+    body = self.server.render(route, tid,
+                              self.server.event(tid).state(), **kwargs)
+
+    if self.headers.get("If-None-Match") == body.etag:
+      self.send_response(304)
+      self.send_header("ETag", body.etag)
+      self.send_header("Content-Length", "0")
+      self.end_headers()
+      self.server.count(route, 304)
+      return
+
+    self.send_body(route, 200, body)
+
+  def route(self, parts, params):
+    """
+    Returns (route, render kwargs) for a request path, or (None, None).
+    """
+
+    def param(name, default=None):
+      values = params.get(name)
+      return values[0] if values else default
+
+    def int_param(name, default):
+      try:
+        return int(param(name, default))
+      except ValueError:
+        return default
+
+    if len(parts) == 2 and parts[0] == "pairings":
+      return "rk9.pairings", {"tid": parts[1]}
+
+    if len(parts) == 1 and parts[0] in ("pairings", "players"):
+      tid = param("eventId")
+      if not tid:
+        return None, None
+      next_key = param("nextKey") or "key-0"
+      kwargs = {
+          "tid": tid,
+          "offset": offset_for_key(next_key),
+          "limit": max(1, int_param("limit", fixtures.BCP_PAGE_LIMIT)),
+      }
+      if parts[0] == "pairings":
+        kwargs["round"] = int_param("round", 1)
+        return "bcp.pairings", kwargs
+      return "bcp.players", kwargs
+
+    if len(parts) == 3 and parts[0] == "stages":
+      if parts[2] == "matches":
+        return "battlefy.matches", {
+            "tid": parts[1],
+            "round": int_param("roundNumber", 1)
+        }
+      if parts[2] == "latest-round-standings":
+        return "battlefy.standings", {"tid": parts[1]}
+
+    return None, None
+
+  def inject_faults(self, route):
+    """
+    Delays the response and maybe fails it. Returns True if the request
+    was answered (or dropped) here.
+    """
+
+    server = self.server
+    delay = server.latency + server.jitter * server.random()
+    if delay:
+      time.sleep(delay)
+
+    if server.bucket:
+      wait = server.bucket.try_acquire()
+      if wait:
+        self.send_error_status(route, 429, retry_after=wait)
+        return True
+
+    roll = server.random()
+    if roll < server.reset_rate:
+      # no response at all; the client sees the connection drop
+      self.close_connection = True
+      server.count(route, "reset")
+      return True
+    roll -= server.reset_rate
+
+    if roll < server.throttle_rate:
+      self.send_error_status(route, 429, retry_after=server.retry_after)
+      return True
+    roll -= server.throttle_rate
+
+    if roll < server.error_rate:
+      with server.rng_lock:
+        status = server.rng.choice(ERROR_STATUSES)
+      self.send_error_status(route, status)
+      return True
+
+    return False
+
+  def send_error_status(self, route, status, retry_after=None):
+    content = json.dumps({"error": status}).encode()
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(content)))
+    if retry_after is not None:
+      self.send_header("Retry-After", f"{max(1, round(retry_after))}")
+    self.end_headers()
+    self.wfile.write(content)
+    self.server.count(route, status, len(content))
+
+  def send_body(self, route, status, body):
+    content = body.content
+    gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+    if gzipped:
+      content = body.gzipped
+
+    self.send_response(status)
+    self.send_header("Content-Type", body.content_type)
+    self.send_header("Content-Length", str(len(content)))
+    self.send_header("ETag", body.etag)
+    self.send_header("Cache-Control", "no-cache")
+    if gzipped:
+      self.send_header("Content-Encoding", "gzip")
+    self.end_headers()
+    self.wfile.write(content)
+    self.server.count(route, status, len(content))
+
+
+def offset_for_key(next_key):
+  # the keys this server hands out are "key-{offset}"
+  try:
+    return max(0, int(next_key.rsplit("-", 1)[-1]))
+  except ValueError:
+    return 0
+
+
+def start(host="127.0.0.1", port=0, **options):
+  """
+  Serves on a background thread and returns the server; its url is
+  server.url and server.shutdown() stops it. port 0 picks a free port.
+  """
+
+  server = MockServer((host, port), **options)
+  thread = threading.Thread(target=server.serve_forever,
+                            name="mock-server",
+                            daemon=True)
+  thread.start()
+  return server
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--host', type=str, default="127.0.0.1")
+  parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+  parser.add_argument('--players', type=int, default=DEFAULT_PLAYERS)
+  parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--rounds-complete',
+                      type=int,
+                      help="rounds already reported when an event is first "
+                      "requested (default: all, or 0 with --round-interval)")
+  parser.add_argument('--round-interval',
+                      type=float,
+                      metavar="SECONDS",
+                      help="play one more round every SECONDS")
+  parser.add_argument('--latency',
+                      type=float,
+                      default=0.0,
+                      help="seconds added before every response")
+  parser.add_argument('--jitter',
+                      type=float,
+                      default=0.0,
+                      help="up to this many more seconds, at random")
+  parser.add_argument('--error-rate',
+                      type=float,
+                      default=0.0,
+                      help="fraction of requests answered with a 5xx")
+  parser.add_argument('--throttle-rate',
+                      type=float,
+                      default=0.0,
+                      help="fraction of requests answered with a 429")
+  parser.add_argument('--reset-rate',
+                      type=float,
+                      default=0.0,
+                      help="fraction of connections dropped without a "
+                      "response")
+  parser.add_argument('--retry-after',
+                      type=float,
+                      default=1.0,
+                      help="Retry-After seconds sent with random 429s")
+  parser.add_argument('--max-rps',
+                      type=float,
+                      help="answer 429 to requests beyond this rate")
+  parser.add_argument('--verbose',
+                      action='store_true',
+                      help="log every request")
+  args = parser.parse_args()
+
+  rounds_complete = args.rounds_complete
+  if rounds_complete is None and args.round_interval:
+    rounds_complete = 0
+
+  server = MockServer((args.host, args.port),
+                      num_players=args.players,
+                      num_rounds=args.rounds,
+                      seed=args.seed,
+                      rounds_complete=rounds_complete,
+                      round_interval=args.round_interval,
+                      latency=args.latency,
+                      jitter=args.jitter,
+                      error_rate=args.error_rate,
+                      throttle_rate=args.throttle_rate,
+                      reset_rate=args.reset_rate,
+                      retry_after=args.retry_after,
+                      max_rps=args.max_rps,
+                      verbose=args.verbose)
+  log(f"serving rk9, bcp and battlefy on {server.url}")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    log(json.dumps(server.stats_summary(), indent=2))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,302 @@
+import argparse
+import hashlib
+import logging
+import os
+import sys
+
+import numpy
+
+import log_config
+import writers
+
+FILENAME = os.path.basename(__file__)
+
+KINDS = ("core", "extra")
+
+DEFAULT_BOOTSTRAP = 1000
+DEFAULT_CONFIDENCE = 0.95
+
+STATE_NAME = "deck_matrix.npz"
+
+MATRIX_FIELDS = [
+    "kind", "deck", "opponent", "wins", "losses", "games", "win_rate", "ci_low",
+    "ci_high"
+]
+
+parser = argparse.ArgumentParser(
+    description="update an event's deck matchup matrix from its "
+    "deck_matches output, recounting only rounds that changed")
+parser.add_argument('--dir', type=str, required=True)
+parser.add_argument('--format',
+                    choices=writers.FORMATS,
+                    default=writers.DEFAULT_FORMAT,
+                    help="format deck_matches was written in, and to write "
+                    "deck_matrix in")
+parser.add_argument('--bootstrap',
+                    type=int,
+                    default=DEFAULT_BOOTSTRAP,
+                    help="bootstrap samples for the win rate intervals")
+parser.add_argument('--confidence', type=float, default=DEFAULT_CONFIDENCE)
+log_config.add_arguments(parser)
+
+logger = logging.getLogger(__name__)
+
+
+def log(msg, print_dest="stderr"):
+  logger.info(msg)
+
+  if print_dest == "stderr":
+    print(msg, file=sys.stderr)
+
+  if print_dest == "stdout":
+    print(msg)
+
+
+def round_digest(winner_decks, loser_decks, is_core):
+  """
+  Identifies a round's records regardless of their order, so a corrected
+  result or a reassigned deck changes it even when the record count doesn't.
+  """
+
+  records = sorted(f"{w}\t{l}\t{'y' if c else ''}"
+                   for w, l, c in zip(winner_decks, loser_decks, is_core))
+  return hashlib.sha1("\n".join(records).encode()).hexdigest()
+
+
+class DeckMatrix:
+  """
+  Per-round deck-vs-deck win counts: wins[kind][r, i, j] is how many of
+  round r's records had deck i beating deck j, kept separately for core and
+  extra records. Rounds can be replaced as they're re-resolved, so a live
+  event only ever recounts its newest rounds.
+  """
+
+  def __init__(self, decks=()):
+    self.decks = []
+    self.index = {}
+    self.rounds = []
+    self.round_index = {}
+    self.digests = []
+    self.wins = {
+        kind: numpy.zeros((0, 0, 0), dtype=numpy.int32) for kind in KINDS
+    }
+
+    self.add_decks(decks)
+
+  def add_decks(self, decks):
+    new = [d for d in dict.fromkeys(decks) if d not in self.index]
+    if not new:
+      return
+
+    for deck in new:
+      self.index[deck] = len(self.decks)
+      self.decks.append(deck)
+
+    size = len(self.decks)
+    for kind, wins in self.wins.items():
+      grown = numpy.zeros((wins.shape[0], size, size), dtype=wins.dtype)
+      grown[:, :wins.shape[1], :wins.shape[2]] = wins
+      self.wins[kind] = grown
+
+  def round_slot(self, round):
+    if round not in self.round_index:
+      self.round_index[round] = len(self.rounds)
+      self.rounds.append(round)
+      self.digests.append("")
+      for kind, wins in self.wins.items():
+        self.wins[kind] = numpy.concatenate(
+            [wins, numpy.zeros((1,) + wins.shape[1:], dtype=wins.dtype)])
+    return self.round_index[round]
+
+  def set_round(self, round, winner_decks, loser_decks, is_core):
+    """
+    Replaces round's counts with the given records: parallel sequences of
+    winner deck, loser deck and whether the record is core.
+    """
+
+    self.add_decks(list(winner_decks) + list(loser_decks))
+    slot = self.round_slot(round)
+
+    winners = numpy.fromiter((self.index[d] for d in winner_decks),
+                             dtype=numpy.intp,
+                             count=len(winner_decks))
+    losers = numpy.fromiter((self.index[d] for d in loser_decks),
+                            dtype=numpy.intp,
+                            count=len(loser_decks))
+    core = numpy.asarray(is_core, dtype=bool)
+
+    for kind, mask in (("core", core), ("extra", ~core)):
+      counts = self.wins[kind][slot]
+      counts[:] = 0
+      numpy.add.at(counts, (winners[mask], losers[mask]), 1)
+
+    self.digests[slot] = round_digest(winner_decks, loser_decks, core)
+
+  def round_changed(self, round, digest):
+    slot = self.round_index.get(round)
+    return slot is None or self.digests[slot] != digest
+
+  def totals(self, kind="core"):
+    return self.wins[kind].sum(axis=0)
+
+  def win_rates(self,
+                kind="core",
+                samples=DEFAULT_BOOTSTRAP,
+                confidence=DEFAULT_CONFIDENCE,
+                seed=0):
+    """
+    Returns (wins, losses, games, rate, low, high) as decks x decks arrays.
+    rate is nan where two decks never met; low/high are the bootstrap
+    interval, drawn for every pair at once.
+
+    A mirror match is counted once, as a game on the diagonal with no win or
+    loss; its rate is 0.5 by definition and it has no interval.
+    """
+
+    wins = self.totals(kind).copy()
+    mirrors = numpy.diagonal(wins).copy()
+    numpy.fill_diagonal(wins, 0)
+    losses = wins.T
+    games = wins + losses + numpy.diag(mirrors)
+
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+      rate = wins / games
+    rate[numpy.diag(mirrors > 0)] = 0.5
+
+    # only draw for pairs that met, and only once per pair: j's interval
+    # against i mirrors i's against j. resampling a pair's games with
+    # replacement is a binomial draw at the observed win rate
+    met = numpy.triu(games > 0, k=1)
+    met_games = games[met]
+    rng = numpy.random.default_rng(seed)
+    draws = rng.binomial(met_games, rate[met], size=(samples, met_games.size))
+    # draws are small ints, so a sort plus indexing is much cheaper than
+    # numpy.percentile's interpolation
+    draws.sort(axis=0)
+
+    tail = (1 - confidence) / 2
+    low_at = int(tail * (samples - 1))
+    high_at = int(round((1 - tail) * (samples - 1)))
+    low = numpy.full(games.shape, numpy.nan)
+    high = numpy.full(games.shape, numpy.nan)
+    low[met] = draws[low_at] / met_games
+    high[met] = draws[high_at] / met_games
+
+    below = numpy.tril(games > 0, k=-1)
+    low[below] = 1 - high.T[below]
+    high[below] = 1 - low.T[below]
+    return wins, losses, games, rate, low, high
+
+  def save(self, path):
+    numpy.savez(path,
+                decks=numpy.array(self.decks, dtype=str),
+                rounds=numpy.array(self.rounds, dtype=numpy.int64),
+                digests=numpy.array(self.digests, dtype=str),
+                **{
+                    f"wins_{kind}": wins for kind, wins in self.wins.items()
+                })
+
+  @classmethod
+  def load(cls, path):
+    data = numpy.load(path)
+    matrix = cls(data["decks"].tolist())
+    matrix.rounds = data["rounds"].tolist()
+    matrix.round_index = {r: i for i, r in enumerate(matrix.rounds)}
+    # state saved before digests were kept has every round recounted once
+    if "digests" in data.files:
+      matrix.digests = data["digests"].tolist()
+    else:
+      matrix.digests = [""] * len(matrix.rounds)
+    for kind in KINDS:
+      matrix.wins[kind] = data[f"wins_{kind}"]
+    return matrix
+
+
+def write_matrix(matrix,
+                 main_dir,
+                 format=writers.DEFAULT_FORMAT,
+                 samples=DEFAULT_BOOTSTRAP,
+                 confidence=DEFAULT_CONFIDENCE):
+  """
+  Writes deck_matrix (one row per kind and deck pair that met) and the
+  state file the next incremental update starts from.
+  """
+
+  base_path = os.path.join(main_dir, "deck_matrix")
+  with writers.open_writer(base_path, MATRIX_FIELDS, format) as writer:
+    for kind in KINDS:
+      wins, losses, games, rate, low, high = matrix.win_rates(
+          kind, samples=samples, confidence=confidence)
+      for i, j in zip(*numpy.nonzero(games)):
+        if i == j:
+          writer.writerow([
+              kind, matrix.decks[i], matrix.decks[j], None, None, games[i, j],
+              f"{rate[i, j]:.4f}", None, None
+          ])
+          continue
+        writer.writerow([
+            kind, matrix.decks[i], matrix.decks[j], wins[i, j], losses[i, j],
+            games[i, j], f"{rate[i, j]:.4f}", f"{low[i, j]:.4f}",
+            f"{high[i, j]:.4f}"
+        ])
+
+  matrix.save(os.path.join(main_dir, STATE_NAME))
+  return writer.path
+
+
+def update_from_rows(matrix, rows):
+  """
+  rows are deck_matches rows as dicts. Rounds whose records (decks and core
+  flags) are the ones the matrix already counted are skipped; any other
+  round is recounted. Returns the rounds that were recounted.
+  """
+
+  by_round = {}
+  for row in rows:
+    by_round.setdefault(int(row["round"]), []).append(row)
+
+  updated = []
+  for round, round_rows in sorted(by_round.items()):
+    winners = [r["winner_deck"] for r in round_rows]
+    losers = [r["loser_deck"] for r in round_rows]
+    core = [r["core_record"] == "y" for r in round_rows]
+    if not matrix.round_changed(round, round_digest(winners, losers, core)):
+      continue
+    matrix.set_round(round, winners, losers, core)
+    updated.append(round)
+
+  return updated
+
+
+def main():
+  args = parser.parse_args()
+  main_dir = os.path.abspath(args.dir)
+  log_config.configure(log_config.log_path(os.path.join(main_dir, "logs"),
+                                           FILENAME),
+                       level=args.log_level)
+
+  state_path = os.path.join(main_dir, STATE_NAME)
+  try:
+    matrix = DeckMatrix.load(state_path)
+  except FileNotFoundError:
+    matrix = DeckMatrix()
+
+  updated = update_from_rows(
+      matrix,
+      writers.read_rows(os.path.join(main_dir, "deck_matches"), args.format))
+
+  if not updated:
+    log("no new rounds")
+    return
+
+  log(f"recounted rounds: {', '.join(str(r) for r in updated)}")
+  path = write_matrix(matrix,
+                      main_dir,
+                      format=args.format,
+                      samples=args.bootstrap,
+                      confidence=args.confidence)
+  log(f"output written to {path}")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,7 +1,6 @@
 import argparse
 from collections import defaultdict, Counter, namedtuple
 import csv
-import datetime
 import logging
 import os
 import pprint
@@ -10,32 +9,54 @@ import traceback
 
 import inquirer
 
-FILENAME = os.path.basename(__file__)
+import identity_store
+import log_config
+import metrics
+import name_index
+import profiling
+import writers
+
+try:
+  import deck_matrix
+except ImportError:
+  deck_matrix = None
 
-run_timestamp = datetime.datetime.now()
+FILENAME = os.path.basename(__file__)
 
 pp = pprint.PrettyPrinter(indent=2)
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--dir', type=str, required=True)
-
-args = parser.parse_args()
-
-main_dir = os.path.abspath(args.dir or ".")
-log_dir = os.path.join(main_dir, "logs")
-
-try:
-  os.mkdir(log_dir)
-except FileExistsError:
-  pass
-
-log_name = f"{FILENAME}-{run_timestamp:%Y%m%d}.log"
-log_path = os.path.join(log_dir, log_name)
-
-logging.basicConfig(format='[%(asctime)s] %(message)s',
-                    filename=log_path,
-                    level=logging.DEBUG)
-logger = logging.getLogger()
+parser.add_argument('--format',
+                    choices=writers.FORMATS,
+                    default=writers.DEFAULT_FORMAT,
+                    help="format of the deck_* outputs")
+parser.add_argument('--no-prompt',
+                    action='store_true',
+                    help="record unresolved players as mismatches instead of "
+                    "asking")
+parser.add_argument('--auto-accept',
+                    type=float,
+                    default=name_index.DEFAULT_AUTO_ACCEPT,
+                    help="take a form name without asking when it matches "
+                    "at least this well (0..1; above 1 always asks)")
+parser.add_argument('--identities',
+                    type=str,
+                    metavar="DB",
+                    help="sqlite store of players' form names, shared across "
+                    "events; consulted before asking and updated with answers")
+parser.add_argument('--platform',
+                    choices=["rk9", "bcp", "battlefy"],
+                    help="platform the rankings' player_ids come from; "
+                    "without it --identities matches by discord and name only")
+parser.add_argument('--candidates',
+                    type=int,
+                    default=name_index.DEFAULT_CANDIDATES,
+                    help="form names offered per unresolved player")
+metrics.add_arguments(parser)
+profiling.add_arguments(parser)
+
+logger = logging.getLogger(__name__)
 
 
 def log(msg, print_dest="stderr"):
@@ -77,7 +98,7 @@ IgnoredName = namedtuple('IgnoredName',
                          ['ranking', 'pairing_record_name', 'reason'])
 
 
-def read_csv(fname, tuple_type):
+def read_csv(main_dir, fname, tuple_type):
   path = os.path.join(main_dir, fname)
   with open(path, newline='') as csvfile:
     reader = csv.DictReader(csvfile)
@@ -107,7 +128,7 @@ def get_indexed_fields(d, field_name):
   return l
 
 
-def read_deck_submissions_csv(fname):
+def read_deck_submissions_csv(main_dir, fname):
   path = os.path.join(main_dir, fname)
   with open(path, newline='') as csvfile:
     reader = csv.DictReader(csvfile)
@@ -119,83 +140,156 @@ def read_deck_submissions_csv(fname):
   return l
 
 
-def write_csv(fname, rows, tuple_type):
+def write_csv(main_dir, fname, rows, tuple_type):
+  # these are read back in on the next run, so they stay plain csv
   path = os.path.join(main_dir, fname)
-  with open(path, 'w') as csvfile:
-    writer = csv.DictWriter(csvfile, fieldnames=tuple_type._fields)
-    writer.writeheader()
-    for row in rows:
-      writer.writerow(row._asdict())
-
+  with writers.CSVWriter(path, tuple_type._fields) as writer:
+    writer.writerows(rows)
+
+
+class EventContext:
+  """
+  Everything read from one event directory (submitted decks, match/game
+  records, rankings, overrides and ignored names) and the lookups built from
+  it. Each step of a run reads from and writes to one of these instead of
+  module globals, so any number of events can be processed in one process.
+  """
+
+  def __init__(self,
+               main_dir,
+               format=writers.DEFAULT_FORMAT,
+               interactive=True,
+               print_dest="stderr",
+               auto_accept=name_index.DEFAULT_AUTO_ACCEPT,
+               candidates=name_index.DEFAULT_CANDIDATES,
+               identities=None,
+               platform=None):
+    self.main_dir = os.path.abspath(main_dir)
+    self.format = format
+    self.interactive = interactive
+    self.auto_accept = auto_accept
+    self.candidates = candidates
+    # an identity_store.IdentityStore, or None
+    self.identities = identities
+    self.platform = platform
+    self.print_dest = print_dest
+
+    self.sub_decks = []
+    self.matches = []
+    self.games = []
+    self.rankings = []
+
+    self.ranking_by_pid = {}
+    self.ranking_by_discord = {}
+    self.ranking_by_rname = {}
+    self.num_players = 0
+
+    self.record_name_by_pid = {}
+    self.override_dict = {}
+    self.ignored_names = set()
+
+    self.sub_player_counts = Counter()
+    self.record_player_names = set()
+
+    self.decks_by_sub_player = {}
+    self.sub_name_index = None
+    self.player_mapping_by_rank = {}
+    self.num_bad_players = 0
+
+  def log(self, msg):
+    log(msg, print_dest=self.print_dest)
+
+  def read_csv(self, fname, tuple_type):
+    return read_csv(self.main_dir, fname, tuple_type)
+
+  def write_csv(self, fname, rows, tuple_type):
+    write_csv(self.main_dir, fname, rows, tuple_type)
+
+  def load(self):
+    self.sub_decks = read_deck_submissions_csv(self.main_dir,
+                                               "submitted_decks.csv")
+
+    self.matches = self.read_csv("matches.csv", GameRecord)
 
-# --- main ---
-
-sub_decks = read_deck_submissions_csv("submitted_decks.csv")
-
-matches = read_csv("matches.csv", GameRecord)
+    try:
+      self.games = self.read_csv("games.csv", GameRecord)
+    except FileNotFoundError:
+      self.games = []
 
-try:
-  games = read_csv("games.csv", GameRecord)
-except FileNotFoundError:
-  games = []
+    try:
+      self.rankings = self.read_csv("rankings.csv", RankingRecord)
+    except FileNotFoundError:
+      self.rankings = []
+
+    rankings = self.rankings
+    self.ranking_by_pid = {
+        r.player_id: int(r.ranking) for r in rankings if r.player_id
+    }
+    self.ranking_by_discord = {
+        r.discord: int(r.ranking) for r in rankings if r.discord
+    }
+    self.ranking_by_rname = {
+        r.name.strip().lower(): int(r.ranking) for r in rankings
+    }
+    self.num_players = len(rankings)
+
+    self.log(f"num_players: {self.num_players}")
+    self.log(f"ranking_by_rname len: {len(self.ranking_by_rname)}")
+
+    # this would seem like the logical solution, but the whole reason to start
+    # using pid is that ranking names didn't match pairing names
+    # record_name_by_pid = {r["player_id"]: r["name"] for r in rankings}
+    self.record_name_by_pid = get_record_name_by_pid(self.matches)
 
-try:
-  rankings = read_csv("rankings.csv", RankingRecord)
-except FileNotFoundError:
-  rankings = []
+    try:
+      overrides = self.read_csv("overrides.csv", NameMapping)
+      self.override_dict = {int(o.ranking): o for o in overrides}
+    except FileNotFoundError:
+      self.override_dict = {}
 
-ranking_by_pid = {r.player_id: int(r.ranking) for r in rankings if r.player_id}
-ranking_by_discord = {r.discord: int(r.ranking) for r in rankings if r.discord}
-ranking_by_rname = {r.name.strip().lower(): int(r.ranking) for r in rankings}
-num_players = len(rankings)
+    try:
+      rows = self.read_csv("ignored_names.csv", IgnoredName)
+      self.ignored_names = set(
+          r.pairing_record_name.strip().lower() for r in rows)
+    except FileNotFoundError:
+      self.ignored_names = set()
 
-log(f"num_players: {num_players}")
-log(f"ranking_by_rname len: {len(ranking_by_rname)}")
+    for submission in self.sub_decks:
+      full_name = submission.player_name
+      self.sub_player_counts[full_name] += 1
 
-# this would seem like the logical solution, but the whole reason to start
-# using pid is that ranking names didn't match pairing names
-# record_name_by_pid = {r["player_id"]: r["name"] for r in rankings}
-record_name_by_pid = {}
+    for sub_player, count in self.sub_player_counts.items():
+      if count > 1 and sub_player not in self.ignored_names:
+        raise Exception(f"multiple submissions for {sub_player}")
 
-try:
-  overrides = read_csv("overrides.csv", NameMapping)
-  override_dict = {int(o.ranking): o for o in overrides}
-except FileNotFoundError:
-  override_dict = {}
+    for ranking in rankings:
+      name = ranking.name.strip().lower()
+      self.record_player_names.add(name)
 
-try:
-  rows = read_csv("ignored_names.csv", IgnoredName)
-  ignored_names = set(r.pairing_record_name.strip().lower() for r in rows)
-except FileNotFoundError:
-  ignored_names = set()
-
-sub_player_counts = Counter()
-sub_players_by_word = defaultdict(set)
-for submission in sub_decks:
-  full_name = submission.player_name
-  words = full_name.split()
-  for word in words:
-    sub_players_by_word[word].add(full_name)
-  sub_player_counts[full_name] += 1
-
-for sub_player, count in sub_player_counts.items():
-  if count > 1 and sub_player not in ignored_names:
-    log(f"FATAL error: multiple submissions for {sub_player}")
-    sys.exit(1)
 
-form_sub_players = set(sub_player_counts.keys())
+def get_record_name_by_pid(records):
+  """
+  pid -> the (lowercased) name the pairings use for that player, from the
+  last non-bye record they appear in.
+  """
 
-record_player_names = set()
-for ranking in rankings:
-  name = ranking.name.strip().lower()
-  record_player_names.add(name)
+  record_name_by_pid = {}
+  for record in records:
+    record_loser = record.loser.strip().lower()
+    if not record_loser:
+      continue
+    if record.winner_pid:
+      record_name_by_pid[record.winner_pid] = record.winner.strip().lower()
+    if record.loser_pid:
+      record_name_by_pid[record.loser_pid] = record_loser
+  return record_name_by_pid
 
 
-def make_deck_mapping():
+def make_deck_mapping(ctx):
 
   deck_dict = {}
 
-  for submission in sub_decks:
+  for submission in ctx.sub_decks:
     sub_player_name = submission.player_name.strip().lower()
     deck_labels = submission.deck_types + submission.tag_counts
     deck_dict[sub_player_name] = [l for l in deck_labels if l]
@@ -204,35 +298,57 @@ def make_deck_mapping():
   return deck_dict
 
 
-def sub_name_for_record_player(player):
+def sub_name_for_record_player(ctx, player):
   if not player:
     return None, []
 
-  if player in form_sub_players:
+  if player in ctx.decks_by_sub_player:
     return player, []
 
-  share_word = set()
-  words = player.split()
-  for word in words:
-    share_word.update(sub_players_by_word.get(word, set()))
+  sub_name = ctx.sub_name_index.best(player, threshold=ctx.auto_accept)
+  if sub_name is not None:
+    ctx.log(f"matched name: {player} -> {sub_name}")
+    return sub_name, []
 
-  share_word = sorted(share_word)
   guesses = [
-      f'* {g}' if g in record_player_names else f'- {g}' for g in share_word
+      f'* {g}' if g in ctx.record_player_names else f'- {g}'
+      for _, g in ctx.sub_name_index.lookup(player, k=ctx.candidates)
   ]
 
-  if len(guesses) > 0:
-    return None, guesses
+  return None, guesses
 
-  return None, []
 
+def known_sub_name(ctx, rec_player, rec_name):
+  if ctx.identities is None:
+    return None
 
-def make_player_mapping():
+  form_name = ctx.identities.lookup(ctx.platform, rec_player.player_id,
+                                    rec_player.discord, rec_name)
+  if form_name is None:
+    return None
+  if form_name in ctx.decks_by_sub_player:
+    return form_name
+  # they may have typed their name a little differently on this event's form
+  return ctx.sub_name_index.best(form_name, threshold=ctx.auto_accept)
+
+
+def remember_sub_name(ctx, rec_player, rec_name, sub_name):
+  if ctx.identities is None or not sub_name:
+    return
+
+  ctx.identities.record(sub_name, ctx.platform, rec_player.player_id,
+                        rec_player.discord, rec_name)
+
+
+def make_player_mapping(ctx):
+  override_dict = ctx.override_dict
   dict = override_dict.copy()
   mismatch_count = 0
 
-  reject_following = False
-  for rec_player in sorted(rankings, key=lambda x: x.name):
+  # without a terminal to ask, treat every guess as rejected; the players
+  # end up in mismatched_players.csv for the next interactive run
+  reject_following = not ctx.interactive
+  for rec_player in sorted(ctx.rankings, key=lambda x: x.name):
     rec_name = rec_player.name.strip().lower()
     rec_rank = int(rec_player.ranking)
 
@@ -241,23 +357,36 @@ def make_player_mapping():
     if not rec_name:
       continue
 
-    if rec_name in ignored_names:
+    if rec_name in ctx.ignored_names:
       continue
 
     override_mapping = override_dict.get(rec_rank)
     if override_mapping and (override_mapping.form_submitted_name or
                              override_mapping.deck_type):
-      log(f"skipping name: {rec_name} (already mapped)")
+      ctx.log(f"skipping name: {rec_name} (already mapped)")
+      if override_mapping.form_submitted_name in ctx.decks_by_sub_player:
+        remember_sub_name(ctx, rec_player, rec_name,
+                          override_mapping.form_submitted_name)
+      continue
+
+    sub_name = known_sub_name(ctx, rec_player, rec_name)
+    if sub_name is not None:
+      ctx.log(f"known player: {rec_name} -> {sub_name}")
+      dict[rec_rank] = NameMapping(rec_rank, rec_name, sub_name)
+      override_dict.pop(rec_rank, None)
       continue
 
-    sub_name, guesses = sub_name_for_record_player(rec_name)
+    sub_name, guesses = sub_name_for_record_player(ctx, rec_name)
     if sub_name is not None:
+      # only exact matches are remembered; fuzzy ones aren't confirmed
+      if sub_name == rec_name:
+        remember_sub_name(ctx, rec_player, rec_name, sub_name)
       dict[rec_rank] = NameMapping(rec_rank, rec_name, sub_name)
       override_dict.pop(rec_rank, None)
       continue
 
     if not guesses:
-      log(f"player not found: {rec_name}")
+      ctx.log(f"player not found: {rec_name}")
       override_dict[rec_rank] = empty_mapping
       mismatch_count += 1
       continue
@@ -283,7 +412,7 @@ def make_player_mapping():
     answers = inquirer.prompt([question])
     answer = answers["chosen_guess"].strip('*- ')
     if answer == reject:
-      log(f"player not found: {rec_name}")
+      ctx.log(f"player not found: {rec_name}")
       override_dict[rec_rank] = empty_mapping
       mismatch_count += 1
     elif answer == reject_all:
@@ -294,21 +423,18 @@ def make_player_mapping():
       mapping = NameMapping(rec_rank, rec_name, answer)
       dict[rec_rank] = mapping
       override_dict[rec_rank] = mapping
+      remember_sub_name(ctx, rec_player, rec_name, answer)
 
   return dict, mismatch_count
 
 
-decks_by_sub_player = make_deck_mapping()
-player_mapping_by_rank, num_bad_players = make_player_mapping()
-
-
 # returns: list of deck types, form_submitted_name
-def get_deck_types_for_rank(ranking):
-  mapping = player_mapping_by_rank.get(ranking)
+def get_deck_types_for_rank(ctx, ranking):
+  mapping = ctx.player_mapping_by_rank.get(ranking)
   # log(f"looking up deck for ranking {ranking}, mapping: {mapping}")
 
   if not mapping:
-    log(f"broken ranking: no mapping for {ranking}")
+    ctx.log(f"broken ranking: no mapping for {ranking}")
     # log_callstack()
     return [], None
 
@@ -318,26 +444,23 @@ def get_deck_types_for_rank(ranking):
   sub_name = mapping.form_submitted_name
 
   if not sub_name:
-    log(f"broken ranking: {mapping.pairing_record_name}")
+    ctx.log(f"broken ranking: {mapping.pairing_record_name}")
     return [], None
 
-  return decks_by_sub_player[sub_name], sub_name
+  return ctx.decks_by_sub_player[sub_name], sub_name
 
 
-def write_deck_rankings():
+def write_deck_rankings(ctx):
   broken_rankings = 0
   ignored_rankings = 0
 
-  if len(rankings) == 0:
+  if len(ctx.rankings) == 0:
     return broken_rankings, ignored_rankings
 
-  output_path = os.path.join(main_dir, f"deck_rankings.csv")
-  with open(output_path, "w") as f:
-    writer = csv.writer(f)
-    writer.writerow(
-        ["ranking", "deck", "pairing name", "form name", "pid", "discord"])
-
-    for ranking_row in rankings:
+  base_path = os.path.join(ctx.main_dir, f"deck_rankings")
+  cols = ["ranking", "deck", "pairing name", "form name", "pid", "discord"]
+  with writers.open_writer(base_path, cols, ctx.format) as writer:
+    for ranking_row in ctx.rankings:
       ranking = int(ranking_row.ranking)
       ranking_name = ranking_row.name.strip().lower()
       pid = ranking_row.player_id
@@ -345,14 +468,15 @@ def write_deck_rankings():
 
       if pid:
         try:
-          record_name = record_name_by_pid[pid]
+          record_name = ctx.record_name_by_pid[pid]
         except KeyError:
-          log(f"ranking for {ranking_name} ignored b/c they have no records")
+          ctx.log(
+              f"ranking for {ranking_name} ignored b/c they have no records")
           continue
       else:
         record_name = ranking_name
 
-      deck_types, sub_name = get_deck_types_for_rank(ranking)
+      deck_types, sub_name = get_deck_types_for_rank(ctx, ranking)
       if len(deck_types) == 0:
         broken_rankings += 1
         continue
@@ -362,29 +486,34 @@ def write_deck_rankings():
   return broken_rankings, ignored_rankings
 
 
-def write_deck_records(record_type, records):
+def write_deck_records(ctx, record_type, records, matrix=None):
+  """
+  Writes the deck_{record_type} rows; with a deck_matrix.DeckMatrix, also
+  counts the same deck pairs into it round by round.
+  """
+
   broken_records = 0
   ignored_records = 0
   core_count = 0
   extra_count = 0
   bye_count = 0
+  # round -> (winner decks, loser decks, is core)
+  matrix_rounds = defaultdict(lambda: ([], [], []))
+
+  base_path = os.path.join(ctx.main_dir, f"deck_{record_type}")
+  cols = [
+      "round",
+      "table",
+      "winner",
+      "loser",
+      "winner_deck",
+      "loser_deck",
+      "core_record",
+      "winner_ranking",
+      "loser_ranking",
+  ]
 
-  output_path = os.path.join(main_dir, f"deck_{record_type}.csv")
-  with open(output_path, "w") as f:
-    cols = [
-        "round",
-        "table",
-        "winner",
-        "loser",
-        "winner_deck",
-        "loser_deck",
-        "core_record",
-        "winner_ranking",
-        "loser_ranking",
-    ]
-
-    writer = csv.writer(f)
-    writer.writerow(cols)
+  with writers.open_writer(base_path, cols, ctx.format) as writer:
     for record in records:
       round = record.round
       table = record.table
@@ -402,40 +531,33 @@ def write_deck_records(record_type, records):
       # log(f"-- r{round} t{table}")
       # log(f"record: {record_winner} vs {record_loser}")
 
-      if winner_pid:
-        record_name_by_pid[winner_pid] = record_winner
-      if loser_pid:
-        record_name_by_pid[loser_pid] = record_loser
-
-      if not record_loser:
-        continue
-
+      ignored_names = ctx.ignored_names
       if record_winner in ignored_names or record_loser in ignored_names:
         ignored_records += 1
         continue
 
-      max_rank = num_players + 1
+      max_rank = ctx.num_players + 1
 
-      winner_rank = (ranking_by_pid.get(winner_pid) or
-                     ranking_by_discord.get(winner_discord) or
-                     ranking_by_rname.get(record_winner) or max_rank)
+      winner_rank = (ctx.ranking_by_pid.get(winner_pid) or
+                     ctx.ranking_by_discord.get(winner_discord) or
+                     ctx.ranking_by_rname.get(record_winner) or max_rank)
 
-      loser_rank = (ranking_by_pid.get(loser_pid) or
-                    ranking_by_discord.get(loser_discord) or
-                    ranking_by_rname.get(record_loser) or max_rank)
+      loser_rank = (ctx.ranking_by_pid.get(loser_pid) or
+                    ctx.ranking_by_discord.get(loser_discord) or
+                    ctx.ranking_by_rname.get(record_loser) or max_rank)
 
-      winner_decks, sub_winner = get_deck_types_for_rank(winner_rank)
-      loser_decks, sub_loser = get_deck_types_for_rank(loser_rank)
+      winner_decks, sub_winner = get_deck_types_for_rank(ctx, winner_rank)
+      loser_decks, sub_loser = get_deck_types_for_rank(ctx, loser_rank)
 
       # log(f"winner_decks: {winner_decks} vs {loser_decks}")
 
       if len(winner_decks) == 0 or len(loser_decks) == 0:
         log(f"broken {record_type} record: {record}", print_dest=None)
-        log(f"rank: {winner_rank} vs {loser_rank}")
+        ctx.log(f"rank: {winner_rank} vs {loser_rank}")
         if len(winner_decks) == 0:
-          log(f"no winner decks")
+          ctx.log(f"no winner decks")
         if len(loser_decks) == 0:
-          log(f"no loser decks")
+          ctx.log(f"no loser decks")
         broken_records += 1
         continue
 
@@ -466,52 +588,196 @@ def write_deck_records(record_type, records):
 
         writer.writerow(row)
 
+        if matrix is not None:
+          winners, losers, core = matrix_rounds[int(round)]
+          winners.append(winner_deck)
+          losers.append(loser_deck)
+          core.append(is_core_record)
+
+  for round, (winners, losers, core) in matrix_rounds.items():
+    matrix.set_round(round, winners, losers, core)
+
   return broken_records, ignored_records, core_count, extra_count, bye_count
 
 
-if override_dict:
-  items = sorted(override_dict.values(), key=lambda x: int(x.ranking))
-  write_csv("overrides.csv", items, NameMapping)
+def write_overrides(ctx):
+  if not ctx.override_dict:
+    return
+
+  items = sorted(ctx.override_dict.values(), key=lambda x: int(x.ranking))
+  ctx.write_csv("overrides.csv", items, NameMapping)
 
   mismatches = [
       o for o in items if (not (o.form_submitted_name or o.deck_type) and
-                           o.pairing_record_name not in ignored_names)
+                           o.pairing_record_name not in ctx.ignored_names)
   ]
   if mismatches:
-    write_csv("mismatched_players.csv", mismatches, NameMapping)
+    ctx.write_csv("mismatched_players.csv", mismatches, NameMapping)
   else:
     try:
-      os.remove(os.path.join(main_dir, "mismatched_players.csv"))
+      os.remove(os.path.join(ctx.main_dir, "mismatched_players.csv"))
     except FileNotFoundError:
       pass
 
-(broken_matches, ignored_matches, core_matches, extra_matches,
- match_byes) = write_deck_records("matches", matches)
-
-(broken_rankings, ignored_rankings) = write_deck_rankings()
-
-if len(games) > 0:
-  (broken_games, ignored_games, core_games, extra_games,
-   game_byes) = write_deck_records("games", games)
-
-log(f"")
-log(f"ignored matches: {ignored_matches} (of {len(matches)})")
-if len(games) > 0:
-  log(f"ignored games: {ignored_games} (of {len(games)})")
-log(f"")
-log(f"mismatched players: {num_bad_players} (of {len(sub_decks)})")
-log(f"")
-log(f"broken matches: {broken_matches} (of {len(matches)})")
-log(f"match byes: {match_byes}")
-if len(games) > 0:
-  log(f"broken games: {broken_games} (of {len(games)})")
-  log(f"game byes: {game_byes}")
-log(f"")
-log(f"core matches: {core_matches}, extra matches: {extra_matches}")
-if len(games) > 0:
-  log(f"core games: {core_games}, extra games: {extra_games}")
-log(f"")
-log(f"broken rankings: {broken_rankings}")
-log(f"ignored rankings: {ignored_rankings}")
-log(f"total players: {len(rankings)}")
-log(f"")
+
+def log_summary(ctx, stats):
+  num_matches = len(ctx.matches)
+  num_games = len(ctx.games)
+
+  ctx.log(f"")
+  ctx.log(f"ignored matches: {stats['ignored_matches']} (of {num_matches})")
+  if num_games > 0:
+    ctx.log(f"ignored games: {stats['ignored_games']} (of {num_games})")
+  ctx.log(f"")
+  ctx.log(f"mismatched players: {ctx.num_bad_players} "
+          f"(of {len(ctx.sub_decks)})")
+  ctx.log(f"")
+  ctx.log(f"broken matches: {stats['broken_matches']} (of {num_matches})")
+  ctx.log(f"match byes: {stats['match_byes']}")
+  if num_games > 0:
+    ctx.log(f"broken games: {stats['broken_games']} (of {num_games})")
+    ctx.log(f"game byes: {stats['game_byes']}")
+  ctx.log(f"")
+  ctx.log(f"core matches: {stats['core_matches']}, "
+          f"extra matches: {stats['extra_matches']}")
+  if num_games > 0:
+    ctx.log(f"core games: {stats['core_games']}, "
+            f"extra games: {stats['extra_games']}")
+  ctx.log(f"")
+  ctx.log(f"broken rankings: {stats['broken_rankings']}")
+  ctx.log(f"ignored rankings: {stats['ignored_rankings']}")
+  ctx.log(f"total players: {len(ctx.rankings)}")
+  ctx.log(f"")
+
+
+def run(ctx):
+  """
+  Loads the event in ctx, resolves players to their submitted decks and
+  writes the deck_* outputs and overrides. Returns a dict of counts.
+  """
+
+  with metrics.phase("load"):
+    ctx.load()
+  with metrics.phase("deck_mapping"):
+    ctx.decks_by_sub_player = make_deck_mapping(ctx)
+    # keys are the stripped, lowercased form names decks are looked up by
+    ctx.sub_name_index = name_index.NameIndex(ctx.decks_by_sub_player)
+  # includes any time spent answering prompts
+  with metrics.phase("player_mapping") as phase:
+    ctx.player_mapping_by_rank, ctx.num_bad_players = make_player_mapping(ctx)
+    phase.rows = len(ctx.player_mapping_by_rank)
+
+  with metrics.phase("write.overrides"):
+    write_overrides(ctx)
+
+  matrix = deck_matrix.DeckMatrix() if deck_matrix is not None else None
+
+  stats = {"mismatched_players": ctx.num_bad_players}
+  with metrics.phase("write.deck_matches") as phase:
+    (stats["broken_matches"], stats["ignored_matches"], stats["core_matches"],
+     stats["extra_matches"],
+     stats["match_byes"]) = write_deck_records(ctx,
+                                               "matches",
+                                               ctx.matches,
+                                               matrix=matrix)
+    phase.rows = len(ctx.matches)
+
+  if matrix is not None:
+    with metrics.phase("deck_matrix"):
+      path = deck_matrix.write_matrix(matrix, ctx.main_dir, format=ctx.format)
+    ctx.log(f"output written to {path}")
+  else:
+    # always on stderr, even in batch runs, since the output is just missing
+    log("numpy isn't installed; skipping deck_matrix (install it with "
+        "`poetry install -E matrix`)")
+
+  with metrics.phase("write.deck_rankings") as phase:
+    (stats["broken_rankings"],
+     stats["ignored_rankings"]) = write_deck_rankings(ctx)
+    phase.rows = len(ctx.rankings)
+
+  if len(ctx.games) > 0:
+    with metrics.phase("write.deck_games") as phase:
+      (stats["broken_games"], stats["ignored_games"], stats["core_games"],
+       stats["extra_games"],
+       stats["game_byes"]) = write_deck_records(ctx, "games", ctx.games)
+      phase.rows = len(ctx.games)
+
+  log_summary(ctx, stats)
+  return stats
+
+
+def open_event_log(main_dir):
+  """
+  Adds a handler logging to main_dir/logs for the duration of one event's
+  run; returns it so the caller can remove it. Batch runs switch files per
+  event, so this writes directly rather than through log_config's queue.
+  """
+
+  log_dir = os.path.join(main_dir, "logs")
+  os.makedirs(log_dir, exist_ok=True)
+
+  handler = logging.FileHandler(log_config.log_path(log_dir, FILENAME))
+  handler.setFormatter(logging.Formatter(log_config.FORMAT))
+  root = logging.getLogger()
+  root.addHandler(handler)
+  root.setLevel(logging.INFO)
+  return handler
+
+
+def process_event(main_dir,
+                  format=writers.DEFAULT_FORMAT,
+                  interactive=True,
+                  print_dest="stderr",
+                  auto_accept=name_index.DEFAULT_AUTO_ACCEPT,
+                  candidates=name_index.DEFAULT_CANDIDATES,
+                  identities_path=None,
+                  platform=None):
+  identities = None
+  if identities_path:
+    identities = identity_store.IdentityStore(identities_path)
+
+  ctx = EventContext(main_dir,
+                     format=format,
+                     interactive=interactive,
+                     print_dest=print_dest,
+                     auto_accept=auto_accept,
+                     candidates=candidates,
+                     identities=identities,
+                     platform=platform)
+  handler = open_event_log(ctx.main_dir)
+  try:
+    return run(ctx)
+  finally:
+    logging.getLogger().removeHandler(handler)
+    handler.close()
+    if identities is not None:
+      identities.close()
+
+
+def main():
+  args = parser.parse_args()
+
+  log_dir = os.path.join(os.path.abspath(args.dir or "."), "logs")
+  metrics.configure(args.metrics or metrics.summary_path(log_dir, FILENAME),
+                    textfile=args.prometheus_textfile,
+                    job=FILENAME)
+  if args.profile:
+    profiling.start(log_dir, FILENAME)
+
+  try:
+    process_event(args.dir or ".",
+                  format=args.format,
+                  interactive=not args.no_prompt,
+                  auto_accept=args.auto_accept,
+                  candidates=args.candidates,
+                  identities_path=args.identities,
+                  platform=args.platform)
+  except Exception as e:
+    logger.info(traceback.format_exc())
+    log(f"FATAL error: {e}")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,162 @@
+import argparse
+import concurrent.futures
+import logging
+import os
+import sys
+import time
+import traceback
+
+import fill_deck_records
+import name_index
+import writers
+
+parser = argparse.ArgumentParser(
+    description="run fill_deck_records over many event directories at once, "
+    "without prompting; unresolved players go to each event's "
+    "mismatched_players.csv")
+parser.add_argument('dirs',
+                    type=str,
+                    nargs='*',
+                    help="event directories (each with a submitted_decks.csv)")
+parser.add_argument('--root',
+                    type=str,
+                    help="also process every subdirectory of ROOT that has a "
+                    "submitted_decks.csv")
+parser.add_argument('--jobs',
+                    type=int,
+                    default=os.cpu_count(),
+                    help="events processed at once")
+parser.add_argument('--format',
+                    choices=writers.FORMATS,
+                    default=writers.DEFAULT_FORMAT,
+                    help="format of the deck_* outputs")
+parser.add_argument('--auto-accept',
+                    type=float,
+                    default=name_index.DEFAULT_AUTO_ACCEPT,
+                    help="take a form name without asking when it matches "
+                    "at least this well (0..1)")
+parser.add_argument('--identities',
+                    type=str,
+                    metavar="DB",
+                    help="sqlite store of players' form names, shared across "
+                    "events")
+parser.add_argument('--platform',
+                    choices=["rk9", "bcp", "battlefy"],
+                    help="platform the rankings' player_ids come from")
+
+logger = logging.getLogger(__name__)
+
+
+def log(msg, print_dest="stderr"):
+  logger.info(msg)
+
+  if print_dest == "stderr":
+    print(msg, file=sys.stderr)
+
+  if print_dest == "stdout":
+    print(msg)
+
+
+def find_event_dirs(root):
+  dirs = []
+  for entry in sorted(os.scandir(root), key=lambda e: e.name):
+    if entry.is_dir() and os.path.exists(
+        os.path.join(entry.path, "submitted_decks.csv")):
+      dirs.append(entry.path)
+  return dirs
+
+
+def run_event(main_dir, format, auto_accept, identities_path, platform):
+  """
+  Runs in a worker process. Each event's details go to its own logs dir;
+  only the returned (dir, seconds, stats, error) reaches the parent.
+  """
+
+  start = time.perf_counter()
+  try:
+    stats = fill_deck_records.process_event(main_dir,
+                                            format=format,
+                                            interactive=False,
+                                            print_dest=None,
+                                            auto_accept=auto_accept,
+                                            identities_path=identities_path,
+                                            platform=platform)
+  except Exception as e:
+    logger.info(traceback.format_exc())
+    return main_dir, time.perf_counter() - start, None, repr(e)
+
+  return main_dir, time.perf_counter() - start, stats, None
+
+
+def run_batch(dirs,
+              jobs,
+              format=writers.DEFAULT_FORMAT,
+              auto_accept=name_index.DEFAULT_AUTO_ACCEPT,
+              identities_path=None,
+              platform=None):
+  """
+  Processes each event directory in a pool of `jobs` processes. Returns a
+  list of (dir, seconds, stats, error) tuples, error being None for events
+  that succeeded.
+  """
+
+  results = []
+  with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+    futures = [
+        executor.submit(run_event, d, format, auto_accept, identities_path,
+                        platform) for d in dirs
+    ]
+    for future in concurrent.futures.as_completed(futures):
+      main_dir, seconds, stats, error = future.result()
+      if error:
+        log(f"FAILED {main_dir} after {seconds:.1f}s: {error}")
+      else:
+        log(f"done {main_dir} in {seconds:.1f}s "
+            f"(mismatched players: {stats['mismatched_players']}, "
+            f"broken matches: {stats['broken_matches']})")
+      results.append((main_dir, seconds, stats, error))
+
+  return results
+
+
+def log_summary(results, elapsed):
+  failures = [r for r in results if r[3]]
+  mismatched = sum(r[2]["mismatched_players"] for r in results if r[2])
+
+  log(f"")
+  log(f"=== batch summary")
+  log(f"events: {len(results)}, failed: {len(failures)}")
+  log(f"mismatched players: {mismatched} "
+      f"(run fill_deck_records.py on those events to resolve them)")
+  log(f"total time: {elapsed:.1f}s, "
+      f"summed event time: {sum(r[1] for r in results):.1f}s")
+  for main_dir, _, _, error in failures:
+    log(f"  {main_dir}: {error}")
+
+
+def main():
+  args = parser.parse_args()
+
+  dirs = list(args.dirs)
+  if args.root:
+    dirs.extend(find_event_dirs(args.root))
+  if not dirs:
+    parser.error("no event directories given")
+
+  log(f"processing {len(dirs)} events ({args.jobs} at once)")
+
+  start = time.perf_counter()
+  results = run_batch(dirs,
+                      args.jobs,
+                      format=args.format,
+                      auto_accept=args.auto_accept,
+                      identities_path=args.identities,
+                      platform=args.platform)
+  log_summary(results, time.perf_counter() - start)
+
+  if any(error for *_, error in results):
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
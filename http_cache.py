@@ -0,0 +1,267 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import time
+
+import http_session
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# layout under the cache dir:
+#   index/<request key>.json        validators + body hash for a url/params
+#   bodies/<hh>/<body hash>.gz      gzipped response bodies, shared by hash
+#   parsed/v<format>/<namespace>/<hash>.pkl
+#                                   parse results keyed on the body hash
+INDEX_DIR = "index"
+BODIES_DIR = "bodies"
+PARSED_DIR = "parsed"
+# parse results are pickles of util's record classes; bump this whenever
+# Match/Game/Player change shape so old pickles are left behind instead of
+# being loaded into the new classes. Parsers version their own namespaces.
+PARSE_FORMAT = 2
+
+_cache = None
+
+
+class CacheMiss(Exception):
+  pass
+
+
+class Response:
+  """
+  The subset of requests.Response that the scrapers use, whether the body
+  came from the network or from the cache.
+  """
+
+  def __init__(self,
+               url,
+               content,
+               status_code=200,
+               encoding=None,
+               headers=None,
+               from_cache=False):
+    self.url = url
+    self.content = content
+    self.status_code = status_code
+    self.encoding = encoding
+    self.headers = headers or {}
+    self.from_cache = from_cache
+    self.body_hash = hashlib.sha256(content).hexdigest()
+
+  @property
+  def text(self):
+    return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+  def json(self):
+    return json.loads(self.content)
+
+
+class ResponseCache:
+
+  def __init__(self, cache_dir, offline=False):
+    self.cache_dir = os.path.abspath(cache_dir)
+    self.offline = offline
+    self.parsed = {}
+
+    for d in (INDEX_DIR, BODIES_DIR, PARSED_DIR):
+      os.makedirs(os.path.join(self.cache_dir, d), exist_ok=True)
+
+  def request_key(self, url, params):
+    params = sorted((str(k), str(v)) for k, v in (params or {}).items())
+    raw = json.dumps([url, params])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+  def index_path(self, key):
+    return os.path.join(self.cache_dir, INDEX_DIR, f"{key}.json")
+
+  def body_path(self, body_hash):
+    return os.path.join(self.cache_dir, BODIES_DIR, body_hash[:2],
+                        f"{body_hash}.gz")
+
+  def parsed_path(self, namespace, body_hash):
+    return os.path.join(self.cache_dir, PARSED_DIR, f"v{PARSE_FORMAT}",
+                        namespace, f"{body_hash}.pkl")
+
+  def read_entry(self, key):
+    try:
+      with open(self.index_path(key)) as f:
+        return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+      return None
+
+  def read_body(self, body_hash):
+    try:
+      with gzip.open(self.body_path(body_hash), "rb") as f:
+        return f.read()
+    except FileNotFoundError:
+      return None
+
+  def store(self, key, url, response):
+    body_hash = response.body_hash
+    body_path = self.body_path(body_hash)
+    if not os.path.exists(body_path):
+      _write_atomic(body_path, gzip.compress(response.content))
+
+    entry = {
+        "url": url,
+        "body_hash": body_hash,
+        "encoding": response.encoding,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "fetched_at": time.time(),
+    }
+    _write_atomic(self.index_path(key), json.dumps(entry).encode())
+    return entry
+
+  def get(self, url, params=None, headers=None):
+    key = self.request_key(url, params)
+    entry = self.read_entry(key)
+    cached_body = self.read_body(entry["body_hash"]) if entry else None
+
+    if cached_body is None:
+      entry = None
+
+    if self.offline:
+      if entry is None:
+        raise CacheMiss(f"offline and not cached: {url} {params or ''}")
+      logger.debug("cache hit (offline): %s", url)
+      metrics.count("http_cache.offline_hits")
+      return Response(url,
+                      cached_body,
+                      encoding=entry["encoding"],
+                      from_cache=True)
+
+    headers = dict(headers or {})
+    if entry:
+      if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+      if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    response = http_session.get(url, params=params, headers=headers)
+
+    if response.status_code == 304 and entry:
+      logger.debug("cache hit (not modified): %s", url)
+      metrics.count("http_cache.not_modified")
+      return Response(url,
+                      cached_body,
+                      encoding=entry["encoding"],
+                      from_cache=True)
+
+    result = Response(url,
+                      response.content,
+                      status_code=response.status_code,
+                      encoding=response.encoding,
+                      headers=response.headers)
+
+    if response.status_code == 200:
+      metrics.count("http_cache.misses")
+      self.store(key, url, result)
+
+    return result
+
+  def load_parsed(self, path):
+    try:
+      with open(path, "rb") as f:
+        return pickle.load(f)
+    except FileNotFoundError:
+      raise CacheMiss(path)
+    except Exception as e:
+      # a truncated or stale pickle can fail in any number of ways; it's only
+      # a cache, so treat it as a miss and let the caller overwrite it
+      logger.warning("unreadable parse cache entry %s: %r", path, e)
+      raise CacheMiss(path)
+
+  def lookup_parsed(self, namespace, response):
+    mem_key = (namespace, response.body_hash)
+    if mem_key in self.parsed:
+      return self.parsed[mem_key]
+
+    try:
+      result = self.load_parsed(self.parsed_path(namespace, response.body_hash))
+    except CacheMiss:
+      metrics.count("parse_cache.misses")
+      raise
+    logger.debug("parse cache hit: %s %s", namespace, response.body_hash)
+    metrics.count("parse_cache.hits")
+
+    self.parsed[mem_key] = result
+    return result
+
+  def store_parsed(self, namespace, response, result):
+    _write_atomic(self.parsed_path(namespace, response.body_hash),
+                  pickle.dumps(result))
+    self.parsed[(namespace, response.body_hash)] = result
+
+  def parse(self, namespace, response, parse_fn):
+    try:
+      return self.lookup_parsed(namespace, response)
+    except CacheMiss:
+      result = parse_fn()
+      self.store_parsed(namespace, response, result)
+      return result
+
+
+def _write_atomic(path, data):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+  with os.fdopen(fd, "wb") as f:
+    f.write(data)
+  os.replace(tmp_path, path)
+
+
+def configure(cache_dir=None, offline=False):
+  global _cache
+
+  if offline and not cache_dir:
+    raise Exception("offline mode requires a cache dir")
+
+  _cache = ResponseCache(cache_dir, offline=offline) if cache_dir else None
+  return _cache
+
+
+def get(url, params=None, headers=None):
+  if _cache:
+    return _cache.get(url, params=params, headers=headers)
+
+  response = http_session.get(url, params=params, headers=headers)
+  result = Response(url,
+                    response.content,
+                    status_code=response.status_code,
+                    encoding=response.encoding,
+                    headers=response.headers)
+  return result
+
+
+def parse(namespace, response, parse_fn):
+  """
+  Returns parse_fn(), reusing an earlier result for the same namespace and
+  response body when the cache is enabled.
+  """
+
+  if _cache:
+    return _cache.parse(namespace, response, parse_fn)
+
+  return parse_fn()
+
+
+def lookup_parsed(namespace, response):
+  """
+  Returns the result cached for the namespace and response body, raising
+  CacheMiss if there isn't one (or the cache is disabled). For parses that
+  can't be wrapped in a parse_fn, e.g. streamed ones; see store_parsed.
+  """
+
+  if not _cache:
+    raise CacheMiss(namespace)
+  return _cache.lookup_parsed(namespace, response)
+
+
+def store_parsed(namespace, response, result):
+  if _cache:
+    _cache.store_parsed(namespace, response, result)
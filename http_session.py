@@ -0,0 +1,139 @@
+import threading
+import time
+import urllib.parse
+
+import requests
+import requests.adapters
+
+import metrics
+import throttle
+
+# urllib3 keeps one pool per host; pool_connections is how many host pools
+# to keep around, pool_maxsize is how many keep-alive connections per host
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+
+DEFAULT_HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+_lock = threading.Lock()
+_session = None
+_settings = {
+    "pool_connections": DEFAULT_POOL_CONNECTIONS,
+    "pool_maxsize": DEFAULT_POOL_MAXSIZE,
+    "timeout": (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+}
+
+
+def configure(pool_connections=DEFAULT_POOL_CONNECTIONS,
+              pool_maxsize=DEFAULT_POOL_MAXSIZE,
+              connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+              read_timeout=DEFAULT_READ_TIMEOUT):
+  """
+  Sets the pool sizes and timeouts for the shared session. Takes effect for
+  the next session created, so call it before any requests are made.
+  """
+
+  _settings["pool_connections"] = pool_connections
+  _settings["pool_maxsize"] = pool_maxsize
+  _settings["timeout"] = (connect_timeout, read_timeout)
+  close()
+
+
+def make_session():
+  session = requests.Session()
+  session.headers.update(DEFAULT_HEADERS)
+
+  # block=True makes extra threads wait for a pooled connection instead of
+  # opening (and then discarding) one-off connections past pool_maxsize
+  adapter = requests.adapters.HTTPAdapter(
+      pool_connections=_settings["pool_connections"],
+      pool_maxsize=_settings["pool_maxsize"],
+      pool_block=True)
+  session.mount("https://", adapter)
+  session.mount("http://", adapter)
+
+  return session
+
+
+def get_session():
+  global _session
+
+  with _lock:
+    if _session is None:
+      _session = make_session()
+    return _session
+
+
+def close():
+  global _session
+
+  with _lock:
+    if _session is not None:
+      _session.close()
+      _session = None
+
+
+def connection_counts():
+  """
+  Connections opened per host by the shared session's pools; fewer than the
+  host's request count means keep-alive is doing its job.
+  """
+
+  with _lock:
+    session = _session
+  if session is None:
+    return {}
+
+  counts = {}
+  for adapter in set(session.adapters.values()):
+    pools = adapter.poolmanager.pools
+    for key in pools.keys():
+      pool = pools.get(key)
+      if pool is not None:
+        counts[pool.host] = counts.get(pool.host, 0) + pool.num_connections
+  return counts
+
+
+metrics.register_collector("connections", connection_counts)
+
+
+def wire_bytes(response):
+  # bytes read off the socket, i.e. before gzip decoding
+  try:
+    return response.raw.tell()
+  except (AttributeError, TypeError):
+    return len(response.content)
+
+
+def get(url, params=None, headers=None):
+  session = get_session()
+  timeout = _settings["timeout"]
+  host = urllib.parse.urlparse(url).netloc
+
+  def send():
+    start = time.perf_counter()
+    try:
+      response = session.get(url,
+                             params=params,
+                             headers=headers,
+                             timeout=timeout)
+    except requests.RequestException as e:
+      metrics.record_request(host,
+                             time.perf_counter() - start,
+                             error=type(e).__name__)
+      raise
+
+    metrics.record_request(host,
+                           time.perf_counter() - start,
+                           status=response.status_code,
+                           ttfb=response.elapsed.total_seconds(),
+                           body_bytes=len(response.content),
+                           wire_bytes=wire_bytes(response))
+    return response
+
+  return throttle.call(url, send)
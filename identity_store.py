@@ -0,0 +1,88 @@
+import datetime
+import sqlite3
+
+from name_index import fold
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS aliases (
+  kind TEXT NOT NULL,
+  key TEXT NOT NULL,
+  form_name TEXT NOT NULL,
+  updated_at TEXT NOT NULL,
+  PRIMARY KEY (kind, key)
+);
+"""
+
+# the ways a player is recognized, most trustworthy first: pids are stable
+# per platform, discord handles are stable everywhere, and pairing names are
+# a last resort since two players can share one
+KINDS = ("pid", "discord", "name")
+
+
+def alias_keys(platform=None, pid=None, discord=None, name=None):
+  keys = []
+  if platform and pid:
+    keys.append(("pid", f"{platform}:{pid}"))
+  if discord:
+    keys.append(("discord", discord.strip().casefold()))
+  if name and fold(name):
+    keys.append(("name", fold(name)))
+  return keys
+
+
+class IdentityStore:
+  """
+  Remembers which form-submitted name a player goes by, keyed by (platform,
+  pid), discord handle and pairing name, across every event it's used for.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    # batch runs open the store from several processes at once
+    self.conn = sqlite3.connect(path, timeout=30)
+    self.conn.execute("PRAGMA journal_mode = WAL")
+    self.conn.executescript(SCHEMA)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def close(self):
+    self.conn.close()
+
+  def lookup(self, platform=None, pid=None, discord=None, name=None):
+    """
+    The form name last confirmed for the first of the player's keys that has
+    one, or None. The name key is only consulted for players with no pid or
+    discord key: one that has them but isn't known by them is a new player,
+    not whoever else went by the same name.
+    """
+
+    keys = alias_keys(platform, pid, discord, name)
+    # a pid only yields a key with a platform, so go by the keys themselves
+    if any(kind != "name" for kind, _ in keys):
+      keys = [(kind, key) for kind, key in keys if kind != "name"]
+
+    for kind, key in keys:
+      row = self.conn.execute(
+          "SELECT form_name FROM aliases WHERE kind = ? AND key = ?",
+          (kind, key)).fetchone()
+      if row:
+        return row[0]
+    return None
+
+  def record(self, form_name, platform=None, pid=None, discord=None, name=None):
+    """
+    Points each of the player's keys at form_name.
+    """
+
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    with self.conn:
+      self.conn.executemany(
+          "INSERT INTO aliases (kind, key, form_name, updated_at) "
+          "VALUES (?, ?, ?, ?) ON CONFLICT (kind, key) DO UPDATE SET "
+          "form_name = excluded.form_name, updated_at = excluded.updated_at",
+          [(kind, key, form_name, now)
+           for kind, key in alias_keys(platform, pid, discord, name)])
@@ -0,0 +1,144 @@
+import atexit
+import datetime
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+FORMAT = '[%(asctime)s] %(name)s: %(message)s'
+LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+DEFAULT_LEVEL = "INFO"
+
+run_timestamp = datetime.datetime.now()
+
+_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+_rate_limited = []
+
+
+def add_arguments(parser):
+  parser.add_argument('--log-level',
+                      choices=LEVELS,
+                      default=DEFAULT_LEVEL,
+                      help="DEBUG also logs every parsed line and element")
+
+
+def log_path(log_dir, filename):
+  return os.path.join(log_dir, f"{filename}-{run_timestamp:%Y%m%d}.log")
+
+
+def configure(path, level=DEFAULT_LEVEL):
+  """
+  Sends every module's records to one log file for this run. Records are
+  handed to a queue and written by a background thread, so logging from a
+  parse loop never waits on disk. Only the first call in a process has any
+  effect; returns whether this was it.
+  """
+
+  global _listener, _queue_handler
+
+  with _lock:
+    if _listener is not None:
+      return False
+
+    log_dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(log_dir, exist_ok=True)
+
+    file_handler = logging.FileHandler(path)
+    file_handler.setFormatter(logging.Formatter(FORMAT))
+
+    records = queue.SimpleQueue()
+    _queue_handler = logging.handlers.QueueHandler(records)
+    _listener = logging.handlers.QueueListener(records, file_handler)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_queue_handler)
+
+  atexit.register(shutdown)
+  return True
+
+
+def shutdown():
+  """
+  Logs the rate-limited totals, flushes queued records and stops the writer
+  thread.
+  """
+
+  global _listener, _queue_handler
+
+  for limited in _rate_limited:
+    limited.summary()
+
+  with _lock:
+    if _listener is None:
+      return
+
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+      handler.close()
+    _listener = None
+    _queue_handler = None
+
+
+class Lazy:
+  """
+  Defers an expensive value until a record is actually written:
+  logger.debug("html: %s", Lazy(lxml.html.tostring, div)).
+  """
+
+  __slots__ = ("fn", "args", "kwargs")
+
+  def __init__(self, fn, *args, **kwargs):
+    self.fn = fn
+    self.args = args
+    self.kwargs = kwargs
+
+  def __str__(self):
+    return str(self.fn(*self.args, **self.kwargs))
+
+
+class RateLimited:
+  """
+  Logs the first `first` records for each key (the message format by
+  default), then one in every `every`, so a page with thousands of malformed
+  elements costs a handful of log lines. summary() logs the totals.
+  """
+
+  def __init__(self, logger, first=10, every=1000):
+    self.logger = logger
+    self.first = first
+    self.every = every
+    self.counts = {}
+    self.lock = threading.Lock()
+    _rate_limited.append(self)
+
+  def log(self, level, msg, *args, key=None):
+    key = key or msg
+    with self.lock:
+      count = self.counts.get(key, 0) + 1
+      self.counts[key] = count
+
+    if count > self.first and count % self.every:
+      return
+    if not self.logger.isEnabledFor(level):
+      return
+
+    if count > self.first:
+      msg = f"{msg} (seen %d times)"
+      args = args + (count,)
+    self.logger.log(level, msg, *args)
+
+  def warning(self, msg, *args, key=None):
+    self.log(logging.WARNING, msg, *args, key=key)
+
+  def summary(self):
+    with self.lock:
+      counts = dict(self.counts)
+    for key, count in counts.items():
+      if count > self.first:
+        self.logger.info("%d times: %s", count, key)
@@ -0,0 +1,193 @@
+from array import array
+
+from util import Match
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# column name -> array typecode
+COLUMNS = {
+    "round": "H",
+    "table": "i",
+    "winner": "i",
+    "loser": "i",
+    "winner_wins": "B",
+    "loser_wins": "B",
+}
+
+# stands in for a table number that isn't an integer
+NO_TABLE = -1
+
+
+def normalize_name(name):
+  return (name or "").strip().lower()
+
+
+class PlayerRegistry:
+  """
+  Interns players as dense integer ids. A player is found by pid first, then
+  discord, then normalized name, so the same id is reused across events on a
+  platform while names are stored (and lowercased) only once. A player first
+  seen by name keeps their id when later seen with a pid, but a name never
+  joins two different pids.
+  """
+
+  def __init__(self):
+    self.names = []
+    self.pids = []
+    self.discords = []
+    self.ids_by_pid = {}
+    self.ids_by_discord = {}
+    self.ids_by_name = {}
+
+  def __len__(self):
+    return len(self.names)
+
+  def lookup(self, name=None, pid=None, discord=None):
+    player_id = self.ids_by_pid.get(pid) if pid else None
+    if player_id is None and discord:
+      player_id = self.compatible(self.ids_by_discord.get(discord), pid)
+    if player_id is None:
+      player_id = self.compatible(self.ids_by_name.get(normalize_name(name)),
+                                  pid)
+    return player_id
+
+  def compatible(self, player_id, pid):
+    # a discord or name match only counts if it isn't someone with another pid
+    if player_id is None or not pid or not self.pids[player_id]:
+      return player_id
+    return player_id if self.pids[player_id] == pid else None
+
+  def intern(self, name, pid=None, discord=None):
+    player_id = self.lookup(name, pid=pid, discord=discord)
+
+    if player_id is None:
+      player_id = len(self.names)
+      self.names.append(name)
+      self.pids.append(pid)
+      self.discords.append(discord)
+      self.ids_by_name.setdefault(normalize_name(name), player_id)
+    else:
+      # fill in whatever this sighting knows that earlier ones didn't
+      if pid and not self.pids[player_id]:
+        self.pids[player_id] = pid
+      if discord and not self.discords[player_id]:
+        self.discords[player_id] = discord
+
+    if pid:
+      self.ids_by_pid[pid] = player_id
+    if discord:
+      self.ids_by_discord.setdefault(discord, player_id)
+
+    return player_id
+
+  def name_key(self, player_id):
+    return normalize_name(self.names[player_id])
+
+
+class MatchTable:
+  """
+  An event's matches as parallel integer columns, with players replaced by
+  ids from a (possibly shared) PlayerRegistry.
+  """
+
+  def __init__(self, registry=None):
+    self.registry = registry if registry is not None else PlayerRegistry()
+    self.columns = {name: array(code) for name, code in COLUMNS.items()}
+
+  def __len__(self):
+    return len(self.columns["round"])
+
+  def __getattr__(self, name):
+    try:
+      return self.__dict__["columns"][name]
+    except KeyError:
+      raise AttributeError(name)
+
+  @classmethod
+  def from_matches(cls, matches, registry=None):
+    table = cls(registry)
+    table.extend(matches)
+    return table
+
+  def extend(self, matches):
+    for match in matches:
+      self.append(match)
+
+  def append(self, match):
+    intern = self.registry.intern
+    columns = self.columns
+
+    try:
+      table = int(match.table)
+    except (TypeError, ValueError):
+      table = NO_TABLE
+
+    columns["round"].append(int(match.round))
+    columns["table"].append(table)
+    columns["winner"].append(
+        intern(match.winner, match.winner_pid, match.winner_discord))
+    columns["loser"].append(
+        intern(match.loser, match.loser_pid, match.loser_discord))
+    columns["winner_wins"].append(match.winner_wins)
+    columns["loser_wins"].append(match.loser_wins)
+
+  def to_matches(self):
+    """
+    Rebuilds util.Match objects. Tables come back as ints (None where the
+    original wasn't a number).
+    """
+
+    registry = self.registry
+    c = self.columns
+    matches = []
+    for i in range(len(self)):
+      w = c["winner"][i]
+      l = c["loser"][i]
+      table = c["table"][i]
+      matches.append(
+          Match(registry.names[w],
+                registry.names[l],
+                None if table == NO_TABLE else table,
+                c["round"][i],
+                c["winner_wins"][i],
+                c["loser_wins"][i],
+                winner_pid=registry.pids[w],
+                loser_pid=registry.pids[l],
+                winner_discord=registry.discords[w],
+                loser_discord=registry.discords[l]))
+    return matches
+
+  def to_numpy(self):
+    """
+    Zero-copy numpy views of the columns, for vectorized analytics.
+    """
+
+    if numpy is None:
+      raise Exception("numpy is required for to_numpy()")
+
+    return {
+        name: numpy.frombuffer(column, dtype=column.typecode)
+        for name, column in self.columns.items()
+    }
+
+  def win_loss_counts(self):
+    """
+    Returns (wins, losses) per player id, indexed by id.
+    """
+
+    num_players = len(self.registry)
+    if numpy is not None:
+      cols = self.to_numpy()
+      return (numpy.bincount(cols["winner"], minlength=num_players),
+              numpy.bincount(cols["loser"], minlength=num_players))
+
+    wins = [0] * num_players
+    losses = [0] * num_players
+    for w in self.columns["winner"]:
+      wins[w] += 1
+    for l in self.columns["loser"]:
+      losses[l] += 1
+    return wins, losses
@@ -0,0 +1,501 @@
+import atexit
+import bisect
+import contextlib
+import datetime
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+import log_config
+
+# upper bounds (seconds) of the request latency histogram buckets, the same
+# ones the prometheus textfile exports
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PROMETHEUS_PREFIX = "rk9_scraper"
+
+_lock = threading.Lock()
+_local = threading.local()
+_phases = {}
+_hosts = {}
+_counters = {}
+_collectors = {}
+_phase_listeners = []
+_outputs = {"json": None, "textfile": None, "job": None}
+
+_started_at = datetime.datetime.now()
+_start_wall = time.perf_counter()
+_start_cpu = time.process_time()
+
+logger = logging.getLogger(__name__)
+
+
+def log(msg, print_dest="stderr"):
+  logger.info(msg)
+
+  if print_dest == "stderr":
+    print(msg, file=sys.stderr)
+
+  if print_dest == "stdout":
+    print(msg)
+
+
+class PhaseStats:
+
+  def __init__(self):
+    self.count = 0
+    self.wall = 0.0
+    self.cpu = 0.0
+    self.self_wall = 0.0
+    self.self_cpu = 0.0
+    self.rows = 0
+
+  def to_dict(self):
+    return {
+        "count":
+            self.count,
+        "wall_seconds":
+            round(self.wall, 6),
+        "cpu_seconds":
+            round(self.cpu, 6),
+        "self_wall_seconds":
+            round(self.self_wall, 6),
+        "self_cpu_seconds":
+            round(self.self_cpu, 6),
+        "rows":
+            self.rows,
+        "rows_per_second":
+            (round(self.rows /
+                   self.self_wall, 1) if self.rows and self.self_wall else None
+            ),
+    }
+
+
+class Phase:
+  """
+  One timed run of a phase. Set or add to `rows` for throughput.
+  """
+
+  __slots__ = ("name", "rows", "child_wall", "child_cpu")
+
+  def __init__(self, name, rows=0):
+    self.name = name
+    self.rows = rows
+    self.child_wall = 0.0
+    self.child_cpu = 0.0
+
+  def add_rows(self, rows):
+    self.rows += rows
+
+
+class HostStats:
+
+  def __init__(self):
+    self.requests = 0
+    self.errors = 0
+    self.retries = 0
+    self.statuses = {}
+    self.body_bytes = 0
+    self.wire_bytes = 0
+    # latencies are kept only as histogram counts plus a sum and max, so a
+    # long scrape's stats stay a fixed size; percentiles are estimated from
+    # the buckets
+    self.latency_sum = 0.0
+    self.latency_max = None
+    self.ttfb = 0.0
+    self.throttle_wait = 0.0
+    self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+  def record_latency(self, seconds):
+    self.latency_sum += seconds
+    if self.latency_max is None or seconds > self.latency_max:
+      self.latency_max = seconds
+    self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+  def percentile(self, p):
+    """
+    Interpolates within the bucket holding the p-th latency, like
+    prometheus' histogram_quantile, capped at the largest latency seen.
+    """
+
+    total = sum(self.buckets)
+    if not total:
+      return None
+
+    rank = p * total
+    seen = 0
+    for i, n in enumerate(self.buckets):
+      if n and seen + n >= rank:
+        if i == len(LATENCY_BUCKETS):
+          return round(self.latency_max, 6)
+        low = LATENCY_BUCKETS[i - 1] if i else 0.0
+        high = LATENCY_BUCKETS[i]
+        estimate = low + (high - low) * (rank - seen) / n
+        return round(min(estimate, self.latency_max), 6)
+      seen += n
+    return round(self.latency_max, 6)
+
+  def to_dict(self):
+    latency_max = self.latency_max
+    if latency_max is not None:
+      latency_max = round(latency_max, 6)
+
+    return {
+        "requests": self.requests,
+        "errors": self.errors,
+        "retries": self.retries,
+        "statuses": {
+            str(k): v for k, v in sorted(self.statuses.items())
+        },
+        "body_bytes": self.body_bytes,
+        "wire_bytes": self.wire_bytes,
+        "latency_seconds": {
+            "sum": round(self.latency_sum, 6),
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": latency_max,
+        },
+        # time to response headers, i.e. dns, connect, tls and server time;
+        # the rest of the latency is the body download
+        "ttfb_seconds": round(self.ttfb, 6),
+        "throttle_wait_seconds": round(self.throttle_wait, 6),
+        "histogram": {
+            "le": list(LATENCY_BUCKETS) + ["+Inf"],
+            "counts": list(self.buckets),
+        },
+    }
+
+
+def _host(host):
+  stats = _hosts.get(host)
+  if stats is None:
+    stats = _hosts[host] = HostStats()
+  return stats
+
+
+@contextlib.contextmanager
+def phase(name, rows=0):
+  """
+  Times the block as phase `name`: wall and cpu time in total and excluding
+  any phases nested inside it on the same thread. Yields a Phase whose rows
+  count toward the phase's rows per second.
+
+  Don't hold a phase open across a yield; a generator's consumer would have
+  its time counted too.
+  """
+
+  stack = getattr(_local, "stack", None)
+  if stack is None:
+    stack = _local.stack = []
+
+  current = Phase(name, rows)
+  stack.append(current)
+  start_wall = time.perf_counter()
+  start_cpu = time.thread_time()
+  try:
+    yield current
+  finally:
+    wall = time.perf_counter() - start_wall
+    cpu = time.thread_time() - start_cpu
+    stack.pop()
+    if stack:
+      stack[-1].child_wall += wall
+      stack[-1].child_cpu += cpu
+
+    with _lock:
+      stats = _phases.get(name)
+      if stats is None:
+        stats = _phases[name] = PhaseStats()
+      stats.count += 1
+      stats.wall += wall
+      stats.cpu += cpu
+      stats.self_wall += wall - current.child_wall
+      stats.self_cpu += cpu - current.child_cpu
+      stats.rows += current.rows
+
+    for listener in _phase_listeners:
+      listener(name)
+
+
+def count(name, n=1):
+  with _lock:
+    _counters[name] = _counters.get(name, 0) + n
+
+
+def record_request(host,
+                   seconds,
+                   status=None,
+                   ttfb=None,
+                   body_bytes=0,
+                   wire_bytes=0,
+                   error=None):
+  """
+  Records one request attempt (retries and hedged requests each count).
+  """
+
+  with _lock:
+    stats = _host(host)
+    stats.requests += 1
+    if error:
+      stats.errors += 1
+      stats.statuses[error] = stats.statuses.get(error, 0) + 1
+    else:
+      stats.statuses[status] = stats.statuses.get(status, 0) + 1
+    stats.body_bytes += body_bytes
+    stats.wire_bytes += wire_bytes
+    stats.record_latency(seconds)
+    stats.ttfb += ttfb or 0.0
+
+
+def record_retry(host):
+  with _lock:
+    _host(host).retries += 1
+
+
+def record_throttle_wait(host, seconds):
+  with _lock:
+    _host(host).throttle_wait += seconds
+
+
+def register_collector(name, fn):
+  """
+  fn() is called when the summary is built and its result included under
+  `name`, for state that lives elsewhere (e.g. connection pools).
+  """
+
+  _collectors[name] = fn
+
+
+def add_phase_listener(fn):
+  """
+  fn(name) is called on the finishing thread after each phase ends.
+  """
+
+  _phase_listeners.append(fn)
+
+
+def reset():
+  global _started_at, _start_wall, _start_cpu
+
+  with _lock:
+    _phases.clear()
+    _hosts.clear()
+    _counters.clear()
+    _started_at = datetime.datetime.now()
+    _start_wall = time.perf_counter()
+    _start_cpu = time.process_time()
+
+
+def max_rss_mb():
+  if resource is None:
+    return None
+  # kilobytes on linux, bytes on macos
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summary():
+  with _lock:
+    result = {
+        "job": _outputs["job"],
+        "started_at": _started_at.isoformat(timespec="seconds"),
+        "wall_seconds": round(time.perf_counter() - _start_wall, 6),
+        "cpu_seconds": round(time.process_time() - _start_cpu, 6),
+        "max_rss_mb": max_rss_mb(),
+        "phases": {
+            name: stats.to_dict() for name, stats in sorted(_phases.items())
+        },
+        "hosts": {
+            host: stats.to_dict() for host, stats in sorted(_hosts.items())
+        },
+        "counters": dict(sorted(_counters.items())),
+    }
+
+  for name, fn in _collectors.items():
+    try:
+      result[name] = fn()
+    except Exception as e:
+      logger.info("metrics collector %s failed: %r", name, e)
+
+  return result
+
+
+def _write_atomic(path, text):
+  path = os.path.abspath(path)
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+  with os.fdopen(fd, "w") as f:
+    f.write(text)
+  os.replace(tmp_path, path)
+
+
+def write_json(path, result=None):
+  _write_atomic(path, json.dumps(result or summary(), indent=2) + "\n")
+
+
+def _label_value(value):
+  return (str(value).replace("\\", "\\\\").replace('"',
+                                                   '\\"').replace("\n", "\\n"))
+
+
+def _labels(**labels):
+  pairs = (
+      f'{k}="{_label_value(v)}"' for k, v in labels.items() if v is not None)
+  return "{" + ",".join(pairs) + "}"
+
+
+def to_prometheus(result):
+  """
+  The summary in the prometheus text exposition format, for node_exporter's
+  textfile collector.
+  """
+
+  p = PROMETHEUS_PREFIX
+  job = result["job"]
+  lines = []
+
+  def metric(name, type, help, samples):
+    if not samples:
+      return
+    lines.append(f"# HELP {p}_{name} {help}")
+    lines.append(f"# TYPE {p}_{name} {type}")
+    for suffix, labels, value in samples:
+      lines.append(f"{p}_{name}{suffix}{_labels(job=job, **labels)} {value}")
+
+  metric("run_seconds", "gauge", "wall time of the run",
+         [("", {}, result["wall_seconds"])])
+  metric("run_cpu_seconds", "gauge", "cpu time of the run",
+         [("", {}, result["cpu_seconds"])])
+
+  phases = result["phases"]
+  metric("phase_seconds", "gauge",
+         "time spent in each phase, excluding nested phases",
+         [("", {
+             "phase": name,
+             "clock": clock
+         }, stats[f"self_{clock}_seconds"])
+          for name, stats in phases.items()
+          for clock in ("wall", "cpu")])
+  metric("phase_rows", "gauge", "rows produced by each phase", [("", {
+      "phase": name
+  }, stats["rows"]) for name, stats in phases.items()])
+
+  hosts = result["hosts"]
+  metric("http_requests", "gauge", "request attempts by host and status",
+         [("", {
+             "host": host,
+             "status": status
+         }, n)
+          for host, stats in hosts.items()
+          for status, n in stats["statuses"].items()])
+  metric("http_bytes", "gauge", "bytes received by host",
+         [("", {
+             "host": host,
+             "kind": kind
+         }, stats[f"{kind}_bytes"])
+          for host, stats in hosts.items()
+          for kind in ("body", "wire")])
+
+  samples = []
+  for host, stats in hosts.items():
+    cumulative = 0
+    histogram = stats["histogram"]
+    for le, n in zip(histogram["le"], histogram["counts"]):
+      cumulative += n
+      samples.append(("_bucket", {"host": host, "le": le}, cumulative))
+    samples.append(("_sum", {"host": host}, stats["latency_seconds"]["sum"]))
+    samples.append(("_count", {"host": host}, stats["requests"]))
+  metric("http_request_duration_seconds", "histogram",
+         "request latency by host", samples)
+
+  metric("events", "gauge", "counted events", [("", {
+      "name": name
+  }, n) for name, n in result["counters"].items()])
+
+  return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path, result=None):
+  _write_atomic(path, to_prometheus(result or summary()))
+
+
+def log_summary(result):
+  log(
+      f"=== metrics ({result['wall_seconds']:.2f}s wall, "
+      f"{result['cpu_seconds']:.2f}s cpu)",
+      print_dest=None)
+
+  phases = sorted(result["phases"].items(),
+                  key=lambda p: -p[1]["self_wall_seconds"])
+  for name, stats in phases:
+    rate = stats["rows_per_second"]
+    rate = f", {rate:.0f} rows/s" if rate else ""
+    log(
+        f"  {name}: {stats['self_wall_seconds']:.3f}s wall, "
+        f"{stats['self_cpu_seconds']:.3f}s cpu, {stats['count']}x{rate}",
+        print_dest=None)
+
+  for host, stats in result["hosts"].items():
+    latency = stats["latency_seconds"]
+    log(
+        f"  {host}: {stats['requests']} requests, {stats['errors']} errors, "
+        f"{stats['wire_bytes'] / 1024 / 1024:.2f} MB, "
+        f"p50 {latency['p50']}s, p90 {latency['p90']}s",
+        print_dest=None)
+
+
+def add_arguments(parser):
+  parser.add_argument('--metrics',
+                      type=str,
+                      metavar="PATH",
+                      help="where to write the run's json metrics summary "
+                      "(default: next to the log file)")
+  parser.add_argument('--prometheus-textfile',
+                      type=str,
+                      metavar="PATH",
+                      help="also write the metrics as a prometheus textfile")
+
+
+def summary_path(log_dir, filename):
+  return os.path.join(
+      log_dir,
+      f"{filename}-{log_config.run_timestamp:%Y%m%d-%H%M%S}.metrics.json")
+
+
+def configure(json_path, textfile=None, job=None):
+  """
+  Writes the summary to json_path (and the prometheus textfile, if given)
+  when the process exits, however main() ends.
+  """
+
+  first = _outputs["json"] is None and _outputs["textfile"] is None
+  _outputs.update(json=json_path, textfile=textfile, job=job)
+  if first:
+    atexit.register(finish)
+
+
+def finish():
+  if not (_outputs["json"] or _outputs["textfile"]):
+    return
+
+  result = summary()
+  log_summary(result)
+
+  if _outputs["json"]:
+    write_json(_outputs["json"], result)
+    log(f"metrics written to {_outputs['json']}", print_dest=None)
+  if _outputs["textfile"]:
+    write_prometheus(_outputs["textfile"], result)
+    log(f"metrics written to {_outputs['textfile']}", print_dest=None)
+
+  _outputs.update(json=None, textfile=None)
@@ -0,0 +1,183 @@
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+try:
+  from nicknames import NickNamer
+except ImportError:
+  NickNamer = None
+
+DEFAULT_CANDIDATES = 5
+# a top match at least this good, and this far ahead of the runner-up, is
+# taken without asking
+DEFAULT_AUTO_ACCEPT = 0.9
+DEFAULT_MARGIN = 0.15
+
+# how many trigram-overlap candidates get fully scored per lookup
+SHORTLIST_SIZE = 30
+
+NON_WORD_RE = re.compile(r"[^\w]+")
+
+_nicknamer = None
+
+
+def fold(name):
+  """
+  Case-folded, accent-stripped, punctuation-free key for a name:
+  "  José  O'Neil" -> "jose o neil".
+  """
+
+  decomposed = unicodedata.normalize("NFKD", name or "")
+  stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+  return " ".join(NON_WORD_RE.sub(" ", stripped.casefold()).split())
+
+
+def trigrams(key):
+  padded = f"  {key} "
+  return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def dice(a, b):
+  if not a or not b:
+    return 0.0
+  return 2 * len(a & b) / (len(a) + len(b))
+
+
+def related_names(token):
+  """
+  The token's nicknames and the names it is a nickname of, e.g. "bill" ->
+  {"william", ...} and "william" -> {"bill", "will", ...}.
+  """
+
+  global _nicknamer
+
+  if NickNamer is None:
+    return set()
+  if _nicknamer is None:
+    _nicknamer = NickNamer()
+  return _nicknamer.nicknames_of(token) | _nicknamer.canonicals_of(token)
+
+
+class NameIndex:
+  """
+  Finds the closest of a fixed set of names to a query name. Candidates come
+  from shared character trigrams and from shared (or nickname-equivalent)
+  words, and are scored 0..1 by how well each word of the shorter name lines
+  up with a word of the longer one.
+  """
+
+  def __init__(self, names, nicknames=True):
+    self.nicknames = nicknames and NickNamer is not None
+
+    self.names = []
+    self.keys = []
+    self.key_tokens = []
+    self.key_trigrams = []
+    self.ids_by_key = {}
+    self.ids_by_token = defaultdict(set)
+    self.ids_by_trigram = defaultdict(set)
+    self._related = {}
+    self._token_trigrams = {}
+
+    for name in names:
+      key = fold(name)
+      if not key or key in self.ids_by_key:
+        continue
+
+      name_id = len(self.names)
+      self.names.append(name)
+      self.keys.append(key)
+      self.ids_by_key[key] = name_id
+
+      tokens = key.split()
+      self.key_tokens.append(tokens)
+      for token in tokens:
+        self.ids_by_token[token].add(name_id)
+
+      grams = trigrams(key)
+      self.key_trigrams.append(grams)
+      for gram in grams:
+        self.ids_by_trigram[gram].add(name_id)
+
+  def __len__(self):
+    return len(self.names)
+
+  def related(self, token):
+    if not self.nicknames:
+      return set()
+    if token not in self._related:
+      self._related[token] = related_names(token)
+    return self._related[token]
+
+  def token_similarity(self, a, b):
+    if a == b:
+      return 1.0
+    if b in self.related(a) or a in self.related(b):
+      return 0.95
+    return dice(self.token_trigrams(a), self.token_trigrams(b))
+
+  def token_trigrams(self, token):
+    if token not in self._token_trigrams:
+      self._token_trigrams[token] = trigrams(token)
+    return self._token_trigrams[token]
+
+  def score(self, tokens, grams, name_id):
+    candidate = self.key_tokens[name_id]
+    short, long = sorted((tokens, candidate), key=len)
+
+    aligned = sum(max(self.token_similarity(t, c) for c in long) for t in short)
+    # extra words on either side (middle names, suffixes) cost a little
+    token_score = aligned / len(short) * (0.9**(len(long) - len(short)))
+
+    return max(token_score, dice(grams, self.key_trigrams[name_id]))
+
+  def candidates(self, key):
+    tokens = key.split()
+    grams = trigrams(key)
+
+    # rank by shared trigrams, counting a word that is a nickname of one of
+    # the query's words as if all of its trigrams were shared
+    overlap = Counter()
+    for gram in grams:
+      overlap.update(self.ids_by_trigram.get(gram, ()))
+    for token in tokens:
+      weight = len(self.token_trigrams(token))
+      for other in self.related(token):
+        for name_id in self.ids_by_token.get(other, ()):
+          overlap[name_id] += weight
+
+    ids = [name_id for name_id, _ in overlap.most_common(SHORTLIST_SIZE)]
+    return tokens, grams, ids
+
+  def lookup(self, name, k=DEFAULT_CANDIDATES):
+    """
+    Returns up to k (score, name) pairs, best first.
+    """
+
+    key = fold(name)
+    if not key:
+      return []
+
+    tokens, grams, ids = self.candidates(key)
+    scored = sorted(
+        ((self.score(tokens, grams, i), self.names[i]) for i in ids),
+        key=lambda s: (-s[0], s[1]))
+    return scored[:k]
+
+  def best(self, name, threshold=DEFAULT_AUTO_ACCEPT, margin=DEFAULT_MARGIN):
+    """
+    The single name confidently matching `name`, or None: either the same
+    key, or a top score that reaches threshold and beats the runner-up by
+    margin.
+    """
+
+    exact = self.ids_by_key.get(fold(name))
+    if exact is not None:
+      return self.names[exact]
+
+    matches = self.lookup(name, k=2)
+    if not matches or matches[0][0] < threshold:
+      return None
+    if len(matches) > 1 and matches[0][0] - matches[1][0] < margin:
+      return None
+    return matches[0][1]
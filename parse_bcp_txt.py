@@ -1,32 +1,55 @@
 import argparse
-import csv
-import datetime
+import concurrent.futures
+import io
+import itertools
 import logging
+import multiprocessing
 import os
 import pprint
 import re
 import sys
 
-FILENAME = os.path.basename(__file__)
+import log_config
+import metrics
+import profiling
+import writers
 
-run_timestamp = datetime.datetime.now()
+FILENAME = os.path.basename(__file__)
 
 pp = pprint.PrettyPrinter(indent=2)
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--output', type=str, default="output")
-parser.add_argument('--input', type=str, required=True)
-
-args = parser.parse_args()
+ROUND_FILE_RE = re.compile(r'round_(\d+)\.txt$')
+# a line starting a round in a concatenated stream: "round_3.txt", "Round 3",
+# or the "==> round_3.txt <==" headers `tail -n +1 round_*.txt` prints
+ROUND_MARKER_RE = re.compile(
+    r'^(?:==> )?(?:.*/)?round[_ ](\d+)(?:\.txt)?(?: <==)?$', re.IGNORECASE)
 
-log_dir = os.path.abspath(args.output or ".")
-log_name = f"{FILENAME}-{run_timestamp:%Y%m%d}.log"
-log_path = os.path.join(log_dir, log_name)
+MATCH_FIELDS = ["round", "table", "winner", "loser"]
 
-logging.basicConfig(format='[%(asctime)s] %(message)s',
-                    filename=log_path,
-                    level=logging.DEBUG)
-logger = logging.getLogger()
+parser = argparse.ArgumentParser()
+parser.add_argument('--output', type=str, default="output")
+parser.add_argument('--input',
+                    type=str,
+                    nargs='+',
+                    required=True,
+                    help="directories of round_N.txt files, each written to "
+                    "its own output, or - to read rounds from stdin")
+parser.add_argument('--name',
+                    type=str,
+                    default="stdin",
+                    help="output name for rounds read from stdin")
+parser.add_argument('--jobs',
+                    type=int,
+                    default=1,
+                    help="round files to parse at once, in separate processes")
+parser.add_argument('--format',
+                    choices=writers.FORMATS,
+                    default=writers.DEFAULT_FORMAT)
+log_config.add_arguments(parser)
+metrics.add_arguments(parser)
+profiling.add_arguments(parser)
+
+logger = logging.getLogger(__name__)
 
 
 def log(msg, print_dest="stderr"):
@@ -64,6 +87,9 @@ def get_round_matches(txt_f, round):
 
   ignore_list = ['TABLE']
 
+  # one record per input line adds up, so only build them when asked for
+  trace = logger.isEnabledFor(logging.DEBUG)
+
   for line in txt_f:
     line = line.strip()
 
@@ -75,70 +101,212 @@ def get_round_matches(txt_f, round):
       loser = None
 
     if not line.strip():
-      log(f"skip << {line}", print_dest=None)
+      if trace:
+        logger.debug("skip << %s", line)
       continue
 
     if line in ignore_list:
-      log(f"ignore << {line}", print_dest=None)
+      if trace:
+        logger.debug("ignore << %s", line)
       continue
 
     if line.isdigit():
-      log(f"table << {line}", print_dest=None)
+      if trace:
+        logger.debug("table << %s", line)
       table = line
       continue
 
     if line == "Win: 1":
-      log(f"winner << {line}", print_dest=None)
+      if trace:
+        logger.debug("winner << %s", line)
       winner = pending_name
       continue
 
     if line == "Loss: 0":
-      log(f"loser << {line}", print_dest=None)
+      if trace:
+        logger.debug("loser << %s", line)
       loser = pending_name
       continue
 
-    log(f"pending_name << {line}", print_dest=None)
+    if trace:
+      logger.debug("pending_name << %s", line)
     pending_name = line
 
+  if table and winner and loser:
+    matches.append(Match(winner, loser, table, round))
+
   return matches
 
 
+def round_files(txt_dir):
+  """
+  Returns [(round, path)] for txt_dir's round_N.txt files, in round order.
+  """
+
+  files = []
+  for txt_file in os.listdir(txt_dir):
+    round_match = ROUND_FILE_RE.match(txt_file)
+    if round_match:
+      files.append((int(round_match.group(1)), os.path.join(txt_dir, txt_file)))
+    elif txt_file.endswith(".txt"):
+      log(f"skipping {txt_file}: not named round_N.txt")
+
+  return sorted(files)
+
+
+def split_rounds(txt_f):
+  """
+  Splits a stream of several rounds' text at round marker lines. Returns
+  [(round, text)] in round order; text before the first marker is round 1.
+  """
+
+  rounds = []
+  round = 1
+  lines = []
+  for line in txt_f:
+    marker = ROUND_MARKER_RE.match(line.strip())
+    if marker:
+      if any(l.strip() for l in lines):
+        rounds.append((round, "".join(lines)))
+      round = int(marker.group(1))
+      lines = []
+    else:
+      lines.append(line)
+
+  if any(l.strip() for l in lines):
+    rounds.append((round, "".join(lines)))
+
+  return sorted(rounds, key=lambda r: r[0])
+
+
+def parse_round(task):
+  """
+  Parses one (input, name, round, path, text) task, reading path unless
+  text is given. Returns the matches as writer rows, which pickle much
+  faster than Match objects on their way back from a worker.
+  """
+
+  _, _, round, path, text = task
+  if text is None:
+    with open(path, 'r') as f:
+      matches = get_round_matches(f, round)
+  else:
+    matches = get_round_matches(io.StringIO(text), round)
+
+  return [(m.round, m.table, m.winner, m.loser) for m in matches]
+
+
+def iter_round_rows(tasks, jobs=1):
+  """
+  Yields (task, rows) for each task in order. With jobs > 1 the rounds are
+  parsed in that many worker processes, and each is yielded as soon as it
+  and every round before it are done.
+  """
+
+  if jobs <= 1:
+    for task in tasks:
+      with metrics.phase("parse") as phase:
+        rows = parse_round(task)
+        phase.rows = len(rows)
+      yield task, rows
+    return
+
+  # spawn rather than fork: the log and metrics threads may hold locks a
+  # forked child would inherit
+  with concurrent.futures.ProcessPoolExecutor(
+      max_workers=jobs,
+      mp_context=multiprocessing.get_context("spawn")) as executor:
+    results = executor.map(parse_round, tasks)
+    for task in tasks:
+      with metrics.phase("parse.wait") as phase:
+        rows = next(results)
+        phase.rows = len(rows)
+      yield task, rows
+
+
+def write_rows(name, task_rows, output_dir, format=writers.DEFAULT_FORMAT):
+  """
+  Writes one input's rows as they arrive. Returns (rows written, rounds
+  with no matches).
+  """
+
+  empty = []
+  base_path = os.path.join(output_dir, f"{name}_matches")
+  with writers.open_writer(base_path, MATCH_FIELDS, format) as writer:
+    for (_, _, round, path, _), rows in task_rows:
+      source = os.path.basename(path) if path else f"round {round}"
+      if rows:
+        log(f"{name}: found {len(rows)} matches in {source}")
+      else:
+        log(f"{name}: no matches found in {source}")
+        empty.append(round)
+
+      with metrics.phase("write.matches") as phase:
+        writer.writerows(rows)
+        phase.rows = len(rows)
+
+  log(f"{name}: {writer.rows_written} matches written to {writer.path}")
+  return writer.rows_written, empty
+
+
 def main():
-  txt_dir = os.path.abspath(args.input)
-  input_name = os.path.basename(txt_dir)
-  if not os.path.isdir(txt_dir):
-    log(f"input directory {txt_dir} does not exist")
-    sys.exit(1)
+  args = parser.parse_args()
+  log_config.configure(log_config.log_path(args.output or ".", FILENAME),
+                       level=args.log_level)
+  metrics.configure(args.metrics or
+                    metrics.summary_path(args.output or ".", FILENAME),
+                    textfile=args.prometheus_textfile,
+                    job=FILENAME)
+  if args.profile:
+    profiling.start(args.output or ".", FILENAME)
+
+  tasks = []
+  inputs_by_name = {}
+  for i, input in enumerate(args.input):
+    name = args.name if input == "-" else os.path.basename(
+        os.path.abspath(input))
+    if name in inputs_by_name:
+      log(f"{inputs_by_name[name]} and {input} would both be written to "
+          f"{name}_matches; rename a directory or pass a different --name")
+      sys.exit(1)
+    inputs_by_name[name] = input
+
+    if input == "-":
+      tasks.extend((i, name, round, None, text)
+                   for round, text in split_rounds(sys.stdin))
+      continue
+
+    txt_dir = os.path.abspath(input)
+    if not os.path.isdir(txt_dir):
+      log(f"input directory {txt_dir} does not exist")
+      sys.exit(1)
 
-  txt_files = [f for f in os.listdir(txt_dir) if f.endswith(".txt")]
-  if not txt_files:
-    log(f"no txt files found in {txt_dir}")
+    files = round_files(txt_dir)
+    if not files:
+      log(f"no round files found in {txt_dir}")
+      sys.exit(1)
+    tasks.extend((i, name, round, path, None) for round, path in files)
+
+  if not tasks:
+    log(f"no rounds found")
     sys.exit(1)
 
-  all_matches = []
-
-  for txt_file in sorted(txt_files):
-    log(f"parsing {txt_file}...")
-    round = re.match(r"round_(\d+).txt", txt_file).group(1)
-    txt_path = os.path.join(txt_dir, txt_file)
-    with open(txt_path, 'r') as f:
-      round_matches = get_round_matches(f, round)
-      if not round_matches:
-        log(f"no matches found in {txt_file}")
-        sys.exit(1)
-      log(f"found {len(round_matches)} matches")
-      all_matches.extend(round_matches)
-
-  log(f"TOTAL: found {len(all_matches)} matches")
-
-  output_path = os.path.join(args.output, f"{input_name}_matches.csv")
-  with open(output_path, 'w', newline='') as f:
-    writer = csv.writer(f)
-    writer.writerow(["round", "table", "winner", "loser"])
-    for match in all_matches:
-      writer.writerow([match.round, match.table, match.winner, match.loser])
-
-  log(f"output written to {output_path}")
+  total = 0
+  empty_inputs = []
+  task_rows = iter_round_rows(tasks, jobs=args.jobs)
+  # tasks are in input order, so each input's rounds arrive together
+  for (_, name), group in itertools.groupby(task_rows, key=lambda t: t[0][:2]):
+    written, empty = write_rows(name, group, args.output, format=args.format)
+    total += written
+    if empty:
+      empty_inputs.append(f"{name} (rounds {', '.join(map(str, empty))})")
+
+  log(f"TOTAL: found {total} matches")
+
+  # an empty round is usually a copy that went wrong
+  if empty_inputs:
+    log(f"rounds with no matches: {'; '.join(empty_inputs)}")
+    sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,270 @@
+import atexit
+import collections
+import cProfile
+import json
+import logging
+import os
+import platform
+import re
+import subprocess
+import sys
+import threading
+import tracemalloc
+
+import log_config
+import metrics
+
+FILEDIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+# grouping by allocation site only needs the innermost frame, and every
+# extra frame makes snapshots slower to summarize
+TRACEMALLOC_FRAMES = 1
+TOP_ALLOCATIONS = 25
+
+# a thread pool's workers share a flame graph root instead of one each
+THREAD_NUMBER_RE = re.compile(r'[_-]\d+$')
+
+IGNORED_FILES = (tracemalloc.__file__, "<frozen importlib")
+
+# log_config's writer thread, parked on its queue for nearly the whole run
+IDLE_FUNCTIONS = {("handlers.py", "dequeue")}
+
+_profiler = None
+
+logger = logging.getLogger(__name__)
+
+
+def log(msg, print_dest="stderr"):
+  logger.info(msg)
+
+  if print_dest == "stderr":
+    print(msg, file=sys.stderr)
+
+  if print_dest == "stdout":
+    print(msg)
+
+
+def add_arguments(parser):
+  parser.add_argument('--profile',
+                      action='store_true',
+                      help="write cProfile stats, collapsed stacks for flame "
+                      "graphs and tracemalloc snapshots next to the log file")
+
+
+def git_revision():
+  try:
+    result = subprocess.run(["git", "rev-parse", "HEAD"],
+                            cwd=FILEDIR,
+                            capture_output=True,
+                            text=True,
+                            timeout=5)
+  except (OSError, subprocess.SubprocessError):
+    return None
+  return result.stdout.strip() or None
+
+
+class StackSampler:
+  """
+  Samples every thread's stack every `interval` seconds and counts them in
+  the collapsed format flamegraph.pl and speedscope read ("root;f;g 12").
+  Unlike cProfile this sees worker threads, and costs the same however deep
+  the call stacks are.
+  """
+
+  def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+    self.interval = interval
+    self.counts = collections.Counter()
+    self.samples = 0
+    self.paused = False
+    self.stopped = threading.Event()
+    self.thread = threading.Thread(target=self.run,
+                                   name="profiling-sampler",
+                                   daemon=True)
+
+  def start(self):
+    self.thread.start()
+
+  def stop(self):
+    self.stopped.set()
+    self.thread.join()
+
+  def run(self):
+    own = threading.get_ident()
+    while not self.stopped.wait(self.interval):
+      if self.paused:
+        continue
+
+      names = {t.ident: t.name for t in threading.enumerate()}
+      for ident, frame in sys._current_frames().items():
+        if ident == own:
+          continue
+        if (os.path.basename(frame.f_code.co_filename),
+            frame.f_code.co_name) in IDLE_FUNCTIONS:
+          continue
+
+        stack = []
+        while frame is not None:
+          code = frame.f_code
+          stack.append(f"{code.co_name} "
+                       f"({os.path.basename(code.co_filename)}:"
+                       f"{code.co_firstlineno})")
+          frame = frame.f_back
+        stack.append(THREAD_NUMBER_RE.sub("", names.get(ident, "thread")))
+
+        self.counts[";".join(reversed(stack))] += 1
+      self.samples += 1
+
+  def write(self, path):
+    with open(path, "w") as f:
+      for stack, n in self.counts.most_common():
+        f.write(f"{stack} {n}\n")
+
+
+class Profiler:
+  """
+  Everything --profile collects for one run, written under log_dir with the
+  log file's name and the run's timestamp:
+
+    .prof             cProfile stats for the main thread (pstats, snakeviz)
+    .collapsed        sampled stacks from every thread, for flame graphs
+    .tracemalloc.txt  top allocations after each phase first finishes, and
+                      what grew since the previous snapshot
+    .profile.json     how the run was invoked, to reproduce it
+  """
+
+  def __init__(self,
+               log_dir,
+               filename,
+               sample_interval=DEFAULT_SAMPLE_INTERVAL):
+    os.makedirs(log_dir, exist_ok=True)
+    self.prefix = os.path.join(
+        log_dir, f"{filename}-{log_config.run_timestamp:%Y%m%d-%H%M%S}")
+    self.paths = {
+        "pstats": f"{self.prefix}.prof",
+        "collapsed": f"{self.prefix}.collapsed",
+        "tracemalloc": f"{self.prefix}.tracemalloc.txt",
+        "manifest": f"{self.prefix}.profile.json",
+    }
+    self.profile = cProfile.Profile()
+    self.sampler = StackSampler(sample_interval)
+    self.snapshot_lock = threading.Lock()
+    self.snapshotted = set()
+    self.previous = {}
+    self.memory = {}
+
+  def start(self):
+    self.manifest = {
+        "argv": sys.argv,
+        "cwd": os.getcwd(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "git_revision": git_revision(),
+        "started_at": log_config.run_timestamp.isoformat(timespec="seconds"),
+        "sample_interval": self.sampler.interval,
+        "tracemalloc_frames": TRACEMALLOC_FRAMES,
+    }
+
+    with open(self.paths["tracemalloc"], "w") as f:
+      f.write(f"# tracemalloc snapshots for {' '.join(sys.argv)}\n")
+
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+    metrics.add_phase_listener(self.on_phase)
+    self.sampler.start()
+    self.profile.enable()
+
+  def on_phase(self, name):
+    # once per phase name: the later runs of a per-round phase would mostly
+    # repeat the first
+    with self.snapshot_lock:
+      if name in self.snapshotted or not tracemalloc.is_tracing():
+        return
+      self.snapshotted.add(name)
+      # keep the snapshots themselves out of the flame graph
+      self.sampler.paused = True
+      try:
+        self.snapshot(f"after {name}")
+      finally:
+        self.sampler.paused = False
+
+  def snapshot(self, label):
+    current, peak = tracemalloc.get_traced_memory()
+    self.memory[label] = {"current_bytes": current, "peak_bytes": peak}
+
+    # filtering the statistics is much cheaper than filter_traces(), which
+    # walks every trace in python
+    stats = [
+        stat for stat in tracemalloc.take_snapshot().statistics("lineno")
+        if not stat.traceback[0].filename.startswith(IGNORED_FILES)
+    ]
+
+    lines = [
+        f"", f"=== {label}: {current / 1024 / 1024:.1f} MB traced, "
+        f"{peak / 1024 / 1024:.1f} MB peak", f"--- top allocations"
+    ]
+    for stat in stats[:TOP_ALLOCATIONS]:
+      lines.append(f"  {stat}")
+
+    sizes = {stat.traceback: stat.size for stat in stats}
+    if self.previous:
+      # Snapshot.compare_to would redo both snapshots' statistics
+      growth = sorted(
+          ((size - self.previous.get(tb, 0), tb) for tb, size in sizes.items()),
+          key=lambda g: -abs(g[0]))
+      lines.append(f"--- growth since the previous snapshot")
+      for size_diff, tb in growth[:TOP_ALLOCATIONS]:
+        if size_diff:
+          lines.append(f"  {tb}: {size_diff / 1024:+.1f} KiB")
+    self.previous = sizes
+
+    with open(self.paths["tracemalloc"], "a") as f:
+      f.write("\n".join(lines) + "\n")
+
+  def stop(self):
+    self.profile.disable()
+    self.sampler.stop()
+
+    with self.snapshot_lock:
+      self.snapshot("end of run")
+      self.previous = {}
+    tracemalloc.stop()
+
+    self.profile.dump_stats(self.paths["pstats"])
+    self.sampler.write(self.paths["collapsed"])
+
+    self.manifest.update(samples=self.sampler.samples,
+                         memory=self.memory,
+                         outputs=self.paths)
+    with open(self.paths["manifest"], "w") as f:
+      json.dump(self.manifest, f, indent=2)
+      f.write("\n")
+
+    log(f"profile written to {self.prefix}.*")
+
+
+def start(log_dir, filename, sample_interval=DEFAULT_SAMPLE_INTERVAL):
+  """
+  Starts profiling the rest of the run; the results are written when the
+  process exits.
+  """
+
+  global _profiler
+
+  if _profiler is not None:
+    return _profiler
+
+  _profiler = Profiler(log_dir, filename, sample_interval=sample_interval)
+  _profiler.start()
+  atexit.register(stop)
+  return _profiler
+
+
+def stop():
+  global _profiler
+
+  if _profiler is None:
+    return
+
+  profiler = _profiler
+  _profiler = None
+  profiler.stop()
@@ -1,32 +1,55 @@
-import datetime
+import hashlib
 import logging
-import os
 import re
 import sys
+import threading
 
 import bs4
-import requests
+import lxml.html
 
+import http_cache
+import log_config
+import metrics
 from util import Match, Player
 
-run_timestamp = datetime.datetime.now()
+RK9_BASE_URL = "https://rk9.gg"
+RK9_PAIRINGS_URL = f"{RK9_BASE_URL}/pairings/{{}}"
 
-# TODO: fix these paths -- since they're global, they get set once by bcp.py
-# and then all the logs for other modules get written to bcp.py
+# "bs4" walks a BeautifulSoup tree round by round; "lxml" extracts every round
+# in one pass over the pairings subtree. both produce the same matches.
+PARSERS = ("lxml", "bs4")
+DEFAULT_PARSER = "lxml"
+# part of the parse cache namespaces; bump it when a change to the parsers
+# changes what they extract, so results cached by the old code aren't reused
+PARSE_VERSION = 2
 
-FILENAME = os.path.basename(__file__)
-FILEDIR = os.path.dirname(__file__)
+# each division is a tab of the pairings page: P0 juniors, P1 seniors and P2
+# masters, with rounds {division}R{n} and standings {division}-standings
+DIVISIONS = ("P0", "P1", "P2")
+DEFAULT_DIVISION = "P2"
 
-RK9_PAIRINGS_URL = "https://rk9.gg/pairings/{}"
+DISCORD_RE = re.compile(r'"(.*)" (.*)')
+ROUND_ID_RE = re.compile(r'P\dR(\d+)$')
+RANKING_DISCORD_RE = re.compile(r'(\d+). "(.*)" (.*)')
+RANKING_RE = re.compile(r'(\d+). (.*)')
 
-log_dir = os.path.join(FILEDIR, "logs")
-log_name = f"{FILENAME}-{run_timestamp:%Y%m%d}.log"
-log_path = os.path.join(log_dir, log_name)
 
-logging.basicConfig(format='[%(asctime)s] %(message)s',
-                    filename=log_path,
-                    level=logging.DEBUG)
-logger = logging.getLogger()
+def _class_xpath(tag, class_name):
+  return (f'{tag}[contains(concat(" ", normalize-space(@class), " "), '
+          f'" {class_name} ")]')
+
+
+DIVISION_ROOT = lxml.etree.XPath('//*[@id=$division]')
+ROUND_DIVS = lxml.etree.XPath('.//*[starts-with(@id, $prefix)]')
+MATCH_DIVS = lxml.etree.XPath(f'.//{_class_xpath("div", "match")}')
+WINNER_NAME = lxml.etree.XPath(f'(.//{_class_xpath("div", "winner")})[1]'
+                               f'//{_class_xpath("span", "name")}')
+LOSER_NAME = lxml.etree.XPath(f'(.//{_class_xpath("div", "loser")})[1]'
+                              f'//{_class_xpath("span", "name")}')
+TABLE_NUMBER = lxml.etree.XPath(f'.//{_class_xpath("span", "tablenumber")}')
+
+logger = logging.getLogger(__name__)
+parse_failures = log_config.RateLimited(logger)
 
 
 def log(msg, print_dest="stderr"):
@@ -39,43 +62,275 @@ def log(msg, print_dest="stderr"):
     print(msg)
 
 
-def get_all_matches(event_id):
-  data = scrape(RK9_PAIRINGS_URL.format(event_id))
-  matches = []
-  round = 1
-  while True:
-    round_matches = get_round_matches(data, round)
-    if round_matches:
-      log(f"found {len(round_matches)} matches for round {round}")
-      matches.extend(round_matches)
-      round += 1
+def configure(base_url=RK9_BASE_URL):
+  """
+  Fetches pairings pages from base_url instead of rk9.gg, e.g. from
+  benchmarks/mock_server.py.
+  """
+
+  global RK9_PAIRINGS_URL
+  RK9_PAIRINGS_URL = f"{base_url.rstrip('/')}/pairings/{{}}"
+
+
+class EventSnapshot:
+  """
+  One fetch + parse of an event's pairings page. Matches and standings of
+  every division are extracted from the same parsed tree, so a combined
+  scrape only downloads and parses the page once.
+  """
+
+  def __init__(self, event_id, parser=DEFAULT_PARSER):
+    if parser not in PARSERS:
+      raise Exception(f"unknown parser: {parser}")
+
+    self.event_id = event_id
+    self.parser = parser
+    self.response = None
+    self._page = None
+    self._page_lock = threading.Lock()
+    self._data = {}
+    self._matches = {}
+    self._rankings = {}
+
+  def fetch(self):
+    self.response = fetch_response(RK9_PAIRINGS_URL.format(self.event_id))
+    self._page = None
+    self._data = {}
+    self._matches = {}
+    self._rankings = {}
+    return self
+
+  @property
+  def page(self):
+    if self.response is None:
+      self.fetch()
+
+    # a snapshot shared between threads still parses the page once
+    with self._page_lock:
+      if self._page is None:
+        with metrics.phase("rk9.decode"):
+          html = self.response.text
+        with metrics.phase(f"rk9.parse.{self.parser}"):
+          if self.parser == "lxml":
+            self._page = parse_page_lxml(html)
+          else:
+            self._page = parse_page_bs4(html)
+
+    return self._page
+
+  def division_data(self, division=DEFAULT_DIVISION):
+    if division not in self._data:
+      self._data[division] = find_division(self.page, division, self.parser)
+    return self._data[division]
+
+  @property
+  def data(self):
+    return self.division_data(DEFAULT_DIVISION)
+
+  def cache_namespace(self, kind, division):
+    return f"rk9-{kind}-{division}-{self.parser}-v{PARSE_VERSION}"
+
+  def get_matches(self, division=DEFAULT_DIVISION):
+    if self.response is None:
+      self.fetch()
+
+    # an unchanged page (e.g. a finished event) skips the html parse entirely
+    if division not in self._matches:
+      self._matches[division] = http_cache.parse(
+          self.cache_namespace("matches", division), self.response,
+          lambda: self._get_matches(division))
+    return self._matches[division]
+
+  def get_rankings(self, division=DEFAULT_DIVISION):
+    if self.response is None:
+      self.fetch()
+
+    if division not in self._rankings:
+      self._rankings[division] = http_cache.parse(
+          self.cache_namespace("rankings", division), self.response,
+          lambda: self._get_rankings(division))
+    return self._rankings[division]
+
+  def _get_rankings(self, division):
+    data = self.division_data(division)
+    with metrics.phase("rk9.rankings") as phase:
+      rankings = get_data_rankings(data, self.parser, division=division)
+      phase.rows = len(rankings or ())
+    return rankings
+
+  def get_divisions(self, divisions=DIVISIONS, rankings=False):
+    """
+    Returns {division: (matches, players)}, each division extracted in turn
+    from the one parsed page. players is None unless rankings=True.
+    """
+
+    # extraction is cpu-bound python over one tree, so threads wouldn't help
+    results = {}
+    for division in divisions:
+      matches = self.get_matches(division)
+      players = self.get_rankings(division) if rankings else None
+      results[division] = (matches, players)
+    return results
+
+  def iter_round_matches(self, division=DEFAULT_DIVISION):
+    """
+    Yields (round, matches) for rounds 1, 2, ... until a round is missing or
+    has no matches, extracting each round only when it's asked for.
+    """
+
+    data = self.division_data(division)
+    if data is None:
+      log(f"no {division} division found")
+      return
+
+    if self.parser == "lxml":
+      round_divs = get_round_divs_lxml(data, division)
+      get_matches = lambda round: (get_round_matches_lxml(
+          round_divs[round], round) if round in round_divs else None)
     else:
-      log(f"no matches found for round {round}")
-      break
+      get_matches = lambda round: get_round_matches(data, round, division)
+
+    round = 1
+    while True:
+      with metrics.phase("rk9.extract") as phase:
+        round_matches = get_matches(round)
+        phase.rows = len(round_matches or ())
+      if round_matches:
+        log(f"found {len(round_matches)} matches for {division} round {round}")
+        yield round, round_matches
+        round += 1
+      else:
+        log(f"no matches found for {division} round {round}")
+        break
+
+  def iter_matches(self, division=DEFAULT_DIVISION):
+    """
+    Yields the division's matches round by round as they're extracted. Like
+    get_matches, an unchanged page is served from the parse cache without
+    parsing it; otherwise the cache entry is written once the stream has
+    been consumed.
+    """
+
+    if self.response is None:
+      self.fetch()
+
+    namespace = self.cache_namespace("matches", division)
+    if division not in self._matches:
+      try:
+        self._matches[division] = http_cache.lookup_parsed(
+            namespace, self.response)
+      except http_cache.CacheMiss:
+        pass
+
+    if division in self._matches:
+      yield from self._matches[division]
+      return
+
+    matches = []
+    for _, round_matches in self.iter_round_matches(division):
+      matches.extend(round_matches)
+      yield from round_matches
+
+    self._matches[division] = matches
+    http_cache.store_parsed(namespace, self.response, matches)
+
+  def _get_matches(self, division):
+    return [
+        m for _, round_matches in self.iter_round_matches(division)
+        for m in round_matches
+    ]
+
+
+def division_name(event_id, division=DEFAULT_DIVISION):
+  """
+  The name a division's outputs go by: the event id for the default
+  division, as single-division scrapes have always written it, and
+  {event_id}_{division} for the others.
+  """
+
+  if division == DEFAULT_DIVISION:
+    return event_id
+  return f"{event_id}_{division}"
 
-  return matches
 
+def iter_matches(event_id, parser=DEFAULT_PARSER, division=DEFAULT_DIVISION):
+  return EventSnapshot(event_id, parser=parser).iter_matches(division)
 
-def scrape(data_url):
+
+def get_all_matches(event_id, parser=DEFAULT_PARSER, division=DEFAULT_DIVISION):
+  return EventSnapshot(event_id, parser=parser).get_matches(division)
+
+
+def get_divisions(event_id,
+                  divisions=DIVISIONS,
+                  parser=DEFAULT_PARSER,
+                  rankings=False):
+  return EventSnapshot(event_id, parser=parser).get_divisions(divisions,
+                                                              rankings=rankings)
+
+
+def fetch_response(data_url):
   log(f"scrape: {data_url}")
-  response = requests.get(data_url)
+  with metrics.phase("rk9.fetch"):
+    response = http_cache.get(data_url)
 
   mb = len(response.content) / 1024 / 1024
-  log(f"got {mb:.2f} MB response")
+  source = " (cached)" if response.from_cache else ""
+  log(f"got {mb:.2f} MB response{source}")
+
+  return response
+
+
+def fetch(data_url):
+  return fetch_response(data_url).text
+
+
+def scrape(data_url, division=DEFAULT_DIVISION):
+  return parse_bs4(fetch(data_url), division)
+
 
+def parse_page_bs4(html):
+  soup = bs4.BeautifulSoup(html, "html.parser")
+  log(f"soup parsed html")
+  return soup
+
+
+def parse_page_lxml(html):
   try:
-    soup = bs4.BeautifulSoup(response.text, "html.parser")
-    data = soup.find(id="P2")
-  except AttributeError:
+    root = lxml.html.fromstring(html)
+  except (lxml.etree.ParserError, ValueError):
     return None
 
-  log(f"soup parsed html")
+  log(f"lxml parsed html")
+  return root
+
+
+def find_division(page, division=DEFAULT_DIVISION, parser=DEFAULT_PARSER):
+  """
+  The division's tab in a parsed page, or None if the event doesn't have
+  that division.
+  """
+
+  if page is None:
+    return None
+
+  if parser == "lxml":
+    found = DIVISION_ROOT(page, division=division)
+    return found[0] if found else None
+
+  return page.find(id=division)
+
 
-  return data
+def parse_bs4(html, division=DEFAULT_DIVISION):
+  return find_division(parse_page_bs4(html), division, "bs4")
 
 
-def get_round_matches(data, round):
-  round_div = data.find(id=f"P2R{round}")
+def parse_lxml(html, division=DEFAULT_DIVISION):
+  return find_division(parse_page_lxml(html), division, "lxml")
+
+
+def get_round_matches(data, round, division=DEFAULT_DIVISION):
+  round_div = data.find(id=f"{division}R{round}")
   if not round_div:
     return None
 
@@ -88,32 +343,30 @@ def get_round_matches(data, round):
     winner_discord = None
     loser_discord = None
 
-    discord_re = re.compile(r'"(.*)" (.*)')
-
     try:
       winner = match_div.find("div", class_="winner").find(
           "span", class_="name").get_text(" ", strip=True)
-      winner_discord_match = discord_re.match(winner)
+      winner_discord_match = DISCORD_RE.match(winner)
       if winner_discord_match:
         winner_discord = winner_discord_match.group(1)
         winner = winner_discord_match.group(2)
     except AttributeError:
-      log(f"failed to parse winner", print_dest=None)
+      parse_failures.warning("failed to parse winner (round %s)", round)
 
     try:
       loser = match_div.find("div", class_="loser").find(
           "span", class_="name").get_text(" ", strip=True)
-      loser_re_match = discord_re.match(loser)
+      loser_re_match = DISCORD_RE.match(loser)
       if loser_re_match:
         loser_discord = loser_re_match.group(1)
         loser = loser_re_match.group(2)
     except AttributeError:
-      log(f"failed to parse loser", print_dest=None)
+      parse_failures.warning("failed to parse loser (round %s)", round)
 
     try:
       table = match_div.find("span", class_="tablenumber").text
     except AttributeError:
-      log(f"failed to parse table", print_dest=None)
+      parse_failures.warning("failed to parse table (round %s)", round)
 
     match = Match(winner,
                   loser,
@@ -124,22 +377,183 @@ def get_round_matches(data, round):
     if match.is_valid_match():
       matches.append(match)
     else:
-      log(f"missing data for match: {match}, {match_div}", print_dest=None)
+      parse_failures.warning("missing data for match: %s, %s", match,
+                             log_config.Lazy(str, match_div))
 
   return matches
 
 
-def get_rankings(event_id):
-  data = scrape(RK9_PAIRINGS_URL.format(event_id))
-  rankings_div = data.find(id="P2-standings")
-  if not rankings_div:
+def _lxml_text(el):
+  # same as bs4's get_text(" ", strip=True)
+  return " ".join(t.strip() for t in el.itertext() if t.strip())
+
+
+def _lxml_name(match_div, name_xpath):
+  found = name_xpath(match_div)
+  if not found:
+    return None, None
+
+  name = _lxml_text(found[0])
+  discord_match = DISCORD_RE.match(name)
+  if discord_match:
+    return discord_match.group(2), discord_match.group(1)
+
+  return name, None
+
+
+def get_round_slices(html, division=DEFAULT_DIVISION):
+  """
+  Finds the raw html of each {division}R{n} block without parsing the page:
+  from the block's opening tag up to the next round's (or the division's
+  standings). Returns a dict of round -> (start, stop) offsets into html.
+  """
+
+  round_start_re = re.compile(rf'id=["\']{division}R(\d+)["\']')
+  standings_start_re = re.compile(rf'id=["\']{division}-standings["\']')
+
+  starts = [(html.rfind("<", 0, m.start()), int(m.group(1)))
+            for m in round_start_re.finditer(html)]
+  if not starts:
+    return {}
+
+  standings = standings_start_re.search(html, starts[-1][0])
+  end = html.rfind("<", 0, standings.start()) if standings else len(html)
+
+  slices = {}
+  for i, (start, round) in enumerate(starts):
+    stop = starts[i + 1][0] if i + 1 < len(starts) else end
+    slices[round] = (start, stop)
+
+  return slices
+
+
+def get_round_fingerprints(html, division=DEFAULT_DIVISION):
+  """
+  Hashes each round's slice of the page (see get_round_slices), so a poller
+  can tell which rounds changed. Returns a dict of round -> digest.
+  """
+
+  return {
+      round: hashlib.sha1(html[start:stop].encode()).hexdigest()
+      for round, (start, stop) in get_round_slices(html, division).items()
+  }
+
+
+def get_round_slice_matches_lxml(html, rounds, division=DEFAULT_DIVISION):
+  """
+  Extracts `rounds` by parsing only their slices of the page, not the whole
+  page. Returns a dict of round number -> list of matches, like
+  get_all_round_matches_lxml.
+  """
+
+  slices = get_round_slices(html, division)
+  matches_by_round = {}
+  for round in rounds:
+    if round not in slices:
+      continue
+    start, stop = slices[round]
+    try:
+      # a slice can end with the closing tags of the elements around it,
+      # which the html parser drops
+      fragment = lxml.html.fragment_fromstring(html[start:stop],
+                                               create_parent="div")
+    except (lxml.etree.ParserError, ValueError):
+      continue
+    round_divs = get_round_divs_lxml(fragment, division)
+    if round in round_divs:
+      matches_by_round[round] = get_round_matches_lxml(round_divs[round], round)
+
+  return matches_by_round
+
+
+def get_round_divs_lxml(data, division=DEFAULT_DIVISION):
+  round_divs = {}
+  if data is None:
+    return round_divs
+
+  for round_div in ROUND_DIVS(data, prefix=f"{division}R"):
+    round_match = ROUND_ID_RE.match(round_div.get("id"))
+    if round_match:
+      round_divs[int(round_match.group(1))] = round_div
+
+  return round_divs
+
+
+def get_round_matches_lxml(round_div, round):
+  matches = []
+  for match_div in MATCH_DIVS(round_div):
+    winner, winner_discord = _lxml_name(match_div, WINNER_NAME)
+    if winner is None:
+      parse_failures.warning("failed to parse winner (round %s)", round)
+
+    loser, loser_discord = _lxml_name(match_div, LOSER_NAME)
+    if loser is None:
+      parse_failures.warning("failed to parse loser (round %s)", round)
+
+    table = None
+    table_spans = TABLE_NUMBER(match_div)
+    if table_spans:
+      table = table_spans[0].text_content()
+    else:
+      parse_failures.warning("failed to parse table (round %s)", round)
+
+    match = Match(winner,
+                  loser,
+                  table,
+                  round,
+                  winner_discord=winner_discord,
+                  loser_discord=loser_discord)
+    if match.is_valid_match():
+      matches.append(match)
+    else:
+      parse_failures.warning(
+          "missing data for match: %s, %s", match,
+          log_config.Lazy(lxml.html.tostring, match_div, encoding="unicode"))
+
+  return matches
+
+
+def get_all_round_matches_lxml(data, rounds=None, division=DEFAULT_DIVISION):
+  """
+  Extracts the matches for every round under the division's element in one
+  pass, or only for `rounds` if given. Returns a dict of round number ->
+  list of matches.
+  """
+
+  return {
+      round: get_round_matches_lxml(round_div, round)
+      for round, round_div in get_round_divs_lxml(data, division).items()
+      if rounds is None or round in rounds
+  }
+
+
+def get_rankings(event_id, parser=DEFAULT_PARSER, division=DEFAULT_DIVISION):
+  return EventSnapshot(event_id, parser=parser).get_rankings(division)
+
+
+def get_data_rankings(data, parser=DEFAULT_PARSER, division=DEFAULT_DIVISION):
+  if data is None:
     return None
 
-  discord_re = re.compile(r'(\d+). "(.*)" (.*)')
-  nodiscord_re = re.compile(r'(\d+). (.*)')
+  standings_id = f"{division}-standings"
+  if parser == "lxml":
+    found = data.xpath('.//*[@id=$id]', id=standings_id)
+    if not found:
+      return None
+    rows = (t.strip() for t in found[0].itertext() if t.strip())
+  else:
+    rankings_div = data.find(id=standings_id)
+    if not rankings_div:
+      return None
+    rows = rankings_div.stripped_strings
+
+  return get_rankings_for_rows(rows)
+
+
+def get_rankings_for_rows(rows):
   rankings = []
-  for row in rankings_div.stripped_strings:
-    discord_match = discord_re.match(row)
+  for row in rows:
+    discord_match = RANKING_DISCORD_RE.match(row)
     if discord_match:
       ranking, discord, name = discord_match.groups()
       player = Player(name, ranking, discord=discord)
@@ -147,7 +561,7 @@ def get_rankings(event_id):
         rankings.append(player)
         continue
 
-    nodiscord_match = nodiscord_re.match(row)
+    nodiscord_match = RANKING_RE.match(row)
     if nodiscord_match:
       ranking, name = nodiscord_match.groups()
       player = Player(name, ranking)
@@ -155,6 +569,6 @@ def get_rankings(event_id):
         rankings.append(player)
         continue
 
-    log(f"failed to parse ranking row: {row}")
+    parse_failures.warning("failed to parse ranking row: %s", row)
 
   return rankings
@@ -0,0 +1,264 @@
+import argparse
+import concurrent.futures
+import csv
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
+
+import yaml
+
+import archive
+import battlefy
+import bcp
+import http_cache
+import http_session
+import log_config
+import metrics
+import profiling
+import rk9
+import scrape_matches
+import scrape_rankings
+import throttle
+import writers
+
+FILENAME = os.path.basename(__file__)
+
+PLATFORMS = ("rk9", "bcp", "battlefy")
+
+parser = argparse.ArgumentParser(
+    description="scrape many events from a manifest of platform,tid,client_id "
+    "rows (.csv, or a .yaml list of mappings)")
+parser.add_argument('--manifest', type=str, required=True)
+parser.add_argument('--output', type=str, default=".")
+parser.add_argument('--jobs',
+                    type=int,
+                    default=4,
+                    help="events scraped at once, across all hosts")
+parser.add_argument('--per-host',
+                    type=int,
+                    default=2,
+                    help="events scraped at once against any one host")
+parser.add_argument('--concurrency',
+                    type=int,
+                    default=1,
+                    help="rounds to fetch in parallel within an event")
+parser.add_argument('--rankings',
+                    action='store_true',
+                    help="also write the rankings csv for each event")
+parser.add_argument('--format',
+                    choices=writers.FORMATS,
+                    default=writers.DEFAULT_FORMAT)
+parser.add_argument('--archive',
+                    type=str,
+                    metavar="DB",
+                    help="also store each event in this sqlite archive")
+parser.add_argument('--cache-dir', type=str)
+parser.add_argument('--offline', action='store_true')
+parser.add_argument('--timeout',
+                    type=float,
+                    default=http_session.DEFAULT_READ_TIMEOUT)
+parser.add_argument('--rate',
+                    type=float,
+                    default=throttle.DEFAULT_RATE,
+                    help="max requests per second to any one host")
+parser.add_argument('--retries',
+                    type=int,
+                    default=throttle.DEFAULT_MAX_RETRIES,
+                    help="retries for 429s, 5xxs and connection errors")
+parser.add_argument('--hedge',
+                    action='store_true',
+                    help="send a backup request when a battlefy request is "
+                    "slower than usual")
+parser.add_argument('--base-url',
+                    type=str,
+                    help="fetch from this host instead of rk9, bcp and "
+                    "battlefy's own, e.g. benchmarks/mock_server.py")
+
+log_config.add_arguments(parser)
+metrics.add_arguments(parser)
+profiling.add_arguments(parser)
+
+logger = logging.getLogger(__name__)
+
+
+def log(msg, print_dest="stderr"):
+  logger.info(msg)
+
+  if print_dest == "stderr":
+    print(msg, file=sys.stderr)
+
+  if print_dest == "stdout":
+    print(msg)
+
+
+def read_manifest(path):
+  if path.endswith((".yaml", ".yml")):
+    with open(path) as f:
+      rows = yaml.safe_load(f) or []
+  else:
+    with open(path, newline='') as f:
+      rows = list(csv.DictReader(f))
+
+  entries = []
+  for row in rows:
+    platform = (row.get("platform") or "").strip().lower()
+    tid = str(row.get("tid") or "").strip()
+    client_id = (row.get("client_id") or row.get("client-id") or
+                 "").strip() or None
+    if platform not in PLATFORMS or not tid:
+      log(f"skipping bad manifest row: {row}")
+      continue
+    entries.append((platform, tid, client_id))
+
+  return entries
+
+
+def platform_hosts():
+  """
+  The host each platform is scraped from, which --base-url can change.
+  """
+
+  return {
+      "rk9": urllib.parse.urlparse(rk9.RK9_PAIRINGS_URL).netloc,
+      "bcp": urllib.parse.urlparse(bcp.BCP_PAIRINGS_URL).netloc,
+      "battlefy": urllib.parse.urlparse(battlefy.BATTLEFY_PAIRINGS_URL).netloc,
+  }
+
+
+def run_batch(entries,
+              output_dir,
+              jobs,
+              per_host,
+              concurrency=1,
+              rankings=False,
+              format=writers.DEFAULT_FORMAT,
+              archive_path=None):
+  """
+  Scrapes each (platform, tid, client_id) entry with at most `jobs` events in
+  flight overall and `per_host` against any one host. Each event's csvs are
+  written as soon as it finishes (and stored in the sqlite archive at
+  archive_path, if given); a failing event is logged and skipped.
+
+  Returns a list of (platform, tid, seconds, error) tuples, error being None
+  for events that succeeded.
+  """
+
+  hosts = platform_hosts()
+  host_limits = {
+      host: threading.Semaphore(per_host) for host in set(hosts.values())
+  }
+  # sqlite takes one writer at a time anyway
+  archive_lock = threading.Lock()
+
+  def run_entry(platform, tid, client_id):
+    with host_limits[hosts[platform]]:
+      start = time.perf_counter()
+      try:
+        matches, get_players = scrape_matches.stream_event(
+            platform,
+            tid,
+            client_id=client_id,
+            concurrency=concurrency,
+            rankings=rankings)
+        if archive_path:
+          matches = list(matches)
+        scrape_matches.write_matches(matches,
+                                     output_dir,
+                                     platform,
+                                     tid,
+                                     format=format)
+        players = get_players()
+        if players is not None:
+          scrape_rankings.write_rankings(players,
+                                         output_dir,
+                                         platform,
+                                         tid,
+                                         format=format)
+        if archive_path:
+          with archive_lock, metrics.phase("archive"), archive.Archive(
+              archive_path) as db:
+            db.ingest_event(platform, tid, matches, players=players)
+      except Exception as e:
+        logger.info(traceback.format_exc())
+        return platform, tid, time.perf_counter() - start, repr(e)
+
+      return platform, tid, time.perf_counter() - start, None
+
+  results = []
+  with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+    futures = [executor.submit(run_entry, *entry) for entry in entries]
+    for future in concurrent.futures.as_completed(futures):
+      platform, tid, seconds, error = future.result()
+      if error:
+        log(f"FAILED {platform} {tid} after {seconds:.1f}s: {error}")
+      else:
+        log(f"done {platform} {tid} in {seconds:.1f}s")
+      results.append((platform, tid, seconds, error))
+
+  return results
+
+
+def log_summary(results, elapsed):
+  failures = [r for r in results if r[3]]
+
+  log(f"")
+  log(f"=== batch summary")
+  for platform, tid, seconds, error in sorted(results, key=lambda r: -r[2]):
+    status = "FAILED" if error else "ok"
+    log(f"  {status:6} {seconds:8.1f}s  {platform} {tid}")
+  log(f"")
+  log(f"events: {len(results)}, failed: {len(failures)}")
+  log(f"total time: {elapsed:.1f}s, "
+      f"summed event time: {sum(r[2] for r in results):.1f}s")
+  for platform, tid, _, error in failures:
+    log(f"  {platform} {tid}: {error}")
+
+
+def main():
+  args = parser.parse_args()
+
+  log_config.configure(log_config.log_path(args.output, FILENAME),
+                       level=args.log_level)
+  metrics.configure(args.metrics or metrics.summary_path(args.output, FILENAME),
+                    textfile=args.prometheus_textfile,
+                    job=FILENAME)
+  if args.profile:
+    profiling.start(args.output, FILENAME)
+
+  http_cache.configure(args.cache_dir, offline=args.offline)
+  http_session.configure(pool_maxsize=max(http_session.DEFAULT_POOL_MAXSIZE,
+                                          args.per_host * args.concurrency),
+                         read_timeout=args.timeout)
+  throttle.configure(rate=args.rate,
+                     burst=max(1, int(args.rate)),
+                     max_retries=args.retries,
+                     hedge=args.hedge)
+  if args.base_url:
+    for module in (rk9, bcp, battlefy):
+      module.configure(base_url=args.base_url)
+
+  entries = read_manifest(args.manifest)
+  log(f"scraping {len(entries)} events ({args.jobs} at once, "
+      f"{args.per_host} per host)")
+
+  start = time.perf_counter()
+  results = run_batch(entries,
+                      args.output,
+                      args.jobs,
+                      args.per_host,
+                      concurrency=args.concurrency,
+                      rankings=args.rankings,
+                      format=args.format,
+                      archive_path=args.archive)
+  log_summary(results, time.perf_counter() - start)
+
+  if any(error for *_, error in results):
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -1,21 +1,28 @@
 import argparse
-import csv
-import datetime
 import logging
 import os
 import pprint
 import sys
+import time
 
+import archive
 import battlefy
 import bcp
+import http_cache
+import http_session
+import log_config
+import metrics
+import profiling
 import rk9
+import scrape_rankings
+import throttle
+import watch
+import writers
 
-from util import Match, Game
+from util import Match, Game, MATCH_FIELDS
 
 FILENAME = os.path.basename(__file__)
 
-run_timestamp = datetime.datetime.now()
-
 pp = pprint.PrettyPrinter(indent=2)
 
 parser = argparse.ArgumentParser()
@@ -28,17 +35,71 @@ platform_group.add_argument('--bcp', action='store_true')
 platform_group.add_argument('--battlefy', action='store_true')
 parser.add_argument('--client-id', type=str)
 parser.add_argument('--games', action='store_true')
+parser.add_argument('--cache-dir',
+                    type=str,
+                    help="cache responses here and revalidate on re-runs")
+parser.add_argument('--offline',
+                    action='store_true',
+                    help="only serve responses from --cache-dir")
+parser.add_argument('--pool-size',
+                    type=int,
+                    default=http_session.DEFAULT_POOL_MAXSIZE,
+                    help="keep-alive connections per host")
+parser.add_argument('--timeout',
+                    type=float,
+                    default=http_session.DEFAULT_READ_TIMEOUT,
+                    help="read timeout (seconds) for each request")
+parser.add_argument('--rate',
+                    type=float,
+                    default=throttle.DEFAULT_RATE,
+                    help="max requests per second to any one host")
+parser.add_argument('--retries',
+                    type=int,
+                    default=throttle.DEFAULT_MAX_RETRIES,
+                    help="retries for 429s, 5xxs and connection errors")
+parser.add_argument('--hedge',
+                    action='store_true',
+                    help="send a backup request when a battlefy request is "
+                    "slower than usual")
+parser.add_argument('--base-url',
+                    type=str,
+                    help="fetch from this host instead of rk9, bcp and "
+                    "battlefy's own, e.g. benchmarks/mock_server.py")
+parser.add_argument('--concurrency',
+                    type=int,
+                    default=1,
+                    help="rounds to fetch in parallel (bcp, battlefy)")
+parser.add_argument('--rankings',
+                    action='store_true',
+                    help="also write the rankings csv for the event")
+parser.add_argument('--watch',
+                    type=float,
+                    metavar="SECONDS",
+                    help="poll the live round every SECONDS and append new "
+                    "matches to the output csvs")
+parser.add_argument('--format',
+                    choices=writers.FORMATS,
+                    default=writers.DEFAULT_FORMAT)
+parser.add_argument('--archive',
+                    type=str,
+                    metavar="DB",
+                    help="also store the event in this sqlite archive")
+parser.add_argument('--rk9-parser',
+                    choices=rk9.PARSERS,
+                    default=rk9.DEFAULT_PARSER)
+parser.add_argument('--divisions',
+                    nargs='+',
+                    choices=rk9.DIVISIONS,
+                    default=[rk9.DEFAULT_DIVISION],
+                    help="rk9 divisions to scrape (P0 juniors, P1 seniors, "
+                    "P2 masters) from one download; P2 is written to the "
+                    "usual rk9_{tid} outputs, the others to "
+                    "rk9_{tid}_{division}")
+log_config.add_arguments(parser)
+metrics.add_arguments(parser)
+profiling.add_arguments(parser)
 
-args = parser.parse_args()
-
-log_dir = os.path.abspath(args.output or ".")
-log_name = f"{FILENAME}-{run_timestamp:%Y%m%d}.log"
-log_path = os.path.join(log_dir, log_name)
-
-logging.basicConfig(format='[%(asctime)s] %(message)s',
-                    filename=log_path,
-                    level=logging.DEBUG)
-logger = logging.getLogger()
+logger = logging.getLogger(__name__)
 
 
 def log(msg, print_dest="stderr"):
@@ -51,58 +112,269 @@ def log(msg, print_dest="stderr"):
     print(msg)
 
 
+def stream_event(platform,
+                 tid,
+                 client_id=None,
+                 concurrency=1,
+                 rankings=False,
+                 rk9_parser=rk9.DEFAULT_PARSER):
+  """
+  Returns (matches, get_players). matches is an iterator over the event's
+  matches, streamed round by round as they're fetched; get_players() returns
+  the rankings (None unless rankings=True) once matches is exhausted.
+  """
+
+  get_players = lambda: None
+
+  if platform == "rk9":
+    # matches and standings come from the same page, so only fetch it once
+    event = rk9.EventSnapshot(tid, parser=rk9_parser)
+    matches = event.iter_matches()
+    if rankings:
+      get_players = event.get_rankings
+  elif platform == "bcp":
+    if not client_id:
+      raise Exception("bcp client-id required")
+    if rankings and concurrency > 1:
+      # rankings are paginated alongside the rounds, so pull them out of the
+      # same stream
+      players = []
+
+      def iter_bcp_matches():
+        for type, items in bcp.iter_event_concurrent(client_id,
+                                                     tid,
+                                                     concurrency,
+                                                     rankings=True):
+          if type == "rankings":
+            players.extend(items)
+          else:
+            yield from items
+
+      matches = iter_bcp_matches()
+      get_players = lambda: players
+    else:
+      matches = bcp.iter_matches(client_id, tid, concurrency=concurrency)
+      if rankings:
+        get_players = lambda: bcp.get_rankings(client_id, tid)
+  elif platform == "battlefy":
+    matches = battlefy.iter_matches(tid, concurrency=concurrency)
+    if rankings:
+      get_players = lambda: battlefy.get_rankings(tid)
+  else:
+    raise Exception(f"invalid platform: {platform}")
+
+  return matches, get_players
+
+
+def scrape_event(platform,
+                 tid,
+                 client_id=None,
+                 concurrency=1,
+                 rankings=False,
+                 rk9_parser=rk9.DEFAULT_PARSER):
+  """
+  Returns (matches, players) for the event; players is None unless
+  rankings=True.
+  """
+
+  matches, get_players = stream_event(platform,
+                                      tid,
+                                      client_id=client_id,
+                                      concurrency=concurrency,
+                                      rankings=rankings,
+                                      rk9_parser=rk9_parser)
+  matches = list(matches)
+  return matches, get_players()
+
+
+def match_row(match):
+  return [
+      match.round, match.table, match.winner, match.loser, match.winner_pid,
+      match.loser_pid, match.winner_discord, match.loser_discord
+  ]
+
+
+def write_matches(matches,
+                  output_dir,
+                  platform,
+                  tid,
+                  format=writers.DEFAULT_FORMAT):
+  """
+  Writes the matches output, and the games output if any match has games,
+  in a single pass over `matches` (which can be a stream).
+  """
+
+  base_path = os.path.join(output_dir, f"{platform}_{tid}")
+  game_writer = None
+
+  # fetching and parsing happen as the stream is pulled, in their own
+  # (nested) phases, so this phase's own time is just the writing
+  with metrics.phase("write.matches") as phase:
+    try:
+      with writers.open_writer(f"{base_path}_matches", MATCH_FIELDS,
+                               format) as match_writer:
+        for match in matches:
+          match_writer.writerow(match_row(match))
+
+          if not match.num_games:
+            continue
+
+          if game_writer is None:
+            game_writer = writers.open_writer(f"{base_path}_games",
+                                              MATCH_FIELDS, format)
+          game_writer.writerows(match_row(g) for g in match.iter_games())
+    finally:
+      if game_writer is not None:
+        game_writer.close()
+
+    phase.rows = match_writer.rows_written
+
+  num_games = game_writer.rows_written if game_writer else 0
+  log(f"found {match_writer.rows_written} matches ({num_games} games)")
+  log(f"output written to {match_writer.path}")
+  if game_writer is not None:
+    log(f"output written to {game_writer.path}")
+
+
+def scrape_rk9_divisions(args):
+  """
+  Downloads and parses the rk9 page once, extracts each of args.divisions
+  from it, and writes each to its own outputs (and archive entry), named by
+  rk9.division_name.
+  """
+
+  divisions = list(dict.fromkeys(args.divisions))
+  event = rk9.EventSnapshot(args.tid, parser=args.rk9_parser)
+  results = event.get_divisions(divisions, rankings=args.rankings)
+
+  for division in divisions:
+    matches, players = results[division]
+    if not matches:
+      log(f"no {division} matches found")
+      continue
+
+    name = rk9.division_name(args.tid, division)
+    write_matches(matches, args.output, "rk9", name, format=args.format)
+    if args.rankings:
+      if players is None:
+        log(f"no {division} rankings found")
+      else:
+        scrape_rankings.write_rankings(players,
+                                       args.output,
+                                       "rk9",
+                                       name,
+                                       format=args.format)
+
+    if args.archive:
+      with metrics.phase("archive"), archive.Archive(args.archive) as db:
+        count = db.ingest_event("rk9", name, matches, players=players)
+      log(f"archived {count} {division} matches to {args.archive}")
+
+
+def watch_event(args, platform):
+  name = args.tid
+  if platform == "rk9":
+    if len(args.divisions) > 1:
+      log("--watch follows one rk9 division at a time")
+      sys.exit(1)
+    division = args.divisions[0]
+    name = rk9.division_name(args.tid, division)
+    poller = watch.RK9Poller(args.tid, division=division)
+  elif platform == "bcp":
+    poller = watch.BCPPoller(args.client_id, args.tid)
+  else:
+    poller = watch.BattlefyPoller(args.tid)
+
+  match_path = os.path.join(args.output, f"{platform}_{name}_matches.csv")
+  game_path = os.path.join(args.output, f"{platform}_{name}_games.csv")
+  appender = watch.MatchAppender(match_path, game_path)
+
+  log(f"watching {platform} {args.tid} every {args.watch}s (ctrl-c to stop)")
+  try:
+    while True:
+      matches = poller.poll()
+      new_matches, new_games = appender.append(matches)
+      log(f"appended {new_matches} matches ({new_games} games)")
+      time.sleep(args.watch)
+  except KeyboardInterrupt:
+    log("stopped watching")
+
+
 def main():
+  args = parser.parse_args()
+  log_config.configure(log_config.log_path(args.output or ".", FILENAME),
+                       level=args.log_level)
+  metrics.configure(args.metrics or
+                    metrics.summary_path(args.output or ".", FILENAME),
+                    textfile=args.prometheus_textfile,
+                    job=FILENAME)
+  if args.profile:
+    profiling.start(args.output or ".", FILENAME)
+
+  http_cache.configure(args.cache_dir, offline=args.offline)
+  http_session.configure(pool_maxsize=max(args.pool_size, args.concurrency),
+                         read_timeout=args.timeout)
+  throttle.configure(rate=args.rate,
+                     burst=max(1, int(args.rate)),
+                     max_retries=args.retries,
+                     hedge=args.hedge)
+  if args.base_url:
+    for module in (rk9, bcp, battlefy):
+      module.configure(base_url=args.base_url)
+
   if args.rk9:
     platform = "rk9"
-    matches = rk9.get_all_matches(args.tid)
   elif args.bcp:
     platform = "bcp"
-    if not args.client_id:
-      log("bcp client-id required")
-      sys.exit(1)
-    matches = bcp.get_all_matches(args.client_id, args.tid)
   elif args.battlefy:
     platform = "battlefy"
-    matches = battlefy.get_all_matches(args.tid)
   else:
     log("invalid platform")
     sys.exit(1)
 
-  games = sum([len(m.games) for m in matches])
-  log(f"found {len(matches)} matches ({games} games)")
-
-  match_path = os.path.join(args.output, f"{platform}_{args.tid}_matches.csv")
-  with open(match_path, 'w', newline='') as f:
-    writer = csv.writer(f)
-    writer.writerow([
-        "round", "table", "winner", "loser", "winner_pid", "loser_pid",
-        "winner_discord", "loser_discord"
-    ])
-    for match in matches:
-      writer.writerow([
-          match.round, match.table, match.winner, match.loser, match.winner_pid,
-          match.loser_pid, match.winner_discord, match.loser_discord
-      ])
-
-  log(f"output written to {match_path}")
-
-  has_games = any([len(m.games) > 0 for m in matches])
-  if has_games:
-    game_path = os.path.join(args.output, f"{platform}_{args.tid}_games.csv")
-    with open(game_path, 'w', newline='') as f:
-      writer = csv.writer(f)
-      writer.writerow([
-          "round", "table", "winner", "loser", "winner_pid", "loser_pid",
-          "winner_discord", "loser_discord"
-      ])
-      for match in matches:
-        for game in match.games:
-          writer.writerow([
-              game.round, game.table, game.winner, game.loser, game.winner_pid,
-              game.loser_pid, game.winner_discord, game.loser_discord
-          ])
-
-    log(f"output written to {game_path}")
+  if platform == "bcp" and not args.client_id:
+    log("bcp client-id required")
+    sys.exit(1)
+
+  if args.watch:
+    if args.format != "csv":
+      log("--watch appends to csv output; ignoring --format")
+    watch_event(args, platform)
+    return
+
+  if platform == "rk9" and args.divisions != [rk9.DEFAULT_DIVISION]:
+    scrape_rk9_divisions(args)
+    return
+
+  matches, get_players = stream_event(platform,
+                                      args.tid,
+                                      client_id=args.client_id,
+                                      concurrency=args.concurrency,
+                                      rankings=args.rankings,
+                                      rk9_parser=args.rk9_parser)
+
+  if args.archive:
+    # the archive needs the matches after the writers are done with them
+    matches = list(matches)
+
+  write_matches(matches, args.output, platform, args.tid, format=args.format)
+
+  players = None
+  if args.rankings:
+    players = get_players()
+    if players is None:
+      log("no rankings found")
+    else:
+      scrape_rankings.write_rankings(players,
+                                     args.output,
+                                     platform,
+                                     args.tid,
+                                     format=args.format)
+
+  if args.archive:
+    with metrics.phase("archive"), archive.Archive(args.archive) as db:
+      count = db.ingest_event(platform, args.tid, matches, players=players)
+    log(f"archived {count} matches to {args.archive}")
 
 
 if __name__ == "__main__":
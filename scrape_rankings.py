@@ -1,6 +1,4 @@
 import argparse
-import csv
-import datetime
 import logging
 import os
 import pprint
@@ -8,13 +6,19 @@ import sys
 
 import battlefy
 import bcp
+import http_cache
+import http_session
+import log_config
+import metrics
+import profiling
 import rk9
+import throttle
+import writers
+from util import RANKING_FIELDS
 
 FILENAME = os.path.basename(__file__)
 FILEDIR = os.path.dirname(__file__)
 
-run_timestamp = datetime.datetime.now()
-
 pp = pprint.PrettyPrinter(indent=2)
 
 parser = argparse.ArgumentParser()
@@ -27,15 +31,52 @@ platform_group.add_argument('--bcp', action='store_true')
 platform_group.add_argument('--battlefy', action='store_true')
 parser.add_argument('--client-id', type=str)
 parser.add_argument('--games', action='store_true')
-
-log_dir = os.path.join(FILEDIR, "logs")
-log_name = f"{FILENAME}-{run_timestamp:%Y%m%d}.log"
-log_path = os.path.join(log_dir, log_name)
-
-logging.basicConfig(format='[%(asctime)s] %(message)s',
-                    filename=log_path,
-                    level=logging.DEBUG)
-logger = logging.getLogger()
+parser.add_argument('--format',
+                    choices=writers.FORMATS,
+                    default=writers.DEFAULT_FORMAT)
+parser.add_argument('--cache-dir',
+                    type=str,
+                    help="cache responses here and revalidate on re-runs")
+parser.add_argument('--offline',
+                    action='store_true',
+                    help="only serve responses from --cache-dir")
+parser.add_argument('--pool-size',
+                    type=int,
+                    default=http_session.DEFAULT_POOL_MAXSIZE,
+                    help="keep-alive connections per host")
+parser.add_argument('--timeout',
+                    type=float,
+                    default=http_session.DEFAULT_READ_TIMEOUT,
+                    help="read timeout (seconds) for each request")
+parser.add_argument('--rate',
+                    type=float,
+                    default=throttle.DEFAULT_RATE,
+                    help="max requests per second to any one host")
+parser.add_argument('--retries',
+                    type=int,
+                    default=throttle.DEFAULT_MAX_RETRIES,
+                    help="retries for 429s, 5xxs and connection errors")
+parser.add_argument('--hedge',
+                    action='store_true',
+                    help="send a backup request when a battlefy request is "
+                    "slower than usual")
+parser.add_argument('--divisions',
+                    nargs='+',
+                    choices=rk9.DIVISIONS,
+                    default=[rk9.DEFAULT_DIVISION],
+                    help="rk9 divisions to read standings for, from one "
+                    "download; P2 is written to the usual rk9_{tid}_rankings, "
+                    "the others to rk9_{tid}_{division}_rankings")
+parser.add_argument('--base-url',
+                    type=str,
+                    help="fetch from this host instead of rk9, bcp and "
+                    "battlefy's own, e.g. benchmarks/mock_server.py")
+
+log_config.add_arguments(parser)
+metrics.add_arguments(parser)
+profiling.add_arguments(parser)
+
+logger = logging.getLogger(__name__)
 
 
 def log(msg, print_dest="stderr"):
@@ -50,6 +91,38 @@ def log(msg, print_dest="stderr"):
 
 def main():
   args = parser.parse_args()
+  log_dir = os.path.join(FILEDIR, "logs")
+  log_config.configure(log_config.log_path(log_dir, FILENAME),
+                       level=args.log_level)
+  metrics.configure(args.metrics or metrics.summary_path(log_dir, FILENAME),
+                    textfile=args.prometheus_textfile,
+                    job=FILENAME)
+  if args.profile:
+    profiling.start(log_dir, FILENAME)
+
+  http_cache.configure(args.cache_dir, offline=args.offline)
+  http_session.configure(pool_maxsize=args.pool_size, read_timeout=args.timeout)
+  throttle.configure(rate=args.rate,
+                     burst=max(1, int(args.rate)),
+                     max_retries=args.retries,
+                     hedge=args.hedge)
+  if args.base_url:
+    for module in (rk9, bcp, battlefy):
+      module.configure(base_url=args.base_url)
+
+  if args.rk9 and args.divisions != [rk9.DEFAULT_DIVISION]:
+    event = rk9.EventSnapshot(args.tid)
+    for division in dict.fromkeys(args.divisions):
+      players = event.get_rankings(division)
+      if not players:
+        log(f"no {division} rankings found")
+        continue
+      write_rankings(players,
+                     args.output,
+                     "rk9",
+                     rk9.division_name(args.tid, division),
+                     format=args.format)
+    return
 
   if args.rk9:
     platform = "rk9"
@@ -67,16 +140,23 @@ def main():
     log("invalid platform")
     sys.exit(1)
 
-  players_path = os.path.join(args.output,
-                              f"{platform}_{args.tid}_rankings.csv")
-  with open(players_path, 'w', newline='') as f:
-    writer = csv.writer(f)
-    writer.writerow(["ranking", "name", "player_id", "discord"])
+  write_rankings(players, args.output, platform, args.tid, format=args.format)
+
+
+def write_rankings(players,
+                   output_dir,
+                   platform,
+                   tid,
+                   format=writers.DEFAULT_FORMAT):
+  base_path = os.path.join(output_dir, f"{platform}_{tid}_rankings")
+  with metrics.phase("write.rankings") as phase, writers.open_writer(
+      base_path, RANKING_FIELDS, format) as writer:
     for player in players:
       writer.writerow(
           [player.ranking, player.name, player.player_id, player.discord])
+    phase.rows = writer.rows_written
 
-  log(f"output written to {players_path}")
+  log(f"output written to {writer.path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,280 @@
+import concurrent.futures
+import email.utils
+import logging
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE = 10.0  # requests per second per host
+DEFAULT_BURST = 10
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_CAP = 60.0
+# a server asking us to wait longer than this isn't coming back within a
+# scrape, and sleeping on it would hold a worker (and a batch slot) hostage
+MAX_RETRY_AFTER = 300.0
+
+DEFAULT_INITIAL_CONCURRENCY = 8
+DEFAULT_MAX_CONCURRENCY = 32
+# responses slower than this count as congestion, the same as a 429
+DEFAULT_LATENCY_TARGET = 5.0
+
+# battlefy's api is a cloudfront distribution with a long latency tail;
+# battlefy.configure repoints this when the api is served from elsewhere
+HEDGE_HOSTS = {"dtmwra1jsgyb0.cloudfront.net"}
+DEFAULT_HEDGE_DELAY = 2.0
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_lock = threading.Lock()
+_hosts = {}
+_settings = {
+    "rate": DEFAULT_RATE,
+    "burst": DEFAULT_BURST,
+    "max_retries": DEFAULT_MAX_RETRIES,
+    "backoff_base": DEFAULT_BACKOFF_BASE,
+    "backoff_cap": DEFAULT_BACKOFF_CAP,
+    "initial_concurrency": DEFAULT_INITIAL_CONCURRENCY,
+    "max_concurrency": DEFAULT_MAX_CONCURRENCY,
+    "latency_target": DEFAULT_LATENCY_TARGET,
+    "hedge": False,
+    "hedge_delay": DEFAULT_HEDGE_DELAY,
+}
+
+_hedge_executor = None
+
+
+class TokenBucket:
+  """
+  Allows `rate` acquisitions per second on average, with bursts of up to
+  `burst`.
+  """
+
+  def __init__(self, rate, burst):
+    self.rate = rate
+    self.burst = burst
+    self.tokens = burst
+    self.updated = time.monotonic()
+    self.lock = threading.Lock()
+
+  def acquire(self):
+    while True:
+      with self.lock:
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return
+
+        wait = (1 - self.tokens) / self.rate
+
+      time.sleep(wait)
+
+
+class AdaptiveLimiter:
+  """
+  Caps in-flight requests at a limit that grows by one per window of
+  successful responses and halves on a 429 or a response slower than the
+  latency target (additive increase, multiplicative decrease).
+  """
+
+  def __init__(self, initial, maximum, latency_target):
+    self.limit = float(initial)
+    self.maximum = maximum
+    self.latency_target = latency_target
+    self.in_flight = 0
+    self.cond = threading.Condition()
+
+  def acquire(self):
+    with self.cond:
+      while self.in_flight >= int(self.limit):
+        self.cond.wait()
+      self.in_flight += 1
+
+  def release(self, throttled=False, latency=None):
+    with self.cond:
+      self.in_flight -= 1
+
+      if throttled or (latency is not None and latency > self.latency_target):
+        self.limit = max(1.0, self.limit / 2)
+      else:
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+      self.cond.notify_all()
+
+
+class HostThrottle:
+
+  def __init__(self, host):
+    self.host = host
+    self.bucket = TokenBucket(_settings["rate"], _settings["burst"])
+    self.limiter = AdaptiveLimiter(_settings["initial_concurrency"],
+                                   _settings["max_concurrency"],
+                                   _settings["latency_target"])
+    self.latencies = []
+
+  def hedge_delay(self):
+    # hedge at roughly the p90 of what we've seen, once we've seen enough
+    if len(self.latencies) < 20:
+      return _settings["hedge_delay"]
+    recent = sorted(self.latencies[-200:])
+    return recent[int(len(recent) * 0.9)]
+
+  def record_latency(self, latency):
+    self.latencies.append(latency)
+    if len(self.latencies) > 1000:
+      del self.latencies[:500]
+
+
+def configure(rate=DEFAULT_RATE,
+              burst=DEFAULT_BURST,
+              max_retries=DEFAULT_MAX_RETRIES,
+              max_concurrency=DEFAULT_MAX_CONCURRENCY,
+              latency_target=DEFAULT_LATENCY_TARGET,
+              hedge=False,
+              hedge_delay=DEFAULT_HEDGE_DELAY):
+  with _lock:
+    _settings.update(rate=rate,
+                     burst=burst,
+                     max_retries=max_retries,
+                     max_concurrency=max_concurrency,
+                     latency_target=latency_target,
+                     hedge=hedge,
+                     hedge_delay=hedge_delay)
+    _hosts.clear()
+
+
+def get_host(host):
+  with _lock:
+    if host not in _hosts:
+      _hosts[host] = HostThrottle(host)
+    return _hosts[host]
+
+
+def retry_after_seconds(response):
+  value = response.headers.get("Retry-After")
+  if not value:
+    return None
+
+  try:
+    return max(0.0, float(value))
+  except ValueError:
+    pass
+
+  try:
+    when = email.utils.parsedate_to_datetime(value)
+  except (TypeError, ValueError):
+    return None
+  return max(0.0, when.timestamp() - time.time())
+
+
+def backoff_seconds(attempt):
+  # "full jitter": uniform over [0, min(cap, base * 2^attempt)]
+  ceiling = min(_settings["backoff_cap"],
+                _settings["backoff_base"] * (2**attempt))
+  return random.uniform(0, ceiling)
+
+
+def _send(throttle, send):
+  waited = time.monotonic()
+  throttle.bucket.acquire()
+  throttle.limiter.acquire()
+
+  start = time.monotonic()
+  metrics.record_throttle_wait(throttle.host, start - waited)
+  throttled = False
+  try:
+    response = send()
+    throttled = response.status_code == 429
+    return response
+  finally:
+    latency = time.monotonic() - start
+    throttle.record_latency(latency)
+    throttle.limiter.release(throttled=throttled, latency=latency)
+
+
+def _send_hedged(throttle, send):
+  global _hedge_executor
+
+  with _lock:
+    if _hedge_executor is None:
+      _hedge_executor = concurrent.futures.ThreadPoolExecutor(
+          max_workers=_settings["max_concurrency"])
+
+  first = _hedge_executor.submit(_send, throttle, send)
+  done, _ = concurrent.futures.wait([first], timeout=throttle.hedge_delay())
+  if done:
+    return first.result()
+
+  logger.info("hedging slow request to %s", throttle.host)
+  metrics.count("throttle.hedged")
+  second = _hedge_executor.submit(_send, throttle, send)
+  done, _ = concurrent.futures.wait(
+      [first, second], return_when=concurrent.futures.FIRST_COMPLETED)
+
+  # prefer whichever finished without raising
+  for future in done:
+    if future.exception() is None:
+      return future.result()
+  return first.result() if first in done else second.result()
+
+
+def call(url, send):
+  """
+  Calls send() (which makes one request to url and returns the response)
+  under the host's rate limit and concurrency limit, retrying 429s, 5xxs and
+  connection errors with jittered exponential backoff. A Retry-After header
+  takes precedence over the computed backoff, up to MAX_RETRY_AFTER.
+
+  Raises requests.HTTPError if the last attempt still has an error status,
+  or if the server asks for a wait longer than MAX_RETRY_AFTER.
+  """
+
+  host = urllib.parse.urlparse(url).netloc
+  throttle = get_host(host)
+  hedge = _settings["hedge"] and host in HEDGE_HOSTS
+  max_retries = _settings["max_retries"]
+
+  attempt = 0
+  while True:
+    try:
+      if hedge:
+        response = _send_hedged(throttle, send)
+      else:
+        response = _send(throttle, send)
+    except (requests.ConnectionError, requests.Timeout) as e:
+      if attempt >= max_retries:
+        raise
+      wait = backoff_seconds(attempt)
+      logger.info("%s from %s, retry in %.1fs", type(e).__name__, host, wait)
+    else:
+      if response.status_code not in RETRY_STATUSES:
+        response.raise_for_status()
+        return response
+
+      if attempt >= max_retries:
+        response.raise_for_status()
+
+      wait = retry_after_seconds(response)
+      if wait is not None and wait > MAX_RETRY_AFTER:
+        logger.warning("%d from %s asks for a %.0fs wait, giving up",
+                       response.status_code, host, wait)
+        response.raise_for_status()
+      if wait is None:
+        wait = backoff_seconds(attempt)
+      logger.info("%d from %s, retry in %.1fs", response.status_code, host,
+                  wait)
+
+    metrics.record_retry(host)
+    attempt += 1
+    time.sleep(wait)
@@ -1,4 +1,25 @@
+# columns of the matches/games csvs, in order; also the attribute names on
+# Match and Game
+MATCH_FIELDS = [
+    "round", "table", "winner", "loser", "winner_pid", "loser_pid",
+    "winner_discord", "loser_discord"
+]
+
+# columns of the rankings csv; also the attribute names on Player
+RANKING_FIELDS = ["ranking", "name", "player_id", "discord"]
+
+
+def _game_count(wins):
+  if wins == '' or wins is None:
+    return 0
+  return int(wins)
+
+
 class Match:
+  # matches are the bulk of what a scrape holds in memory, so keep them
+  # slotted and derive games from the win counts instead of storing them
+  __slots__ = ("winner", "loser", "table", "round", "winner_wins", "loser_wins",
+               "winner_pid", "loser_pid", "winner_discord", "loser_discord")
 
   def __init__(self,
                winner,
@@ -15,11 +36,12 @@ class Match:
     self.loser = loser
     self.table = table
     self.round = round
+    self.winner_wins = _game_count(winner_wins)
+    self.loser_wins = _game_count(loser_wins)
     self.winner_pid = winner_pid
     self.loser_pid = loser_pid
     self.winner_discord = winner_discord
     self.loser_discord = loser_discord
-    self.games = self.make_games(winner_wins, loser_wins)
 
   def __repr__(self):
     return f"{self.winner} beat {self.loser} (round {self.round}, table {self.table})"
@@ -28,29 +50,27 @@ class Match:
   def is_valid_match(self):
     return self.winner and self.loser and self.table and self.round
 
-  def make_games(self, winner_wins, loser_wins):
-    l = []
-
-    if winner_wins == '':
-      winner_wins = 0
+  @property
+  def num_games(self):
+    return self.winner_wins + self.loser_wins
 
-    if loser_wins == '':
-      loser_wins = 0
+  @property
+  def games(self):
+    return list(self.iter_games())
 
-    for i in range(int(winner_wins) or 0):
-      l.append(
-          Game(self.winner, self.loser, self.table, self.round, self.winner_pid,
-               self.loser_pid))
+  def iter_games(self):
+    for i in range(self.winner_wins):
+      yield Game(self.winner, self.loser, self.table, self.round,
+                 self.winner_pid, self.loser_pid)
 
-    for i in range(int(loser_wins) or 0):
-      l.append(
-          Game(self.loser, self.winner, self.table, self.round, self.loser_pid,
-               self.winner_pid))
-
-    return l
+    for i in range(self.loser_wins):
+      yield Game(self.loser, self.winner, self.table, self.round,
+                 self.loser_pid, self.winner_pid)
 
 
 class Game:
+  __slots__ = ("winner", "loser", "table", "round", "winner_pid", "loser_pid",
+               "winner_discord", "loser_discord")
 
   def __init__(self,
                winner,
@@ -71,10 +91,11 @@ class Game:
     self.loser_discord = loser_discord
 
   def __repr__(self):
-    return f"{self.winner} beat {self.loser} (round {self.round}, table {self.table}, game {self.match_game})"
+    return f"{self.winner} beat {self.loser} (round {self.round}, table {self.table})"
 
 
 class Player:
+  __slots__ = ("name", "ranking", "player_id", "discord")
 
   def __init__(self, name, ranking, player_id=None, discord=None):
     self.name = name
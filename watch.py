@@ -0,0 +1,215 @@
+import abc
+import csv
+import os
+
+import battlefy
+import bcp
+import rk9
+from util import MATCH_FIELDS
+
+
+class MatchAppender:
+  """
+  Appends match (and game) rows to the output csvs. Rows are keyed by
+  round/table, so a poll that returns the same rows appends nothing, and a
+  result corrected between polls replaces the rows it supersedes instead of
+  leaving the stale row next to the new one. Polls return whole rounds, so
+  rows of a polled round that are no longer in it (e.g. a pairing moved to
+  another table) are removed. Either way the file is rewritten.
+  """
+
+  def __init__(self, match_path, game_path):
+    self.paths = {"matches": match_path, "games": game_path}
+    self.rows = {kind: self.read_rows(path) for kind, path in self.paths.items()}
+
+  def read_rows(self, path):
+    rows = {}
+    try:
+      with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+          rows.setdefault(row_key(row), []).append(tuple(row))
+    except FileNotFoundError:
+      pass
+    return rows
+
+  def append_rows(self, kind, records, rounds):
+    polled = {}
+    for record in records:
+      row = tuple("" if v is None else str(v)
+                  for v in (getattr(record, f) for f in MATCH_FIELDS))
+      polled.setdefault(row_key(row), []).append(row)
+
+    rows = self.rows[kind]
+    new_rows = []
+    # keys are (round, table) strings, as read back from the csv
+    removed = [key for key in rows if key[0] in rounds and key not in polled]
+    for key in removed:
+      del rows[key]
+
+    superseded = bool(removed)
+    for key, key_rows in polled.items():
+      if rows.get(key) == key_rows:
+        continue
+      superseded = superseded or key in rows
+      rows[key] = key_rows
+      new_rows.extend(key_rows)
+
+    path = self.paths[kind]
+    if superseded:
+      self.rewrite(path, rows)
+      return len(new_rows)
+
+    if not new_rows:
+      return 0
+
+    write_header = not os.path.exists(path)
+    with open(path, 'a', newline='') as f:
+      writer = csv.writer(f)
+      if write_header:
+        writer.writerow(MATCH_FIELDS)
+      writer.writerows(new_rows)
+
+    return len(new_rows)
+
+  def rewrite(self, path, rows):
+    # write to the side and rename so a reader never sees a partial file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', newline='') as f:
+      writer = csv.writer(f)
+      writer.writerow(MATCH_FIELDS)
+      for key_rows in rows.values():
+        writer.writerows(key_rows)
+    os.replace(tmp_path, path)
+
+  def append(self, matches):
+    rounds = set(str(m.round) for m in matches)
+    new_matches = self.append_rows("matches", matches, rounds)
+    new_games = self.append_rows("games",
+                                 (g for m in matches for g in m.iter_games()),
+                                 rounds)
+    return new_matches, new_games
+
+
+def row_key(row):
+  # round, table
+  return tuple(row[:2])
+
+
+class RoundPoller(abc.ABC):
+  """
+  Polls a round-by-round api. Rounds before the current one are final once
+  the next round has pairings, so each poll refetches only the current round
+  and probes the one after it. When the next round turns up, the current one
+  is fetched once more, since results may have been posted between the two
+  requests.
+  """
+
+  max_rounds = 19
+
+  def __init__(self):
+    self.current_round = 1
+    self.round_sizes = {}
+
+  @abc.abstractmethod
+  def fetch_round(self, round):
+    pass
+
+  @abc.abstractmethod
+  def convert(self, round, round_data):
+    pass
+
+  def poll(self):
+    matches_by_round = {}
+    round = self.current_round
+
+    while round <= self.max_rounds:
+      round_data = self.fetch_round(round)
+      if not round_data:
+        break
+
+      if round > self.current_round:
+        self.update_round(round - 1, self.fetch_round(round - 1),
+                          matches_by_round)
+      self.update_round(round, round_data, matches_by_round)
+      self.current_round = round
+      round += 1
+
+    return [m for r in sorted(matches_by_round) for m in matches_by_round[r]]
+
+  def update_round(self, round, round_data, matches_by_round):
+    if not round_data:
+      return
+    self.round_sizes[round] = len(round_data)
+    matches_by_round[round] = self.convert(round, round_data)
+
+
+class BCPPoller(RoundPoller):
+
+  max_rounds = bcp.MAX_ROUNDS
+
+  def __init__(self, client_id, event_id):
+    super().__init__()
+    self.client_id = client_id
+    self.event_id = event_id
+
+  def fetch_round(self, round):
+    return bcp.get_all_match_data(self.client_id, self.event_id, round)
+
+  def convert(self, round, round_data):
+    matches = [bcp.match_for_match_data(m) for m in round_data]
+    return [m for m in matches if m and m.is_valid_match()]
+
+
+class BattlefyPoller(RoundPoller):
+
+  max_rounds = battlefy.MAX_ROUNDS
+
+  def __init__(self, event_id):
+    super().__init__()
+    self.event_id = event_id
+
+  def fetch_round(self, round):
+    return battlefy.get_all_match_data(self.event_id, round)
+
+  def convert(self, round, round_data):
+    # earlier rounds are final, so their sizes give this round's table offset
+    prior_rounds_match_count = sum(
+        size for r, size in self.round_sizes.items() if r < round)
+    matches = [
+        battlefy.match_for_match_data(m, prior_rounds_match_count)
+        for m in round_data
+    ]
+    return [m for m in matches if m and m.is_valid_match()]
+
+
+class RK9Poller:
+  """
+  RK9 serves the whole event as one page, so every poll downloads it, but
+  only the {division}R{n} blocks whose html changed since the last poll are
+  parsed, each on its own. If nothing changed nothing is parsed.
+  """
+
+  def __init__(self, event_id, division=rk9.DEFAULT_DIVISION):
+    self.event_id = event_id
+    self.division = division
+    self.fingerprints = {}
+
+  def poll(self):
+    html = rk9.fetch(rk9.RK9_PAIRINGS_URL.format(self.event_id))
+    fingerprints = rk9.get_round_fingerprints(html, self.division)
+    changed = set(r for r, digest in fingerprints.items()
+                  if self.fingerprints.get(r) != digest)
+    if not changed:
+      return []
+
+    matches_by_round = rk9.get_round_slice_matches_lxml(html,
+                                                        changed,
+                                                        division=self.division)
+    self.fingerprints.update(fingerprints)
+
+    matches = []
+    for round in sorted(matches_by_round):
+      matches.extend(matches_by_round[round])
+    return matches
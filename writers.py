@@ -0,0 +1,261 @@
+import abc
+import csv
+import functools
+import gzip
+import io
+import json
+import logging
+
+import log_config
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+try:
+  import pyarrow
+  import pyarrow.parquet
+except ImportError:
+  pyarrow = None
+
+# format name -> file extension
+FORMATS = {
+    "csv": ".csv",
+    "csv.gz": ".csv.gz",
+    "csv.zst": ".csv.zst",
+    "jsonl": ".jsonl",
+    "parquet": ".parquet",
+}
+DEFAULT_FORMAT = "csv"
+
+# columns written as integers by the typed formats (jsonl, parquet); csv
+# formats write every value as it comes
+INT_FIELDS = {
+    "round",
+    "table",
+    "ranking",
+    "winner_ranking",
+    "loser_ranking",
+    "wins",
+    "losses",
+    "games",
+}
+
+PARQUET_BATCH_ROWS = 10000
+
+logger = logging.getLogger(__name__)
+conversion_failures = log_config.RateLimited(logger)
+
+
+def missing_dependency(package, extra, purpose):
+  return ImportError(f"{purpose} requires the {package} package; install it "
+                     f"with `poetry install -E {extra}` or "
+                     f"`pip install {package}`")
+
+
+def output_path(base_path, format=DEFAULT_FORMAT):
+  """
+  base_path is the output path without an extension, e.g.
+  "out/rk9_123_matches".
+  """
+
+  if format not in FORMATS:
+    raise ValueError(f"unknown output format: {format}")
+  return base_path + FORMATS[format]
+
+
+def to_int(value, field=None):
+  if value is None or value == '':
+    return None
+  try:
+    return int(value)
+  except (TypeError, ValueError):
+    # csv keeps the value as it is, but an integer column can only hold null
+    conversion_failures.warning("non-integer %s written as null: %r",
+                                field,
+                                value,
+                                key=f"non-integer {field} written as null")
+    return None
+
+
+def to_str(value):
+  if value is None:
+    return None
+  return str(value)
+
+
+class RowWriter(abc.ABC):
+  """
+  Writes rows (sequences in `fields` order) to one output file. Use as a
+  context manager, or call close().
+  """
+
+  def __init__(self, path, fields):
+    self.path = path
+    self.fields = list(fields)
+    self.converters = [
+        functools.partial(to_int, field=f) if f in INT_FIELDS else to_str
+        for f in self.fields
+    ]
+    self.rows_written = 0
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def typed(self, row):
+    return [convert(v) for convert, v in zip(self.converters, row)]
+
+  @abc.abstractmethod
+  def writerow(self, row):
+    pass
+
+  def writerows(self, rows):
+    for row in rows:
+      self.writerow(row)
+
+  @abc.abstractmethod
+  def close(self):
+    pass
+
+
+class CSVWriter(RowWriter):
+
+  def __init__(self, path, fields, compression=None):
+    super().__init__(path, fields)
+
+    if compression == "gz":
+      self.file = gzip.open(path, 'wt', newline='')
+    elif compression == "zst":
+      if zstandard is None:
+        raise missing_dependency("zstandard", "zstd", "csv.zst output")
+      raw = open(path, 'wb')
+      stream = zstandard.ZstdCompressor().stream_writer(raw)
+      self.file = io.TextIOWrapper(stream, newline='', encoding='utf-8')
+    else:
+      self.file = open(path, 'w', newline='')
+
+    self.writer = csv.writer(self.file)
+    self.writer.writerow(self.fields)
+
+  def writerow(self, row):
+    self.writer.writerow(row)
+    self.rows_written += 1
+
+  def close(self):
+    self.file.close()
+
+
+class JSONLWriter(RowWriter):
+
+  def __init__(self, path, fields):
+    super().__init__(path, fields)
+    self.file = open(path, 'w')
+
+  def writerow(self, row):
+    record = dict(zip(self.fields, self.typed(row)))
+    self.file.write(json.dumps(record))
+    self.file.write("\n")
+    self.rows_written += 1
+
+  def close(self):
+    self.file.close()
+
+
+class ParquetWriter(RowWriter):
+  """
+  Buffers rows into columnar batches and writes one row group per batch.
+  """
+
+  def __init__(self, path, fields):
+    if pyarrow is None:
+      raise missing_dependency("pyarrow", "parquet", "parquet output")
+
+    super().__init__(path, fields)
+    self.schema = pyarrow.schema([
+        (f, pyarrow.int64() if f in INT_FIELDS else pyarrow.string())
+        for f in self.fields
+    ])
+    self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+    self.batch = [[] for _ in self.fields]
+
+  def writerow(self, row):
+    for column, value in zip(self.batch, self.typed(row)):
+      column.append(value)
+    self.rows_written += 1
+
+    if len(self.batch[0]) >= PARQUET_BATCH_ROWS:
+      self.flush()
+
+  def flush(self):
+    if not self.batch[0]:
+      return
+    arrays = [
+        pyarrow.array(column, type=type)
+        for column, type in zip(self.batch, self.schema.types)
+    ]
+    self.writer.write_table(
+        pyarrow.Table.from_arrays(arrays, schema=self.schema))
+    self.batch = [[] for _ in self.fields]
+
+  def close(self):
+    self.flush()
+    self.writer.close()
+
+
+def open_writer(base_path, fields, format=DEFAULT_FORMAT):
+  path = output_path(base_path, format)
+
+  if format == "csv":
+    return CSVWriter(path, fields)
+  elif format == "csv.gz":
+    return CSVWriter(path, fields, compression="gz")
+  elif format == "csv.zst":
+    return CSVWriter(path, fields, compression="zst")
+  elif format == "jsonl":
+    return JSONLWriter(path, fields)
+  elif format == "parquet":
+    return ParquetWriter(path, fields)
+  else:
+    raise ValueError(f"unknown output format: {format}")
+
+
+def read_rows(base_path, format=DEFAULT_FORMAT):
+  """
+  Yields the rows of a file written by open_writer as dicts. Values come
+  back as the format stores them: strings from csv, typed from jsonl and
+  parquet.
+  """
+
+  path = output_path(base_path, format)
+
+  if format == "parquet":
+    if pyarrow is None:
+      raise missing_dependency("pyarrow", "parquet", "parquet input")
+    yield from pyarrow.parquet.read_table(path).to_pylist()
+    return
+
+  if format == "jsonl":
+    with open(path) as f:
+      for line in f:
+        yield json.loads(line)
+    return
+
+  if format == "csv":
+    f = open(path, newline='')
+  elif format == "csv.gz":
+    f = gzip.open(path, 'rt', newline='')
+  elif format == "csv.zst":
+    if zstandard is None:
+      raise missing_dependency("zstandard", "zstd", "csv.zst input")
+    stream = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'),
+                                                        closefd=True)
+    f = io.TextIOWrapper(stream, newline='', encoding='utf-8')
+  else:
+    raise ValueError(f"unknown output format: {format}")
+
+  with f:
+    yield from csv.DictReader(f)